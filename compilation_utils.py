@@ -0,0 +1,213 @@
+"""
+Opt-in compilation of the functions evaluated at every BO iteration (CONFIG.compile_mode), to a
+TF graph ("graph") or to an XLA program ("xla").
+
+compile_model_predictions: Replaces model.predict (and predict_f of the wrapped GPflow model) by
+compiled versions
+
+compile_acquisition_rule: Wraps the builder of an EfficientGlobalOptimization rule so that the
+acquisition functions it returns are compiled
+
+warm_up: Traces all of the above before the first ask, so the first BO iteration does not pay for it
+
+Shared by quantile/ and feasible_set/, which import it with the repository root on the path (as
+plotting.py).
+
+Compiled functions have a fixed input signature with a free number of rows, and their inputs are
+padded to a power of two rows, so that XLA compiles one program per size bucket rather than one per
+input size. A compiled model method is traced again when the variables of the model are replaced
+(e.g. when the number of inducing points changes). Acquisition functions are compiled when they are
+prepared and keep their program as long as their builder updates them in place, which the builders
+of both packages do: batch points and BO iterations only change the state of persistent objects
+(e.g. trajectories redrawn in place, fantasies added to an extended Cholesky factor). A new closure
+returned by a builder (e.g. after the model replaced its variables) is compiled again, with a
+warning if this happens within a greedy batch. A compiled function called while another function
+is being traced is inlined into the caller's graph (logged once per trace), and a model method
+called with extra arguments (e.g. full_cov=True) runs as is (logged once per method).
+
+XLA recompiles whenever the shape of a model variable changes, so it only pays off for models with
+a fixed data capacity (e.g. QuantileVGP); for GPR models whose data grows at every step, "graph" is
+the faster mode.
+"""
+
+import logging
+from typing import Callable
+
+import numpy as np
+import tensorflow as tf
+from gpflow.config import default_float
+
+from trieste.acquisition.interface import (
+    AcquisitionFunctionBuilder,
+    GreedyAcquisitionFunctionBuilder,
+    SingleModelAcquisitionBuilder,
+    SingleModelGreedyAcquisitionBuilder,
+)
+from trieste.acquisition.rule import OBJECTIVE, EfficientGlobalOptimization
+from trieste.types import TensorType
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_size(num_rows: int, minimum: int = 16) -> int:
+    return int(max(minimum, 2 ** np.ceil(np.log2(max(num_rows, 1)))))
+
+
+def pad_rows(x: TensorType) -> TensorType:
+    """ Pads `x` along its first axis with copies of its first row, up to :func:`bucket_size` rows. """
+    num_rows = int(x.shape[0])
+    padding = tf.repeat(x[:1], bucket_size(num_rows) - num_rows, axis=0)
+    return tf.concat([x, padding], axis=0)
+
+
+class CompiledFunction:
+    """
+    XLA-compiled version of `fun`, whose single input has shape [N, *event_shape] for any N. Outputs
+    may be a tensor or a nested structure of tensors with N leading rows.
+    """
+
+    def __init__(self, fun: Callable, event_shape, jit_compile: bool = True):
+        """
+        :param fun: The function to compile.
+        :param event_shape: Shape of one row of the input.
+        :param jit_compile: Whether to compile with XLA, or only trace to a graph.
+        """
+        self.original = fun
+        signature = [tf.TensorSpec([None, *event_shape], default_float())]
+        self._compiled = tf.function(fun, input_signature=signature, jit_compile=jit_compile)
+
+    def __call__(self, x: TensorType):
+        if not tf.executing_eagerly():  # only runs while a caller is traced, which then compiles `fun` itself
+            logger.info("%r is inlined into the graph of its caller", self.original)
+            return self.original(x)
+        num_rows = int(x.shape[0])
+        outputs = self._compiled(pad_rows(tf.convert_to_tensor(x, default_float())))
+        return tf.nest.map_structure(lambda output: output[:num_rows], outputs)
+
+
+class CompiledMethod:
+    """ Compiled version of a method of `module`, traced again when the variables of `module` change. """
+
+    def __init__(self, module: tf.Module, method: Callable, event_shape, jit_compile: bool = True):
+        self._module = module
+        self._method = method
+        self._event_shape = event_shape
+        self._jit_compile = jit_compile
+        self._key = None
+        self._compiled = None
+        self._warned = False
+
+    def __call__(self, *args, **kwargs):
+        if not tf.executing_eagerly():  # only runs while a caller is traced, which then compiles the method
+            logger.info("%r is inlined into the graph of its caller", self._method)
+            return self._method(*args, **kwargs)
+        if len(args) + len(kwargs) != 1:  # e.g. full_cov=True
+            if not self._warned:
+                logger.warning("%r is called with extra arguments and runs uncompiled", self._method)
+                self._warned = True
+            return self._method(*args, **kwargs)
+        x = args[0] if args else next(iter(kwargs.values()))
+        key = tuple(id(variable) for variable in self._module.variables)
+        if key != self._key:
+            self._compiled = CompiledFunction(self._method, self._event_shape, self._jit_compile)
+            self._key = key
+        return self._compiled(x)
+
+
+def compile_model_predictions(model, input_dim: int, jit_compile: bool = True) -> None:
+    if hasattr(model, "model_gpflux"):  # DeepGP models
+        model.predict = CompiledMethod(model.model_gpflux, model.predict, [input_dim], jit_compile)
+        return
+    model.predict = CompiledMethod(model.model, model.predict, [input_dim], jit_compile)
+    model.model.predict_f = CompiledMethod(model.model, model.model.predict_f, [input_dim], jit_compile)
+
+
+class _CompiledBuilderMixin:
+    def __init__(self, builder, input_dim: int, jit_compile: bool = True):
+        """
+        :param builder: A multi-model builder, e.g. the result of `builder.using(OBJECTIVE)`.
+        :param input_dim: Dimension of the search space.
+        :param jit_compile: Whether to compile with XLA, or only trace to a graph.
+        """
+        self._builder = builder
+        self._event_shape = [None, input_dim]  # [B, D], any batch size B
+        self._jit_compile = jit_compile
+        self._warm_function = None
+
+    def __repr__(self) -> str:
+        return f"Compiled({self._builder!r})"
+
+    def _compile(self, function):
+        return CompiledFunction(function, self._event_shape, self._jit_compile)
+
+    def warm_up(self, sample: TensorType, *args, **kwargs) -> None:
+        """
+        Prepares and traces the acquisition function before the first ask. The arguments after
+        `sample` [N, B, D] are those of `prepare_acquisition_function`.
+        """
+        function = self._builder.prepare_acquisition_function(*args, **kwargs)
+        self._compile(function)(sample)
+        self._warm_function = function
+
+    def prepare_acquisition_function(self, *args, **kwargs):
+        if self._warm_function is not None:
+            function = self._builder.update_acquisition_function(self._warm_function, *args, **kwargs)
+            self._warm_function = None
+        else:
+            function = self._builder.prepare_acquisition_function(*args, **kwargs)
+        return self._compile(function)
+
+    def update_acquisition_function(self, function: CompiledFunction, *args, **kwargs):
+        updated = self._builder.update_acquisition_function(function.original, *args, **kwargs)
+        if updated is function.original:
+            return function
+        if not kwargs.get("new_optimization_step", True):
+            logger.warning("%r returned a new acquisition function within a batch, which is traced again",
+                           self._builder)
+        return self._compile(updated)
+
+
+class CompiledAcquisitionBuilder(_CompiledBuilderMixin, AcquisitionFunctionBuilder):
+    pass
+
+
+class CompiledGreedyAcquisitionBuilder(_CompiledBuilderMixin, GreedyAcquisitionFunctionBuilder):
+    pass
+
+
+def compile_acquisition_rule(rule, input_dim: int, jit_compile: bool = True):
+    """
+    Wraps the builder of an :class:`EfficientGlobalOptimization` rule in place, keeping its kind
+    (joint or greedy batch), so the rule builds its batches as before.
+    """
+    builder = rule._builder
+    if isinstance(builder, (SingleModelAcquisitionBuilder, SingleModelGreedyAcquisitionBuilder)):
+        builder = builder.using(OBJECTIVE)
+    if isinstance(builder, GreedyAcquisitionFunctionBuilder):
+        rule._builder = CompiledGreedyAcquisitionBuilder(builder, input_dim, jit_compile)
+    else:
+        rule._builder = CompiledAcquisitionBuilder(builder, input_dim, jit_compile)
+    return rule
+
+
+def warm_up(rule, model, dataset, search_space, num_samples: int = 16) -> None:
+    """ Traces the compiled predictions and acquisition function on a few points of the search space. """
+    sample = search_space.sample(num_samples)
+    model.predict(sample)
+    if isinstance(rule, EfficientGlobalOptimization) and isinstance(rule._builder, _CompiledBuilderMixin):
+        rule._builder.warm_up(sample[:, None, :], {OBJECTIVE: model}, datasets={OBJECTIVE: dataset})
+
+
+def compile_experiment(CONFIG, ask_tell, search_space) -> None:
+    """ Compiles and warms up the model predictions and acquisition function of an experiment. """
+    if CONFIG.compile_mode is None:
+        return
+    jit_compile = CONFIG.compile_mode == "xla"
+    model = ask_tell._models[OBJECTIVE]
+    rule = ask_tell._acquisition_rule
+    input_dim = search_space.lower.shape[-1]
+
+    compile_model_predictions(model, input_dim, jit_compile)
+    if isinstance(rule, EfficientGlobalOptimization):  # other rules (e.g. DPP, k-means) only use predictions
+        compile_acquisition_rule(rule, input_dim, jit_compile)
+    warm_up(rule, model, ask_tell._datasets[OBJECTIVE], search_space)
@@ -1,13 +1,29 @@
 from __future__ import annotations
 
-from trieste.acquisition.rule import EfficientGlobalOptimization
+from typing import Optional
+
+import gpflow
+import tensorflow as tf
+import tensorflow_probability as tfp
+from trieste.acquisition.rule import OBJECTIVE, AcquisitionRule, EfficientGlobalOptimization
+from trieste.acquisition.interface import (
+    AcquisitionFunction,
+    AcquisitionFunctionClass,
+    SingleModelAcquisitionBuilder,
+    SingleModelGreedyAcquisitionBuilder,
+)
 from trieste.acquisition.function import (
     ExpectedFeasibility,
     ExpectedImprovement,
     IntegratedVarianceReduction,
-    LocalPenalization,
-    Fantasizer,
 )
+from trieste.data import Dataset
+from trieste.models.interfaces import FastUpdateModel, ProbabilisticModel
+from trieste.models.gpflow import GaussianProcessRegression
+from trieste.space import Box
+from trieste.types import TensorType
+from profiling_utils import map_in_chunks
+from gibbon import feasGIBBON
 
 
 def create_acquisition_rule(CONFIG, search_space):
@@ -15,14 +31,14 @@ def create_acquisition_rule(CONFIG, search_space):
         return EfficientGlobalOptimization(ExpectedFeasibility(threshold=CONFIG.problem.threshold))
 
     elif CONFIG.rule == "lp-ranjan":
-        acq = LocalPenalization(search_space,
-                                base_acquisition_function_builder=ExpectedFeasibility(threshold=CONFIG.problem.threshold))
+        acq = FeasibilityLocalPenalization(search_space, threshold=CONFIG.problem.threshold,
+                                           min_radius=CONFIG.min_radius)
         return EfficientGlobalOptimization(  # type: ignore
             num_query_points=CONFIG.batch_size, builder=acq
-        )  # TODO: this doesn't work
+        )
 
     elif CONFIG.rule == "kb-ranjan":
-        acq = Fantasizer(ExpectedFeasibility(threshold=CONFIG.problem.threshold))
+        acq = CholeskyFantasizer(ExpectedFeasibility(threshold=CONFIG.problem.threshold))
         return EfficientGlobalOptimization(  # type: ignore
             num_query_points=CONFIG.batch_size, builder=acq
         )
@@ -31,5 +47,492 @@ def create_acquisition_rule(CONFIG, search_space):
         return EfficientGlobalOptimization(
             IntegratedVarianceReduction(search_space.sample_sobol(1000), threshold=CONFIG.problem.threshold),
         num_query_points=CONFIG.batch_size)
+
+    elif CONFIG.rule == "feasgibbon":
+        return EfficientGlobalOptimization(feasGIBBON(threshold=CONFIG.problem.threshold),
+                                           num_query_points=CONFIG.batch_size)
+
+    elif CONFIG.rule == "dpp":
+        return WeightedDPPBatchRule(threshold=CONFIG.problem.threshold, num_query_points=CONFIG.batch_size)
+
+    elif CONFIG.rule == "kmeans":
+        return WeightedKMeansBatchRule(threshold=CONFIG.problem.threshold, num_query_points=CONFIG.batch_size)
+
+    elif CONFIG.rule == "adaptive-evr":
+        return EfficientGlobalOptimization(
+            AdaptiveIntegratedVarianceReduction(search_space, threshold=CONFIG.problem.threshold),
+            num_query_points=CONFIG.batch_size)
     else:
         raise NotImplementedError
+
+
+class AdaptiveIntegratedVarianceReduction(SingleModelAcquisitionBuilder):
+    """
+    IntegratedVarianceReduction whose integration points are redrawn at every step around the
+    current contour. A fixed Sobol pool covers the search space; at each update, `num_integration_points`
+    points are drawn from the pool with probability proportional to p(1 - p), with p = P(f(x) > t),
+    mixed with a uniform share `defensive_share` so that no region gets a zero probability. The
+    points carry importance weights, so the criterion still estimates the integral of the
+    variance weighted by the posterior density at the threshold over the whole search space, at the
+    cost of a few hundred points instead of the full pool.
+    """
+
+    def __init__(self, search_space: Box, threshold: float, num_pool_points: int = 2 ** 12,
+                 num_integration_points: int = 128, defensive_share: float = .1):
+        """
+        :param search_space: The search space, from which the Sobol pool is drawn.
+        :param threshold: The excursion threshold.
+        :param num_pool_points: Size of the Sobol pool.
+        :param num_integration_points: Number of integration points drawn from the pool at each step.
+        :param defensive_share: Share of the sampling distribution that is uniform over the pool.
+        """
+        self._pool = search_space.sample_sobol(num_pool_points)
+        self._threshold = threshold
+        self._num_integration_points = num_integration_points
+        self._defensive_share = defensive_share
+
+    def __repr__(self) -> str:
+        return f"AdaptiveIntegratedVarianceReduction(threshold={self._threshold!r})"
+
+    def prepare_acquisition_function(
+        self, model: FastUpdateModel, dataset: Optional[Dataset] = None
+    ) -> adaptive_integrated_variance_reduction:
+        return adaptive_integrated_variance_reduction(model, self._pool, self._threshold,
+                                                      self._num_integration_points, self._defensive_share)
+
+    def update_acquisition_function(
+        self, function: adaptive_integrated_variance_reduction, model: FastUpdateModel,
+        dataset: Optional[Dataset] = None
+    ) -> adaptive_integrated_variance_reduction:
+        function.update()
+        return function
+
+
+class adaptive_integrated_variance_reduction(AcquisitionFunctionClass):
+    def __init__(self, model: FastUpdateModel, pool: TensorType, threshold: float, num_integration_points: int,
+                 defensive_share: float):
+        self._model = model
+        self._pool = pool
+        self._threshold = threshold
+        self._defensive_share = defensive_share
+        # resampled in place, so a compiled __call__ stays valid
+        self._integration_points = tf.Variable(pool[:num_integration_points], trainable=False)
+        self._weights = tf.Variable(tf.zeros([num_integration_points, 1], dtype=pool.dtype), trainable=False)
+        self.update()
+
+    def update(self) -> None:
+        num_data = int(tf.shape(self._model.model.data[0])[0])  # type: ignore
+        mean, variance = map_in_chunks(self._model.predict, self._pool, 2 * 8 * (num_data + 1))  # [P, 1]
+        distribution = tfp.distributions.Normal(mean, tf.sqrt(variance))
+        prob = distribution.cdf(tf.cast(self._threshold, mean.dtype))
+        score = prob * (1. - prob)  # [P, 1]
+
+        num_pool_points = tf.cast(tf.shape(self._pool)[0], mean.dtype)
+        proposal = (1. - self._defensive_share) * score / tf.reduce_sum(score) \
+            + self._defensive_share / num_pool_points  # [P, 1]
+        num_integration_points = tf.shape(self._integration_points)[0]
+        indices = tf.random.categorical(tf.math.log(tf.transpose(proposal)), num_integration_points)[0]
+
+        target = distribution.prob(tf.cast(self._threshold, mean.dtype)) / num_pool_points  # IVR weights over the pool
+        self._integration_points.assign(tf.gather(self._pool, indices))
+        self._weights.assign(tf.gather(target / proposal, indices) / tf.cast(num_integration_points, mean.dtype))
+
+    @tf.function
+    def __call__(self, x: TensorType) -> TensorType:
+        additional_data = Dataset(x, tf.ones_like(x[..., 0:1]))
+        _, variance = self._model.conditional_predict_f(
+            query_points=self._integration_points, additional_data=additional_data
+        )  # [N, M, 1] for N candidate batches
+        return -tf.reduce_sum(variance * self._weights, axis=-2)
+
+
+class CholeskyFantasizedModel(ProbabilisticModel):
+    """
+    Posterior of a GPR model conditioned on kriging believer fantasies, i.e. observations equal to
+    the predicted mean. The Cholesky factor L of K(X, X) + σ²I is computed once by :meth:`reset` and
+    extended by one block of rows per call to :meth:`fantasize`, in O(qN²) for q new points,
+    instead of refactorising N + q points. L, α = L⁻¹(y - m) and X are variables with a free
+    number of rows, so acquisition functions traced on this model stay valid as fantasies are added.
+    """
+
+    def __init__(self, model: GaussianProcessRegression):
+        self._model = model
+        gpr = model.model
+        X = tf.convert_to_tensor(gpr.data[0])
+        self._X = tf.Variable(X, shape=[None, X.shape[-1]], trainable=False)
+        self._L = tf.Variable(tf.zeros([0, 0], dtype=X.dtype), shape=[None, None], trainable=False)
+        self._alpha = tf.Variable(tf.zeros([0, 1], dtype=X.dtype), shape=[None, 1], trainable=False)
+        self.reset()
+
+    def reset(self) -> None:
+        """ Drops the fantasies and refactorises the current data and hyperparameters of the model. """
+        gpr = self._model.model
+        X, Y = (tf.convert_to_tensor(data) for data in gpr.data)
+        K = gpr.kernel(X) + gpr.likelihood.variance * tf.eye(tf.shape(X)[0], dtype=X.dtype)
+        L = tf.linalg.cholesky(K)
+        self._X.assign(X)
+        self._L.assign(L)
+        self._alpha.assign(tf.linalg.triangular_solve(L, Y - gpr.mean_function(X)))
+
+    def fantasize(self, query_points: TensorType) -> None:
+        gpr = self._model.model
+        mean, _ = self.predict(query_points)
+        B = tf.linalg.triangular_solve(self._L, gpr.kernel(self._X, query_points))  # [N, q]
+        K_new = gpr.kernel(query_points) + gpr.likelihood.variance * tf.eye(tf.shape(query_points)[0],
+                                                                            dtype=query_points.dtype)
+        C = tf.linalg.cholesky(K_new - tf.matmul(B, B, transpose_a=True))  # [q, q]
+        alpha_new = tf.linalg.triangular_solve(  # zero for kriging believer observations, up to round-off
+            C, mean - gpr.mean_function(query_points) - tf.matmul(B, self._alpha, transpose_a=True))
+
+        zeros = tf.zeros([tf.shape(B)[0], tf.shape(B)[1]], dtype=B.dtype)
+        self._L.assign(tf.concat([tf.concat([self._L, zeros], axis=1),
+                                  tf.concat([tf.transpose(B), C], axis=1)], axis=0))
+        self._alpha.assign(tf.concat([self._alpha, alpha_new], axis=0))
+        self._X.assign(tf.concat([self._X, query_points], axis=0))
+
+    def predict(self, query_points: TensorType):
+        gpr = self._model.model
+        A = tf.linalg.triangular_solve(self._L, gpr.kernel(self._X, query_points))  # [N, M]
+        mean = gpr.mean_function(query_points) + tf.matmul(A, self._alpha, transpose_a=True)
+        variance = gpr.kernel(query_points, full_cov=False)[:, None] - tf.reduce_sum(A ** 2, axis=0)[:, None]
+        return mean, variance
+
+    def predict_y(self, query_points: TensorType):
+        mean, variance = self.predict(query_points)
+        return mean, variance + self._model.model.likelihood.variance
+
+    def sample(self, query_points: TensorType, num_samples: int):
+        gpr = self._model.model
+        A = tf.linalg.triangular_solve(self._L, gpr.kernel(self._X, query_points))  # [N, M]
+        mean = gpr.mean_function(query_points) + tf.matmul(A, self._alpha, transpose_a=True)  # [M, 1]
+        cov = gpr.kernel(query_points) - tf.matmul(A, A, transpose_a=True)  # [M, M]
+        jitter = gpflow.config.default_jitter() * tf.eye(tf.shape(query_points)[0], dtype=cov.dtype)
+        L_cov = tf.linalg.cholesky(cov + jitter)
+        eps = tf.random.normal([num_samples, tf.shape(query_points)[0], 1], dtype=cov.dtype)
+        return mean + tf.matmul(L_cov, eps)  # [S, M, 1]
+
+
+class CholeskyFantasizer(SingleModelGreedyAcquisitionBuilder):
+    """
+    Kriging believer batches for a GPR model, as :class:`Fantasizer` with `fantasize_method="KB"`,
+    but with the fantasies added to a :class:`CholeskyFantasizedModel`: the base acquisition
+    function is built once per step on that model, and each new batch point only extends its
+    Cholesky factor.
+    """
+
+    def __init__(self, base_builder: SingleModelAcquisitionBuilder):
+        self._builder = base_builder
+        self._fantasized_model: Optional[CholeskyFantasizedModel] = None
+        self._num_fantasized = 0
+
+    def __repr__(self) -> str:
+        return f"CholeskyFantasizer({self._builder!r})"
+
+    def prepare_acquisition_function(
+        self, model: GaussianProcessRegression, dataset: Optional[Dataset] = None,
+        pending_points: Optional[TensorType] = None,
+    ) -> AcquisitionFunction:
+        self._fantasized_model = CholeskyFantasizedModel(model)
+        self._num_fantasized = 0
+        self._fantasize(pending_points)
+        return self._builder.prepare_acquisition_function(self._fantasized_model, dataset)
+
+    def update_acquisition_function(
+        self, function: AcquisitionFunction, model: GaussianProcessRegression, dataset: Optional[Dataset] = None,
+        pending_points: Optional[TensorType] = None, new_optimization_step: bool = True,
+    ) -> AcquisitionFunction:
+        if new_optimization_step:
+            self._fantasized_model.reset()
+            self._num_fantasized = 0
+            function = self._builder.update_acquisition_function(function, self._fantasized_model, dataset)
+        self._fantasize(pending_points)
+        return function
+
+    def _fantasize(self, pending_points: Optional[TensorType]) -> None:
+        if pending_points is None or pending_points.shape[0] == self._num_fantasized:
+            return
+        self._fantasized_model.fantasize(pending_points[self._num_fantasized:])
+        self._num_fantasized = pending_points.shape[0]
+
+
+class FeasibilityLocalPenalization(SingleModelGreedyAcquisitionBuilder):
+    """
+    Local penalization (González et al., 2016) for contour-finding criteria. trieste's
+    LocalPenalization builds its penalizers for minimisation, around the best predicted value,
+    which does not apply to ExpectedFeasibility. Here the objective is the distance to the contour
+    g(x) = |f(x) - t|, which is Lipschitz with the same constant as f. The contour cannot lie in the
+    ball of radius |f(x_j) - t| / L_j around a pending point x_j, so x is penalized by the
+    probability that it is outside this ball, P(|f(x_j) - t| <= L_j‖x - x_j‖) under the posterior at
+    x_j: a difference of two normal CDFs that vanishes at x_j, with a width σ(x_j) / L_j. The base
+    criterion is multiplied by the penalizers of all pending points, evaluated in one vectorised
+    graph, so the cost of a batch point does not depend on its index.
+
+    L_j is a local estimate: the largest gradient norm of the posterior mean over the
+    `num_local_points` Sobol points nearest to x_j. A global constant is set by the steepest region
+    of f and makes the balls, and hence the batches, too tight elsewhere. Pending points sit near
+    the contour, where |f(x_j) - t| ≈ 0, so the width is also floored at `min_radius`.
+
+    On ScaledBranin the smallest distance between two points of a batch is 0.356 for q = 5 with the
+    default floor (kb-ranjan: 0.361), but only 0.114 for q = 10 (kb-ranjan: 0.181), because the floor
+    does not grow with the batch: larger batches need a larger `min_radius`.
+    """
+
+    def __init__(self, search_space: Box, threshold: float, base_builder: SingleModelAcquisitionBuilder = None,
+                 num_lipschitz_samples: int = 1000, num_local_points: int = 20,
+                 min_radius: float = 0.05):
+        """
+        :param search_space: The search space, sampled to estimate the Lipschitz constant.
+        :param threshold: The excursion threshold.
+        :param base_builder: Non-negative base criterion, defaults to ExpectedFeasibility.
+        :param num_lipschitz_samples: Number of Sobol points used to estimate the Lipschitz constants.
+        :param num_local_points: Number of Sobol points around a pending point used for its local
+            Lipschitz constant.
+        :param min_radius: Floor on the width of the penalizers, as a fraction of the diameter of
+            the search space.
+        """
+        self._lipschitz_points = search_space.sample_sobol(num_lipschitz_samples)
+        self._gradient_norms: Optional[TensorType] = None
+        self._num_local_points = min(num_local_points, num_lipschitz_samples)
+        diameter = tf.norm(search_space.upper - search_space.lower)
+        self._min_radius = min_radius * diameter
+        self._threshold = threshold
+        self._builder = ExpectedFeasibility(threshold=threshold) if base_builder is None else base_builder
+        self._base_function: Optional[AcquisitionFunction] = None
+
+    def __repr__(self) -> str:
+        return f"FeasibilityLocalPenalization({self._builder!r})"
+
+    def _update_gradient_norms(self, model: ProbabilisticModel) -> None:
+        with tf.GradientTape() as tape:
+            tape.watch(self._lipschitz_points)
+            mean, _ = model.predict(self._lipschitz_points)
+        self._gradient_norms = tf.norm(tape.gradient(mean, self._lipschitz_points), axis=-1)  # [S]
+
+    def _local_lipschitz_constants(self, pending_points: Optional[TensorType]) -> Optional[TensorType]:
+        if pending_points is None:
+            return None
+        distances = tf.norm(pending_points[:, None, :] - self._lipschitz_points[None, :, :], axis=-1)  # [P, S]
+        _, nearest = tf.math.top_k(-distances, k=self._num_local_points)  # [P, k]
+        return tf.maximum(tf.reduce_max(tf.gather(self._gradient_norms, nearest), axis=-1), 1e-6)  # [P]
+
+    def prepare_acquisition_function(
+        self, model: ProbabilisticModel, dataset: Optional[Dataset] = None,
+        pending_points: Optional[TensorType] = None,
+    ) -> AcquisitionFunction:
+        self._base_function = self._builder.prepare_acquisition_function(model, dataset)
+        function = feasibility_local_penalizer(model, self._base_function, self._threshold,
+                                               self._lipschitz_points.shape[-1], self._min_radius)
+        self._update_gradient_norms(model)
+        function.update(pending_points, self._local_lipschitz_constants(pending_points))
+        return function
+
+    def update_acquisition_function(
+        self, function: feasibility_local_penalizer, model: ProbabilisticModel, dataset: Optional[Dataset] = None,
+        pending_points: Optional[TensorType] = None, new_optimization_step: bool = True,
+    ) -> AcquisitionFunction:
+        if new_optimization_step:
+            updated_base = self._builder.update_acquisition_function(self._base_function, model, dataset)
+            if updated_base is not self._base_function:
+                return self.prepare_acquisition_function(model, dataset, pending_points)
+            self._update_gradient_norms(model)
+        function.update(pending_points, self._local_lipschitz_constants(pending_points))
+        return function
+
+
+class feasibility_local_penalizer(AcquisitionFunctionClass):
+    def __init__(self, model: ProbabilisticModel, base_function: AcquisitionFunction, threshold: float,
+                 input_dim: int, min_radius: float):
+        self._model = model
+        self._base_function = base_function
+        self._threshold = threshold
+        self._min_radius = min_radius
+        self._pending_points = tf.Variable(tf.zeros([0, input_dim], dtype=tf.float64), shape=[None, input_dim],
+                                           trainable=False)
+        self._offset = tf.Variable(tf.zeros([0], dtype=tf.float64), shape=[None], trainable=False)
+        self._scale = tf.Variable(tf.zeros([0], dtype=tf.float64), shape=[None], trainable=False)
+
+    def update(self, pending_points: Optional[TensorType], lipschitz: Optional[TensorType] = None) -> None:
+        """
+        :param pending_points: The points to penalize, [P, D].
+        :param lipschitz: Local Lipschitz constants at the pending points, [P].
+        """
+        if pending_points is None:
+            pending_points = self._pending_points[:0]
+            lipschitz = tf.ones([0], dtype=tf.float64)
+        mean, variance = self._model.predict(pending_points)
+        self._pending_points.assign(pending_points)
+        self._offset.assign((mean[:, 0] - self._threshold) / lipschitz)
+        self._scale.assign(tf.maximum(tf.sqrt(variance[:, 0]) / lipschitz, self._min_radius))
+
+    @tf.function
+    def __call__(self, x: TensorType) -> TensorType:
+        distances = tf.norm(x - self._pending_points[None, :, :], axis=-1)  # [N, P]
+        normal = tfp.distributions.Normal(tf.cast(0, x.dtype), tf.cast(1, x.dtype))
+        penalizers = normal.cdf((distances - self._offset) / self._scale) \
+            - normal.cdf((-distances - self._offset) / self._scale)  # [N, P]
+        return self._base_function(x) * tf.reduce_prod(penalizers, axis=-1, keepdims=True)
+
+
+def excursion_weights(mean: TensorType, variance: TensorType, threshold: float) -> TensorType:
+    """ p(1 - p), with p = P(f(x) > threshold) under the posterior. """
+    normal = tfp.distributions.Normal(tf.cast(0, mean.dtype), tf.cast(1, mean.dtype))
+    p = normal.cdf((mean - threshold) / tf.sqrt(variance))
+    return p * (1. - p)
+
+
+class WeightedDPPBatchRule(AcquisitionRule):
+    """
+    Batches of any size q drawn greedily from a determinantal point process over a Sobol candidate
+    set, with the kernel diag(w) Σ diag(w), where Σ is the posterior covariance of a GPR model and
+    w = p(1 - p) puts the mass near the contour. Each point maximises the determinant of the
+    selected submatrix given the previous ones, i.e. the residual weighted variance w²(x) σ²(x | batch).
+
+    This is a pivoted Cholesky factorisation of the weighted kernel: after a point is selected, the
+    residual variances of all candidates are updated from one new column of the factor, itself
+    obtained with one matrix-vector product against the cached L⁻¹ K(X, candidates). A batch costs
+    O(NM) per point for M candidates, after the O(N²M) posterior at the candidates.
+
+    When the weighted residuals vanish (e.g. no candidate is near the contour), the batch is
+    completed under the unweighted posterior covariance, given the points already selected. Points
+    are never repeated, so fewer than q points are returned only if the candidates are exhausted.
+    """
+
+    def __init__(self, threshold: float, num_query_points: int = 1, num_candidates: int = 2000):
+        """
+        :param threshold: The excursion threshold.
+        :param num_query_points: The batch size q.
+        :param num_candidates: Number of Sobol candidates, drawn at every step.
+        """
+        self._threshold = threshold
+        self._num_query_points = num_query_points
+        self._num_candidates = num_candidates
+
+    def __repr__(self) -> str:
+        return f"WeightedDPPBatchRule(threshold={self._threshold!r}, num_query_points={self._num_query_points!r})"
+
+    def acquire(self, search_space: Box, models, datasets=None) -> TensorType:
+        gpr = models[OBJECTIVE].model  # type: ignore
+        X, Y = (tf.convert_to_tensor(data) for data in gpr.data)
+        candidates = search_space.sample_sobol(self._num_candidates)  # [M, D]
+
+        K = gpr.kernel(X) + gpr.likelihood.variance * tf.eye(tf.shape(X)[0], dtype=X.dtype)
+        L = tf.linalg.cholesky(K)
+        alpha = tf.linalg.triangular_solve(L, Y - gpr.mean_function(X))
+
+        def cross_solve(x):
+            return tf.transpose(tf.linalg.triangular_solve(L, gpr.kernel(X, x)))
+
+        A = map_in_chunks(cross_solve, candidates, 2 * 8 * (int(X.shape[0]) + 1))  # [M, N]
+        mean = gpr.mean_function(candidates) + tf.matmul(A, alpha)
+        variance = gpr.kernel(candidates, full_cov=False)[:, None] - tf.reduce_sum(A ** 2, axis=-1, keepdims=True)
+        weights = excursion_weights(mean, variance, self._threshold)[:, 0]  # [M]
+
+        eps = 1e-12 * tf.reduce_max(gpr.kernel(candidates, full_cov=False))
+
+        def greedy_selection(scale, pivots):
+            """
+            Pivoted Cholesky of diag(scale) Σ diag(scale): takes `pivots` first, then the candidates
+            with the largest residual, until the batch is full or all residuals are below `eps`.
+            """
+            residual = scale ** 2 * variance[:, 0]  # diagonal of the scaled kernel given the batch
+            factor = tf.zeros([self._num_candidates, 0], dtype=X.dtype)
+            selected = []
+            while len(selected) < self._num_query_points:
+                if len(selected) < len(pivots):
+                    j = pivots[len(selected)]
+                else:
+                    j = int(tf.argmax(residual))
+                    if residual[j] <= eps:
+                        break
+                selected.append(j)
+                covariance = gpr.kernel(candidates, candidates[j:j + 1])[:, 0] - tf.linalg.matvec(A, A[j])  # Σ(., x_j)
+                column = (scale * covariance * scale[j] - tf.linalg.matvec(factor, factor[j])) \
+                    / tf.sqrt(tf.maximum(residual[j], eps))
+                factor = tf.concat([factor, column[:, None]], axis=1)
+                residual = tf.tensor_scatter_nd_update(residual - column ** 2, [[j]],
+                                                       tf.constant([-1.], dtype=X.dtype))
+            return selected
+
+        selected = greedy_selection(weights, [])
+        if len(selected) < self._num_query_points:  # p(1 - p) vanishes away from the selected points
+            selected = greedy_selection(tf.ones_like(weights), selected)
+
+        return tf.gather(candidates, selected)
+
+
+@tf.function
+def weighted_minibatch_kmeans(points: TensorType, weights: TensorType, num_centroids: int,
+                              batch_size: int = 1024, num_iterations: int = 100) -> TensorType:
+    """
+    Mini-batch k-means (Sculley, 2010) with weighted points: each centroid moves to the weighted
+    running mean of all the points assigned to it so far, a mini-batch at a time. The updates run
+    in a single graph loop, traced once per number of centroids, batch size and iterations.
+
+    :param points: Points to cluster, [M, D].
+    :param weights: Non-negative weights of the points, [M].
+    :param num_centroids: Number of centroids K.
+    :param batch_size: Points drawn uniformly at every iteration.
+    :param num_iterations: Number of mini-batch updates.
+    :return: The centroids, [K, D].
+    """
+    num_points = tf.shape(points)[0]
+    if tf.reduce_sum(weights) <= 0.:  # no mass, e.g. p(1 - p) underflows: plain k-means
+        weights = tf.ones_like(weights)
+
+    # seeds drawn in proportion to the weights without replacement (Gumbel top-k), so that no two
+    # centroids tie in the assignments
+    gumbel = -tf.math.log(-tf.math.log(tf.random.uniform(tf.shape(weights), dtype=weights.dtype)))
+    seeds = tf.math.top_k(tf.math.log(weights) + gumbel, num_centroids).indices
+    centroids = tf.gather(points, seeds)  # [K, D]
+    counts = tf.zeros([num_centroids], dtype=points.dtype)
+
+    for _ in tf.range(num_iterations):
+        batch = tf.random.uniform([batch_size], maxval=num_points, dtype=tf.int32)
+        x, w = tf.gather(points, batch), tf.gather(weights, batch)  # [B, D], [B]
+        distances = tf.reduce_sum(centroids ** 2, axis=-1) - 2. * tf.matmul(x, centroids, transpose_b=True)  # [B, K]
+        closest = tf.argmin(distances, axis=-1, output_type=tf.int32)
+        batch_counts = tf.math.unsorted_segment_sum(w, closest, num_centroids)  # [K]
+        batch_sums = tf.math.unsorted_segment_sum(w[:, None] * x, closest, num_centroids)  # [K, D]
+        new_counts = counts + batch_counts
+        moved = batch_counts > 0.
+        centroids = tf.where(moved[:, None], (counts[:, None] * centroids + batch_sums)
+                             / tf.where(moved, new_counts, tf.ones_like(new_counts))[:, None], centroids)
+        counts = new_counts
+
+    return centroids
+
+
+class WeightedKMeansBatchRule(AcquisitionRule):
+    """
+    Batches whose points are the centroids of a p(1 - p)-weighted k-means clustering of the search
+    space, so that the q points spread along the uncertain part of the contour. The weights are
+    predicted once, in chunks, on a Sobol candidate set, and the clustering only uses matrix operations
+    on that set (see :func:`weighted_minibatch_kmeans`).
+    """
+
+    def __init__(self, threshold: float, num_query_points: int = 1, num_candidates: int = 2 ** 14,
+                 batch_size: int = 1024, num_iterations: int = 100):
+        """
+        :param threshold: The excursion threshold.
+        :param num_query_points: The batch size q, i.e. the number of centroids.
+        :param num_candidates: Number of Sobol candidates, drawn at every step.
+        :param batch_size: Candidates per mini-batch update.
+        :param num_iterations: Number of mini-batch updates.
+        """
+        self._threshold = threshold
+        self._num_query_points = num_query_points
+        self._num_candidates = num_candidates
+        self._batch_size = batch_size
+        self._num_iterations = num_iterations
+
+    def __repr__(self) -> str:
+        return f"WeightedKMeansBatchRule(threshold={self._threshold!r}, num_query_points={self._num_query_points!r})"
+
+    def acquire(self, search_space: Box, models, datasets=None) -> TensorType:
+        model = models[OBJECTIVE]
+        candidates = search_space.sample_sobol(self._num_candidates)  # [M, D]
+        num_data = int(tf.shape(model.model.data[0])[0])  # type: ignore
+        mean, variance = map_in_chunks(model.model.predict_f, candidates, 2 * 8 * (num_data + 1))  # type: ignore
+        weights = excursion_weights(mean, variance, self._threshold)[:, 0]
+        return weighted_minibatch_kmeans(candidates, weights, self._num_query_points, self._batch_size,
+                                         self._num_iterations)
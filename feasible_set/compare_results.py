@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from glob import glob
 import os
+from profiling_utils import print_timing_summary
 
 
 def plot_regret(regrets: Dict[str, np.ndarray], title: str=None, ylabel="Regret", show_all=False):
@@ -57,6 +58,10 @@ for tag in pb_tags:
                 accuracy_boundary = np.hstack([accuracy_boundary, reg])
             all_accuracy_boundary[exp_name] = accuracy_boundary.T
 
+        all_timing_files = glob(f"{subdir}*timings.npy")
+        if len(all_timing_files) > 0:
+            print_timing_summary(exp_name, [np.load(file=file) for file in all_timing_files])
+
 
     fig = plot_regret(all_accuracy_global, title=tag, ylabel="Global accuracy", show_all=True)
     fig2 = plot_regret(all_accuracy_boundary, title=tag, ylabel="Boundary accuracy", show_all=True)
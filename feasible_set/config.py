@@ -1,4 +1,5 @@
 from problems import get_problem
+from profiling_utils import set_memory_budget
 from dataclasses import dataclass
 import itertools
 import numpy as np
@@ -7,7 +8,7 @@ import numpy as np
 @dataclass
 class CONFIG:
     problem_name:str  # "branin_large_volume" or ....
-    rule: str  # "nobatch-ranjan", "evr",  "lp-ranjan" ["lp-ranjan" doesn't work atm]
+    rule: str  # "nobatch-ranjan", "evr", "adaptive-evr", "kb-ranjan", "lp-ranjan", "feasgibbon", "dpp" or "kmeans"
     problem = None
     seed:int
     budget:int = None
@@ -16,12 +17,19 @@ class CONFIG:
     batch_size:int = 5
     dirName:str = None
     num_initial_points: int = None
+    min_radius:float = 0.05  # "lp-ranjan" only: penalizer width floor, as a fraction of the search space diameter
+    incremental_metrics:bool = False  # rank-q updates of the test-set posterior, only for fixed hyperparameters
+    excursion_metrics:bool = False  # also report QMC volume error, misclassification and Vorob'ev deviation
+    compile_mode:str = None  # None, "graph" or "xla": compile predictions and acquisition functions
+    memory_budget_mb:float = 512.  # per-worker budget used to chunk large tensor ops
+    reset_host_peaks:bool = False  # per-phase host memory peaks through /proc/self/clear_refs (linux)
     results_dir:str = "results"
 
 
-def make_config(args):
+def make_config(args, problem_data=None):
     config = CONFIG(**args)
-    config.problem = get_problem(config.problem_name)
+    set_memory_budget(config.memory_budget_mb)
+    config.problem = get_problem(config.problem_name, **(problem_data or {}))
 
     config.exp_name = f"problem_{config.problem_name}" \
                       f"rule_{config.rule}" \
@@ -36,6 +44,10 @@ def make_config(args):
                       f"_budget_{config.budget_per_dimension}" \
                       f"_batch_{config.batch_size}"
 
+    if config.rule == "lp-ranjan" and config.min_radius != CONFIG.min_radius:
+        config.exp_name += f"_radius_{config.min_radius}"
+        subdir_name += f"_radius_{config.min_radius}"
+
     config.dirName = f"{config.results_dir}/{subdir_name}"
 
     config.num_initial_points = config.initial_budget_per_dimension * config.problem.dim
@@ -0,0 +1,128 @@
+"""
+Excursion-set metrics integrated over the search space with randomised quasi-Monte Carlo.
+
+volume_error: Posterior expected volume of {f > t} minus its true volume, as fractions of the
+search space
+
+misclassification: Volume of the points where the plug-in classification p(x) > 1/2 is wrong
+
+vorobev_deviation: Expected volume of the symmetric difference between the excursion set and its
+Vorob'ev expectation {p >= α*}, where α* matches the volume of {p >= α*} to the expected volume
+
+Every metric is estimated from `num_replicates` independently scrambled Sobol sequences, which
+gives a standard error from the spread between replicates. The expected volume additionally uses
+the true excursion indicator 1{f(x) > t} as a control variate, with its mean (the true volume)
+computed once on a much larger Sobol sample: as the model improves, p(x) becomes strongly
+correlated with it, and most of the integration error cancels. The misclassification and Vorob'ev
+indicators are only large where p(x) and 1{f(x) > t} disagree, which the indicator does not
+predict, so they are plain replicate means.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_probability as tfp
+from scipy.stats import qmc
+
+from trieste.models import TrainableProbabilisticModel
+from profiling_utils import map_in_chunks
+
+EXCURSION_DTYPE = np.dtype([("iteration", np.int64), ("metric", "U32"), ("estimate", np.float64),
+                            ("std_error", np.float64)])
+
+
+def scrambled_sobol(lower, upper, num_points: int, num_replicates: int, rng: np.random.Generator):
+    """ `num_replicates` independently scrambled Sobol point sets, [R, N, D]. """
+    lower, upper = np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64)
+    m = int(np.ceil(np.log2(num_points)))
+    replicates = [qmc.Sobol(lower.shape[-1], scramble=True, seed=rng).random_base2(m)[:num_points]
+                  for _ in range(num_replicates)]
+    return lower + (upper - lower) * np.stack(replicates)
+
+
+def control_variate_estimate(values, control, control_mean):
+    """
+    Control variate estimate with cross-fitted coefficients: the coefficient β applied to a
+    replicate is estimated on the other replicates only, so that it is independent of the samples
+    it corrects. The standard error from the spread of the corrected replicates is then not made
+    optimistic by fitting β to the same samples, up to the (small) correlation between replicates
+    that share the samples used for their coefficients.
+
+    :param values: Integrand at the points of each replicate, [R, N].
+    :param control: Control variate at the same points, [R, N], with R >= 2.
+    :param control_mean: Exact mean of the control variate.
+    :return: Estimate of the mean of `values` and its standard error over replicates.
+    """
+    num_replicates = values.shape[0]
+    estimates = np.empty(num_replicates)
+    for r in range(num_replicates):
+        held_out = np.arange(num_replicates) != r
+        v, c = values[held_out], control[held_out]
+        control_variance = np.var(c)
+        beta = 0. if control_variance == 0. else np.mean((v - v.mean()) * (c - c.mean())) / control_variance
+        estimates[r] = np.mean(values[r] - beta * (control[r] - control_mean))
+    return estimates.mean(), estimates.std(ddof=1) / np.sqrt(num_replicates)
+
+
+def replicate_estimate(values):
+    """ Mean of `values` [R, N] and its standard error from the spread of the R replicate means. """
+    means = values.mean(axis=-1)
+    return means.mean(), means.std(ddof=1) / np.sqrt(values.shape[0])
+
+
+class ExcursionMetrics:
+    def __init__(self, problem, num_points: int = 2 ** 12, num_replicates: int = 8,
+                 num_reference_points: int = 2 ** 20, seed: int = 0):
+        """
+        :param problem: Problem with `fun`, `threshold` and the bounds of the search space.
+        :param num_points: Points per Sobol replicate.
+        :param num_replicates: Number of independent scramblings.
+        :param num_reference_points: Size of the Sobol sample used once to compute the true volume.
+        :param seed: Seed of the scramblings, fixed so that all iterations and runs share the points.
+        """
+        rng = np.random.default_rng(seed)
+        self._threshold = problem.threshold
+        self._points = scrambled_sobol(problem.lower_bounds, problem.upper_bounds, num_points, num_replicates, rng)
+        flat_points = tf.constant(self._points.reshape(-1, self._points.shape[-1]))
+        self._excursion = (np.asarray(problem.fun(flat_points)).reshape(num_replicates, num_points)
+                           > self._threshold).astype(np.float64)  # [R, N]
+
+        reference_points = tf.constant(scrambled_sobol(problem.lower_bounds, problem.upper_bounds,
+                                                       num_reference_points, 1, rng)[0])
+        reference_values = map_in_chunks(problem.fun, reference_points, 8 * 64)
+        self.true_volume = float(np.mean(np.asarray(reference_values) > self._threshold))
+
+    def excursion_probability(self, model: TrainableProbabilisticModel) -> np.ndarray:
+        """ P(f(x) > t) at the integration points, [R, N], predicted in chunks. """
+        num_replicates, num_points, dim = self._points.shape
+        x = tf.constant(self._points.reshape(-1, dim))
+        num_data = int(tf.shape(model.model.data[0])[0])  # type: ignore
+        mean, variance = map_in_chunks(model.model.predict_f, x, 2 * 8 * (num_data + 1))  # type: ignore
+        normal = tfp.distributions.Normal(tf.cast(0, x.dtype), tf.cast(1, x.dtype))
+        prob = normal.cdf((mean - self._threshold) / tf.sqrt(variance))
+        return prob.numpy().reshape(num_replicates, num_points)
+
+    def __call__(self, model: TrainableProbabilisticModel):
+        """ :return: A dict mapping each metric to its (estimate, standard error). """
+        p = self.excursion_probability(model)
+        h, volume = self._excursion, self.true_volume
+
+        expected_volume, std_error = control_variate_estimate(p, h, volume)
+        misclassification = ((p > .5) != (h > .5)).astype(np.float64)
+
+        # Vorob'ev threshold: the volume of {p >= α*} is the expected volume of the excursion set
+        sorted_p = np.sort(p, axis=None)[::-1]
+        num_inside = int(np.round(np.clip(expected_volume, 0., 1.) * sorted_p.size))
+        alpha = sorted_p[num_inside - 1] if num_inside > 0 else np.inf
+        inside = (p >= alpha).astype(np.float64)
+        deviation = p * (1. - inside) + (1. - p) * inside
+
+        return {
+            "volume_error": (expected_volume - volume, std_error),
+            "misclassification": replicate_estimate(misclassification),
+            "vorobev_deviation": replicate_estimate(deviation),
+        }
+
+    def to_records(self, iteration: int, metrics) -> np.ndarray:
+        return np.array([(iteration, name, *values) for name, values in metrics.items()], dtype=EXCURSION_DTYPE)
@@ -1,47 +1,40 @@
-import itertools
+"""
+feasGIBBON: GIBBON-style greedy batches for excursion set estimation.
+
+feasibility_quality_term: Entropy of the excursion indicator 1{f(x) > threshold}
+
+feasibility_repulsion_term: GIBBON repulsion between a candidate and the pending points of the batch,
+0.5 log(1 - ρ²) with ρ² the squared correlation between the candidate observation and the pending
+ones. The Cholesky factor of the covariance of the pending observations is extended by one row per
+new pending point, instead of being refactorised for every evaluation as in trieste's
+gibbon_repulsion_term, so that a batch of q points costs O(q²N) in repulsion updates.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
 import tensorflow as tf
 import tensorflow_probability as tfp
-import matplotlib.pyplot as plt
-import numpy as np
-import trieste
-from trieste.objectives import branin, BRANIN_SEARCH_SPACE
-from trieste.models.gpflow.models import GaussianProcessRegression
-# from ...trieste.notebooks.util.plotting import plot_bo_points, plot_function_2d
-from plotting import plot_function_2d
-import gpflow
-from trieste.acquisition import AcquisitionFunction, SingleModelAcquisitionBuilder, AcquisitionFunctionClass, \
-    GIBBON, SingleModelGreedyAcquisitionBuilder, gibbon_repulsion_term, PenalizationFunction
-from trieste.acquisition.rule import EfficientGlobalOptimization
-from trieste.models import ProbabilisticModel
-from trieste.utils import DEFAULTS
-from typing import Optional, cast
+from trieste.acquisition import AcquisitionFunction, AcquisitionFunctionClass, SingleModelGreedyAcquisitionBuilder
 from trieste.data import Dataset
+from trieste.models import ProbabilisticModel
 from trieste.types import TensorType
-from trieste.space import SearchSpace
 
 
 class feasGIBBON(SingleModelGreedyAcquisitionBuilder[ProbabilisticModel]):
-
-    def __init__(
-        self,
-        search_space: SearchSpace,
-        num_samples: int = 5,
-        grid_size: int = 1000,
-        rescaled_repulsion: bool = True,
-    ):
-
-        tf.debugging.assert_positive(num_samples)
-        tf.debugging.assert_positive(grid_size)
-
-        self._search_space = search_space
-        self._num_samples = num_samples
-        self._grid_size = grid_size
+    def __init__(self, threshold: float, rescaled_repulsion: bool = True):
+        """
+        :param threshold: The excursion threshold.
+        :param rescaled_repulsion: Whether to divide the repulsion by the squared number of pending
+            points, as in trieste's GIBBON, which keeps it commensurate with the quality term.
+        """
+        self._threshold = threshold
         self._rescaled_repulsion = rescaled_repulsion
+        self._repulsion_term: Optional[feasibility_repulsion_term] = None
 
-        self._min_value_samples: Optional[TensorType] = None
-        self._quality_term: Optional[feasibility_quality_term] = None
-        self._diversity_term: Optional[gibbon_repulsion_term] = None
-        self._gibbon_acquisition: Optional[AcquisitionFunction] = None
+    def __repr__(self) -> str:
+        return f"feasGIBBON(threshold={self._threshold!r}, rescaled_repulsion={self._rescaled_repulsion!r})"
 
     def prepare_acquisition_function(
         self,
@@ -49,16 +42,17 @@ class feasGIBBON(SingleModelGreedyAcquisitionBuilder[ProbabilisticModel]):
         dataset: Optional[Dataset] = None,
         pending_points: Optional[TensorType] = None,
     ) -> AcquisitionFunction:
-
         tf.debugging.Assert(dataset is not None, [])
-        dataset = cast(Dataset, dataset)
-        tf.debugging.assert_positive(len(dataset), message="Dataset must be populated.")
+        quality_term = feasibility_quality_term(model, self._threshold)
+        self._repulsion_term = feasibility_repulsion_term(model, dataset.query_points.shape[-1],
+                                                          self._rescaled_repulsion)
+        self._repulsion_term.update(pending_points)
 
-        acq = self._update_quality_term(dataset, model)
-        if pending_points is not None and len(pending_points) != 0:
-            acq = self._update_repulsion_term(acq, dataset, model, pending_points)
+        @tf.function
+        def gibbon_acquisition(x: TensorType) -> TensorType:
+            return quality_term(x) + self._repulsion_term(x)
 
-        return acq
+        return gibbon_acquisition
 
     def update_acquisition_function(
         self,
@@ -68,167 +62,166 @@ class feasGIBBON(SingleModelGreedyAcquisitionBuilder[ProbabilisticModel]):
         pending_points: Optional[TensorType] = None,
         new_optimization_step: bool = True,
     ) -> AcquisitionFunction:
-
-        tf.debugging.Assert(dataset is not None, [])
-        dataset = cast(Dataset, dataset)
-        tf.debugging.assert_positive(len(dataset), message="Dataset must be populated.")
-        tf.debugging.Assert(self._quality_term is not None, [])
-
-        if new_optimization_step:
-            self._update_quality_term(dataset, model)
-
-        if pending_points is None:
-            # no repulsion term required if no pending_points.
-            return cast(AcquisitionFunction, self._quality_term)
-
-        return self._update_repulsion_term(function, dataset, model, pending_points)
-
-    def _update_repulsion_term(
-        self,
-        function: Optional[AcquisitionFunction],
-        dataset: Dataset,
-        model: ProbabilisticModel,
-        pending_points: Optional[TensorType] = None,
-    ) -> AcquisitionFunction:
-        tf.debugging.assert_rank(pending_points, 2)
-
-        if self._gibbon_acquisition is not None and isinstance(
-            self._diversity_term, gibbon_repulsion_term
-        ):
-            # if possible, just update the repulsion term
-            self._diversity_term.update(pending_points)
-            return self._gibbon_acquisition
-        else:
-            # otherwise construct a new repulsion term and acquisition function
-            self._diversity_term = gibbon_repulsion_term(
-                model, pending_points, rescaled_repulsion=self._rescaled_repulsion
-            )
-
-            @tf.function
-            def gibbon_acquisition(x: TensorType) -> TensorType:
-                return cast(PenalizationFunction, self._diversity_term)(x) + cast(
-                    AcquisitionFunction, self._quality_term
-                )(x)
-
-            self._gibbon_acquisition = gibbon_acquisition
-            return gibbon_acquisition
-
-    def _update_quality_term(
-        self, dataset: Dataset, model: ProbabilisticModel
-    ) -> AcquisitionFunction:
-        tf.debugging.assert_positive(len(dataset), message="Dataset must be populated.")
-
-        if self._quality_term is not None:  # if possible, just update the quality term
-            self._quality_term.update(self._min_value_samples)
-        else:  # otherwise build quality term
-            self._quality_term = feasibility_quality_term(model)
-        return cast(AcquisitionFunction, self._quality_term)
+        if new_optimization_step:  # the model has new data or hyperparameters
+            self._repulsion_term.reset()
+        self._repulsion_term.update(pending_points)
+        return function
 
 
 def value_function(mean, var, threshold):
-  normal = tfp.distributions.Normal(tf.cast(0, mean.dtype), tf.cast(1, mean.dtype))
-  threshold = tf.cast(threshold, mean.dtype)
-  t = (mean - threshold) / tf.sqrt(var)
-  p = normal.cdf(t)
-  return - p * tf.math.log(p) - (1. - p) * tf.math.log(1. - p) # (p * (1. - p))
+    normal = tfp.distributions.Normal(tf.cast(0, mean.dtype), tf.cast(1, mean.dtype))
+    threshold = tf.cast(threshold, mean.dtype)
+    t = (mean - threshold) / tf.sqrt(var)
+    p = normal.cdf(t)
+    return - tf.math.xlogy(p, p) - tf.math.xlogy(1. - p, 1. - p)
 
 
 class feasibility_quality_term(AcquisitionFunctionClass):
-    def __init__(self, model: ProbabilisticModel):
-
-        if not hasattr(model, "covariance_between_points"):
-            raise AttributeError(
-                """
-                GIBBON only supports models with a covariance_between_points method.
-                """
-            )
-
+    def __init__(self, model: ProbabilisticModel, threshold: float):
         self._model = model
-        # self._samples = tf.Variable(samples)
-
-    def update(self, samples: TensorType) -> None:
-        pass
-
+        self._threshold = threshold
 
     @tf.function
-    def __call__(self, x: TensorType) -> TensorType:  # [N, D] -> [N, 1]
+    def __call__(self, x: TensorType) -> TensorType:  # [N, 1, D] -> [N, 1]
         tf.debugging.assert_shapes(
             [(x, [..., 1, None])],
             message="This acquisition function only supports batch sizes of one.",
         )
         fmean, fvar = self._model.predict(tf.squeeze(x, -2))
-        return value_function(fmean, fvar, threshold)  # [N, 1]
+        return value_function(fmean, fvar, self._threshold)
 
 
-def build_model(data):
-    variance = tf.math.reduce_variance(data.observations)
-    kernel = gpflow.kernels.Matern52(variance=variance, lengthscales=[0.2, 0.2])
-    prior_scale = tf.cast(1.0, dtype=tf.float64)
-    kernel.variance.prior = tfp.distributions.LogNormal(
-        tf.math.log(variance), prior_scale
-    )
-    kernel.lengthscales.prior = tfp.distributions.LogNormal(
-        tf.math.log(kernel.lengthscales), prior_scale
-    )
-    gpr = gpflow.models.GPR(data.astuple(), kernel, noise_variance=1e-5)
-    gpflow.set_trainable(gpr.likelihood, False)
-
-    return GaussianProcessRegression(gpr)
-
-
-def excursion_probability(x, model, threshold=80.):
-    mean, variance = model.model.predict_f(x)
-    normal = tfp.distributions.Normal(tf.cast(0, x.dtype), tf.cast(1, x.dtype))
-    threshold = tf.cast(threshold, x.dtype)
-    t = (mean - threshold) / tf.sqrt(variance)
-    return normal.cdf(t)
-
-def plot_excursion_probability(title, model, threshold=80.0):
-
-    def objective_function(x):
-        p = excursion_probability(x, model, threshold)
-        # return - p * tf.math.log(p)
-        return p
-        # return (p * (1. - p) )
-
-    _, ax = plot_function_2d(
-        objective_function,
-        search_space.lower - 0.01,
-        search_space.upper + 0.01,
-        grid_density=70,
-        contour=True,
-        colorbar=True,
-        figsize=(10, 6),
-        title=[title],
-        xlabel="$X_1$",
-        ylabel="$X_2$",
-        fill=True,
-    )
-    return ax
+class feasibility_repulsion_term(AcquisitionFunctionClass):
+    def __init__(self, model: ProbabilisticModel, input_dim: int, rescaled_repulsion: bool = True):
+        if not hasattr(model, "covariance_between_points"):
+            raise AttributeError("feasGIBBON only supports models with a covariance_between_points method.")
+
+        self._model = model
+        self._rescaled_repulsion = rescaled_repulsion
+        # pending points and Cholesky factor of their observation covariance, grown in place
+        self._pending_points = tf.Variable(tf.zeros([0, input_dim], dtype=tf.float64), shape=[None, input_dim],
+                                           trainable=False)
+        self._L = tf.Variable(tf.zeros([0, 0], dtype=tf.float64), shape=[None, None], trainable=False)
+
+    def reset(self) -> None:
+        self._pending_points.assign(self._pending_points[:0])
+        self._L.assign(self._L[:0, :0])
+
+    def update(self, pending_points: Optional[TensorType]) -> None:
+        """ Adds the rows of `pending_points` that are not pending yet to the Cholesky factor. """
+        num_pending = int(tf.shape(self._pending_points)[0])
+        if pending_points is None or pending_points.shape[0] == num_pending:
+            return
+        new_points = pending_points[num_pending:]  # [q, D]
+
+        _, new_covariance = self._model.predict_joint(new_points)  # [1, q, q]
+        noise_variance = self._model.get_observation_noise()
+        new_covariance = new_covariance[0] + noise_variance * tf.eye(new_points.shape[0], dtype=new_points.dtype)
+        cross_covariance = self._model.covariance_between_points(self._pending_points, new_points)[0]  # [m, q]
+
+        B = tf.linalg.triangular_solve(self._L, cross_covariance)  # [m, q]
+        C = tf.linalg.cholesky(new_covariance - tf.matmul(B, B, transpose_a=True))  # [q, q]
+        zeros = tf.zeros([num_pending, new_points.shape[0]], dtype=B.dtype)
+        self._L.assign(tf.concat([tf.concat([self._L, zeros], axis=1),
+                                  tf.concat([tf.transpose(B), C], axis=1)], axis=0))
+        self._pending_points.assign(pending_points)
+
+    @tf.function
+    def __call__(self, x: TensorType) -> TensorType:  # [N, 1, D] -> [N, 1]
+        x = tf.squeeze(x, -2)
+        _, fvar = self._model.predict(x)
+        yvar = fvar + self._model.get_observation_noise()  # [N, 1]
+
+        cross_covariance = self._model.covariance_between_points(self._pending_points, x)[0]  # [m, N]
+        L_inv_A = tf.linalg.triangular_solve(self._L, cross_covariance)  # [m, N]
+        V_det = yvar - tf.reduce_sum(L_inv_A ** 2, axis=0)[:, None]  # equation for determinant of block matrices
+        repulsion = 0.5 * (tf.math.log(V_det) - tf.math.log(yvar))
+
+        if self._rescaled_repulsion:
+            batch_size = tf.cast(tf.maximum(tf.shape(self._pending_points)[0], 1), dtype=yvar.dtype)
+            repulsion = repulsion / batch_size ** 2
+        return repulsion
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import gpflow
+    import trieste
+    from trieste.objectives import branin, BRANIN_SEARCH_SPACE
+    from trieste.models.gpflow.models import GaussianProcessRegression
+    from trieste.acquisition.rule import EfficientGlobalOptimization
+    from plotting import plot_function_2d
+
+    def build_model(data):
+        variance = tf.math.reduce_variance(data.observations)
+        kernel = gpflow.kernels.Matern52(variance=variance, lengthscales=[0.2, 0.2])
+        prior_scale = tf.cast(1.0, dtype=tf.float64)
+        kernel.variance.prior = tfp.distributions.LogNormal(
+            tf.math.log(variance), prior_scale
+        )
+        kernel.lengthscales.prior = tfp.distributions.LogNormal(
+            tf.math.log(kernel.lengthscales), prior_scale
+        )
+        gpr = gpflow.models.GPR(data.astuple(), kernel, noise_variance=1e-5)
+        gpflow.set_trainable(gpr.likelihood, False)
+
+        return GaussianProcessRegression(gpr)
+
+
+    def excursion_probability(x, model, threshold=80.):
+        mean, variance = model.model.predict_f(x)
+        normal = tfp.distributions.Normal(tf.cast(0, x.dtype), tf.cast(1, x.dtype))
+        threshold = tf.cast(threshold, x.dtype)
+        t = (mean - threshold) / tf.sqrt(variance)
+        return normal.cdf(t)
+
+    def plot_excursion_probability(title, model, threshold=80.0):
+
+        def objective_function(x):
+            p = excursion_probability(x, model, threshold)
+            # return - p * tf.math.log(p)
+            return p
+            # return (p * (1. - p) )
+
+        _, ax = plot_function_2d(
+            objective_function,
+            search_space.lower - 0.01,
+            search_space.upper + 0.01,
+            grid_density=70,
+            contour=True,
+            colorbar=True,
+            figsize=(10, 6),
+            title=[title],
+            xlabel="$X_1$",
+            ylabel="$X_2$",
+            fill=True,
+        )
+        return ax
 
 
-np.random.seed(1793)
-tf.random.set_seed(1793)
+    np.random.seed(1793)
+    tf.random.set_seed(1793)
 
-search_space = BRANIN_SEARCH_SPACE
-threshold = 80.0
-observer = trieste.objectives.utils.mk_observer(branin)
+    search_space = BRANIN_SEARCH_SPACE
+    threshold = 80.0
+    observer = trieste.objectives.utils.mk_observer(branin)
 
-num_initial_points = 7
-initial_query_points = search_space.sample_halton(num_initial_points)
-initial_data = observer(initial_query_points)
+    num_initial_points = 7
+    initial_query_points = search_space.sample_halton(num_initial_points)
+    initial_data = observer(initial_query_points)
 
-# fitting the model only to the initial data
-model = build_model(initial_data)
-model.optimize(initial_data)
+    # fitting the model only to the initial data
+    model = build_model(initial_data)
+    model.optimize(initial_data)
 
-acq = feasGIBBON(search_space=search_space, rescaled_repulsion=True)
-rule = EfficientGlobalOptimization(builder=acq, num_query_points=250)
-x1 = rule.acquire_single(search_space, model, dataset=initial_data)
+    acq = feasGIBBON(threshold=threshold, rescaled_repulsion=True)
+    rule = EfficientGlobalOptimization(builder=acq, num_query_points=250)
+    x1 = rule.acquire_single(search_space, model, dataset=initial_data)
 
-ax = plot_excursion_probability(
-    "Excursion probability entropy, initial data (red), query points (blue)",
-    model,
-)
-ax[0,0].scatter(x1[:, 0], x1[:, 1], color = "blue")
-ax[0,0].scatter(initial_query_points[:, 0], initial_query_points[:, 1], color="red")
\ No newline at end of file
+    ax = plot_excursion_probability(
+        "Excursion probability entropy, initial data (red), query points (blue)",
+        model,
+    )
+    ax[0,0].scatter(x1[:, 0], x1[:, 1], color = "blue")
+    ax[0,0].scatter(initial_query_points[:, 0], initial_query_points[:, 1], color="red")
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 from trieste.acquisition.rule import OBJECTIVE
 from trieste.models import TrainableProbabilisticModel
 from trieste.types import TensorType
+from profiling_utils import map_in_chunks
 
 
 def compute_metrics(ask_tell, CONFIG):
@@ -17,10 +19,13 @@ def compute_metrics(ask_tell, CONFIG):
     return accuracy_global, accuracy_boundary
 
 
-def _excursion_probability(
+def excursion_probability(
     x: TensorType, model: TrainableProbabilisticModel, threshold: int
 ) -> tfp.distributions.Distribution:
-    mean, variance = model.model.predict_f(x)  # type: ignore
+    """ P(f(x) > threshold) under the posterior of a GPR model, predicted in chunks of `x`. """
+    num_data = int(tf.shape(model.model.data[0])[0])  # type: ignore
+    # predict_f holds a [N_chunk, num_data] cross-covariance and its triangular solve
+    mean, variance = map_in_chunks(model.model.predict_f, x, 2 * 8 * (num_data + 1))  # type: ignore
     normal = tfp.distributions.Normal(tf.cast(0, x.dtype), tf.cast(1, x.dtype))
     t = (mean - threshold) / tf.sqrt(variance)
     return normal.cdf(t)
@@ -29,7 +34,92 @@ def _excursion_probability(
 def _get_excursion_accuracy(
     x: TensorType, model: TrainableProbabilisticModel, threshold: int
 ) -> float:
-    prob = _excursion_probability(x, model, threshold)
+    prob = excursion_probability(x, model, threshold)
     accuracy = tf.reduce_sum(prob * (1 - prob), axis=0)
 
     return accuracy
+
+
+class IncrementalExcursionAccuracy:
+    """
+    Same metrics as :func:`compute_metrics` for GPR models, with the posterior at the (fixed) test
+    points updated from the new batch only. With L the Cholesky factor of K(X, X) + σ²I and
+    A = L⁻¹ K(X, X*), the posterior mean and variance at X* are m* + Aᵀ L⁻¹ (y - m) and
+    k** - diag(AᵀA). Adding q points appends q rows to L, so A gains q rows and the mean and
+    variance receive a rank-q correction, in O(q N T) instead of O(N² T) for T test points.
+
+    The hyperparameters are snapshotted at every call: if any of them changed (e.g. after a refit),
+    or if the training data is not an extension of the previous one, everything is recomputed in
+    chunks of test points. Aᵀ [T, N] is kept in memory between calls, which :func:`compute_metrics`
+    does not need. The GPR models of this package are refit at every tell, so the rank-q path only
+    runs, and the extra memory only pays off, when the hyperparameters are kept fixed between
+    metric evaluations (CONFIG.incremental_metrics, off by default).
+    """
+
+    def __init__(self, CONFIG):
+        self._test_points = tf.concat([tf.convert_to_tensor(CONFIG.problem.global_test_points),
+                                       tf.convert_to_tensor(CONFIG.problem.boundary_test_points)], axis=0)
+        self._num_global = int(CONFIG.problem.global_test_points.shape[0])
+        self._threshold = CONFIG.problem.threshold
+        self._parameters = None
+        self._X = None
+
+    def __call__(self, ask_tell, CONFIG):
+        gpr = ask_tell._models[OBJECTIVE].model  # type: ignore
+        X, Y = (tf.convert_to_tensor(data) for data in gpr.data)
+        parameters = [p.numpy() for p in gpr.parameters]
+        num_old = 0 if self._X is None else int(self._X.shape[0])
+
+        if (self._parameters is None or num_old > X.shape[0]
+                or any(not np.array_equal(p, q) for p, q in zip(parameters, self._parameters))
+                or not np.array_equal(X[:num_old], self._X)):
+            self._refactorize(gpr, X, Y)
+        elif X.shape[0] > num_old:
+            self._extend(gpr, X, Y, num_old)
+        self._parameters, self._X = parameters, X
+
+        normal = tfp.distributions.Normal(tf.cast(0, X.dtype), tf.cast(1, X.dtype))
+        prob = normal.cdf((self._mean - self._threshold) / tf.sqrt(self._variance))
+        accuracy = prob * (1 - prob)
+        return (tf.reduce_sum(accuracy[:self._num_global], axis=0),
+                tf.reduce_sum(accuracy[self._num_global:], axis=0))
+
+    def _refactorize(self, gpr, X, Y):
+        K = gpr.kernel(X) + gpr.likelihood.variance * tf.eye(X.shape[0], dtype=X.dtype)
+        self._L = tf.linalg.cholesky(K)  # [N, N]
+        self._alpha = tf.linalg.triangular_solve(self._L, Y - gpr.mean_function(X))  # [N, 1]
+
+        def cross_solve(x):  # rows of Aᵀ for a chunk of test points
+            return tf.transpose(tf.linalg.triangular_solve(self._L, gpr.kernel(X, x)))
+
+        num_data = int(X.shape[0])
+        self._At = map_in_chunks(cross_solve, self._test_points, 2 * 8 * (num_data + 1))  # [T, N]
+        self._mean = gpr.mean_function(self._test_points) + tf.matmul(self._At, self._alpha)  # [T, 1]
+        self._variance = (gpr.kernel(self._test_points, full_cov=False)
+                          - tf.reduce_sum(self._At ** 2, axis=-1))[:, None]  # [T, 1]
+
+    def _extend(self, gpr, X, Y, num_old):
+        X_old, X_new = X[:num_old], X[num_old:]
+        B = tf.linalg.triangular_solve(self._L, gpr.kernel(X_old, X_new))  # [N, q]
+        K_new = gpr.kernel(X_new) + gpr.likelihood.variance * tf.eye(X_new.shape[0], dtype=X.dtype)
+        C = tf.linalg.cholesky(K_new - tf.matmul(B, B, transpose_a=True))  # [q, q]
+        alpha_new = tf.linalg.triangular_solve(
+            C, Y[num_old:] - gpr.mean_function(X_new) - tf.matmul(B, self._alpha, transpose_a=True))  # [q, 1]
+
+        num_cols = int(self._At.shape[1])
+
+        def new_cross_solve(x_and_At):  # new columns of Aᵀ for a chunk of test points
+            x, At = x_and_At[:, :-num_cols], x_and_At[:, -num_cols:]
+            residual = gpr.kernel(X_new, x) - tf.matmul(B, At, transpose_a=True, transpose_b=True)  # [q, T]
+            return tf.transpose(tf.linalg.triangular_solve(C, residual))
+
+        At_new = map_in_chunks(new_cross_solve, tf.concat([self._test_points, self._At], axis=1),
+                               2 * 8 * (num_old + X_new.shape[0] + 1))  # [T, q]
+        self._mean = self._mean + tf.matmul(At_new, alpha_new)
+        self._variance = self._variance - tf.reduce_sum(At_new ** 2, axis=-1, keepdims=True)
+
+        zeros = tf.zeros([num_old, X_new.shape[0]], dtype=X.dtype)
+        self._L = tf.concat([tf.concat([self._L, zeros], axis=1),
+                             tf.concat([tf.transpose(B), C], axis=1)], axis=0)
+        self._alpha = tf.concat([self._alpha, alpha_new], axis=0)
+        self._At = tf.concat([self._At, At_new], axis=1)
@@ -1,12 +1,10 @@
 from __future__ import annotations
 
+import os
+import numpy as np
 import tensorflow as tf
 from trieste.objectives import BRANIN_SEARCH_SPACE, scaled_branin
-from trieste.observer import Observer
 from trieste.space import Box
-from trieste.types import TensorType
-from trieste.data import  Dataset
-from run_feasible_set_problem import make_observer
 
 class Problem:
     fun = None
@@ -18,7 +16,13 @@ class Problem:
     boundary_points = None
 
 
-def get_problem(name):
+def get_problem(name, test_seed: int = 0, cache_dir: str = "test_data", global_test_points=None,
+                boundary_test_points=None):
+    """
+    :param global_test_points: Global test set, e.g. shared by the sweep driver (see
+        :func:`get_problem_data`). Loaded from `cache_dir` (or generated) if `None`.
+    :param boundary_test_points: Boundary test set, given along with `global_test_points`.
+    """
     problem = Problem
     if name == "branin_large_volume":
         problem.fun = scaled_branin
@@ -26,69 +30,112 @@ def get_problem(name):
         problem.upper_bounds = BRANIN_SEARCH_SPACE.upper
         problem.dim = 2
         problem.threshold = 1.
-        global_points, boundary_points = _get_feasible_set_test_data(
-            BRANIN_SEARCH_SPACE,
-            lambda qp: Dataset(qp, scaled_branin(qp)),
-            n_global=10000 * problem.dim,
-            n_boundary = 2000 * problem.dim,
-            threshold=problem.threshold,
-        )
-        problem.global_test_points = global_points
-        problem.boundary_test_points = boundary_points
+        if global_test_points is None:
+            global_test_points, boundary_test_points = load_feasible_set_test_data(
+                name,
+                BRANIN_SEARCH_SPACE,
+                scaled_branin,
+                n_global=10000 * problem.dim,
+                n_boundary=2000 * problem.dim,
+                threshold=problem.threshold,
+                seed=test_seed,
+                cache_dir=cache_dir,
+            )
+        problem.global_test_points = global_test_points
+        problem.boundary_test_points = boundary_test_points
         return problem
     else:
         raise NotImplementedError
 
 
+def get_problem_data(name):
+    """ The expensive parts of a problem, computed once by the sweep driver and passed to `get_problem`. """
+    problem = get_problem(name)
+    return dict(global_test_points=np.asarray(problem.global_test_points),
+                boundary_test_points=np.asarray(problem.boundary_test_points))
+
+
+def load_feasible_set_test_data(
+    name: str,
+    search_space: Box,
+    fun,
+    n_global: int,
+    n_boundary: int,
+    threshold: float,
+    seed: int = 0,
+    cache_dir: str = "test_data",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Test sets of :func:`_get_feasible_set_test_data`, saved once per (problem, threshold, seed) and
+    memory-mapped read-only, so that every worker of a sweep shares the same arrays.
+    """
+    prefix = f"{cache_dir}/{name}_threshold_{threshold}_seed_{seed}"
+    paths = [f"{prefix}_global_{n_global}.npy", f"{prefix}_boundary_{n_boundary}.npy"]
+    if not all(os.path.exists(path) for path in paths):
+        os.makedirs(cache_dir, exist_ok=True)
+        test_sets = _get_feasible_set_test_data(search_space, fun, n_global, n_boundary, threshold,
+                                                rng=np.random.default_rng(seed))
+        for path, points in zip(paths, test_sets):
+            tmp_path = f"{path[:-4]}_{os.getpid()}.tmp.npy"  # concurrent workers must not read a partial file
+            np.save(tmp_path, points)
+            os.replace(tmp_path, path)
+    return tuple(np.load(path, mmap_mode="r") for path in paths)
+
+
 def _get_feasible_set_test_data(
     search_space: Box,
-    observer: Observer,
+    fun,
     n_global: int,
     n_boundary: int,
     threshold: float,
     range_pct: float = 0.01,
-) -> tuple[TensorType, TensorType]:
-
-    boundary_done = False
-    global_done = False
-    boundary_points = tf.constant(0, dtype=tf.float64, shape=(0, search_space.dimension))
-    global_points = tf.constant(0, dtype=tf.float64, shape=(0, search_space.dimension))
-
-    while not boundary_done and not global_done:
-        test_query_points = search_space.sample(100000)
-        test_data = observer(test_query_points)
-        threshold_deviation = range_pct * (
-            tf.reduce_max(test_data.observations)  # type: ignore
-            - tf.reduce_min(test_data.observations)  # type: ignore
-        )
-
-        mask = tf.reduce_all(
-            tf.concat(
-                [
-                    test_data.observations > threshold - threshold_deviation,  # type: ignore
-                    test_data.observations < threshold + threshold_deviation,  # type: ignore
-                ],
-                axis=1,
-            ),
-            axis=1,
-        )
-        boundary_points = tf.concat(
-            [boundary_points, tf.boolean_mask(test_query_points, mask)], axis=0
-        )
-        global_points = tf.concat(
-            [global_points, tf.boolean_mask(test_query_points, tf.logical_not(mask))], axis=0
-        )
-
-        if boundary_points.shape[0] > n_boundary:
-            boundary_done = True
-        if global_points.shape[0] > n_global:
-            global_done = True
-
-    return (
-        global_points[
-            :n_global,
-        ],
-        boundary_points[
-            :n_boundary,
-        ],
-    )
+    batch_size: int = 100000,
+    num_bisections: int = 40,
+    rng: np.random.Generator = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Global test points are uniform in the search space, away from the boundary band
+    |f(x) - threshold| <= range_pct * (max f - min f). Boundary points lie on the level set
+    f(x) = threshold: they are found by bisection on random segments whose end points are on
+    either side of the threshold, rather than by rejection in the band. Batches are drawn until
+    both sets are full.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    lower, upper = np.asarray(search_space.lower), np.asarray(search_space.upper)
+    dim = lower.shape[-1]
+
+    def sample(num_points):
+        return lower + (upper - lower) * rng.random((num_points, dim))
+
+    def evaluate(x):
+        return np.asarray(fun(tf.constant(x)))[:, 0] - threshold
+
+    global_points = np.empty((n_global, dim))
+    boundary_points = np.empty((n_boundary, dim))
+    num_global, num_boundary = 0, 0
+    threshold_deviation = None
+
+    while num_global < n_global or num_boundary < n_boundary:
+        x = sample(batch_size)
+        f = evaluate(x)
+        if threshold_deviation is None:
+            threshold_deviation = range_pct * (f.max() - f.min())
+
+        if num_global < n_global:
+            new_points = x[np.abs(f) > threshold_deviation][:n_global - num_global]
+            global_points[num_global:num_global + len(new_points)] = new_points
+            num_global += len(new_points)
+
+        if num_boundary < n_boundary:  # pair each point with the next one to get random segments
+            a, b, f_a, f_b = x[0::2], x[1::2], f[0::2], f[1::2]
+            crossing = np.sign(f_a) != np.sign(f_b)
+            a, b, f_a = a[crossing], b[crossing], f_a[crossing]
+            for _ in range(num_bisections):
+                middle = (a + b) / 2
+                same_side = (np.sign(evaluate(middle)) == np.sign(f_a))[:, None]
+                a, b = np.where(same_side, middle, a), np.where(same_side, b, middle)
+            new_points = ((a + b) / 2)[:n_boundary - num_boundary]
+            boundary_points[num_boundary:num_boundary + len(new_points)] = new_points
+            num_boundary += len(new_points)
+
+    return global_points, boundary_points
@@ -3,11 +3,12 @@ import numpy as np
 import os
 from run_feasible_set_problem import run_experiment
 from config import make_all_configs, make_config
+from problems import get_problem_data
 from trieste.observer import OBJECTIVE
 
 
-def run_single_experiment(config):
-    config = make_config(config)
+def run_single_experiment(config, problem_data=None):
+    config = make_config(config, problem_data)
 
     try:
         # Create target Directory
@@ -16,7 +17,7 @@ def run_single_experiment(config):
     except FileExistsError:
         print("Directory ", config.dirName, " already exists")
 
-    ask_tell, accuracy_global, accuracy_boundary = run_experiment(config)
+    ask_tell, accuracy_global, accuracy_boundary, timings, excursion = run_experiment(config)
     X = ask_tell._datasets[OBJECTIVE].query_points.numpy()
     Y = ask_tell._datasets[OBJECTIVE].observations.numpy()
     experiment_name = config.exp_name
@@ -24,6 +25,9 @@ def run_single_experiment(config):
     np.save(f"{config.dirName}/{experiment_name}_Y", Y)
     np.save(f"{config.dirName}/{experiment_name}_accuracy_global", accuracy_global)
     np.save(f"{config.dirName}/{experiment_name}_accuracy_boundary", accuracy_boundary)
+    np.save(f"{config.dirName}/{experiment_name}_timings", timings)
+    if excursion.size:
+        np.save(f"{config.dirName}/{experiment_name}_excursion", excursion)
     print(f"finished experiment {experiment_name}")
 
 
@@ -34,11 +38,11 @@ if __name__ == "__main__":
     ray.init(num_cpus=num_workers)
 
     @ray.remote
-    def run_single_experiment_with_ray(config):
+    def run_single_experiment_with_ray(config, problem_data):
         try:
-            run_single_experiment(config)
+            run_single_experiment(config, problem_data)
         except:
-            config = make_config(config)
+            config = make_config(config, problem_data)
             experiment_name = config.exp_name
             print(f"failed experiment {experiment_name}")
 
@@ -47,8 +51,12 @@ if __name__ == "__main__":
 
     configs = make_all_configs()
 
+    # test sets are built once and shared read-only: a top-level ObjectRef argument is resolved to
+    # numpy arrays backed by the object store, without a copy per worker
+    problem_data = {name: ray.put(get_problem_data(name)) for name in set(c["problem_name"] for c in configs)}
+
     for config in configs:
-        worker = run_single_experiment_with_ray.remote(config)
+        worker = run_single_experiment_with_ray.remote(config, problem_data[config["problem_name"]])
         workers.append(worker)
 
     remaining_workers = workers
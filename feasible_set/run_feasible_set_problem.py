@@ -4,8 +4,11 @@ import trieste
 from trieste.ask_tell_optimization import AskTellOptimizer
 from model_utils import build_model
 from acquisition_utils import create_acquisition_rule
-from metrics_utils import compute_metrics
+from metrics_utils import compute_metrics, IncrementalExcursionAccuracy
+from excursion_metrics import ExcursionMetrics, EXCURSION_DTYPE
 from trieste.data import Dataset
+from profiling_utils import PhaseTimer
+from compilation_utils import compile_experiment
 
 
 def make_observer(CONFIG):
@@ -15,28 +18,46 @@ def make_observer(CONFIG):
 def run_experiment(CONFIG):
     np.random.seed(CONFIG.seed)
     tf.random.set_seed(CONFIG.seed)
+    timer = PhaseTimer(CONFIG.reset_host_peaks)  # iteration 0 is the set-up, then one record per BO iteration
 
-    observer = make_observer(CONFIG)
+    observer = timer.timed("observer", make_observer(CONFIG))
     search_space = trieste.space.Box(CONFIG.problem.lower_bounds, CONFIG.problem.upper_bounds)
     initial_query_points = search_space.sample_halton(CONFIG.num_initial_points)
 
     data = observer(initial_query_points)
-    model = build_model(data)
+    with timer.phase("build_model"):
+        model = build_model(data)
+    timer.instrument(model, "optimize", "optimize")
+    timer.instrument(model, "update", "update")
 
     acquisition_rule = create_acquisition_rule(CONFIG, search_space)
     ask_tell = AskTellOptimizer(search_space, data, model, acquisition_rule)
+    with timer.phase("compile"):
+        compile_experiment(CONFIG, ask_tell, search_space)
 
     num_iterations = np.int((CONFIG.budget - data.observations.shape[0]) / acquisition_rule._num_query_points)
 
-    accuracy_global, accuracy_boundary = compute_metrics(ask_tell, CONFIG)
+    metrics_fn = IncrementalExcursionAccuracy(CONFIG) if CONFIG.incremental_metrics else compute_metrics
+    # the reference volume on 2^20 points is part of the problem set-up, not of the metrics timings
+    excursion_metrics = ExcursionMetrics(CONFIG.problem) if CONFIG.excursion_metrics else None
+    with timer.phase("metrics"):
+        accuracy_global, accuracy_boundary = metrics_fn(ask_tell, CONFIG)
+        excursion = [excursion_metrics.to_records(0, excursion_metrics(model))] if excursion_metrics is not None else []
     accuracy_global = tf.repeat(accuracy_global, data.observations.shape[0], axis=0)
     accuracy_boundary = tf.repeat(accuracy_boundary, data.observations.shape[0], axis=0)
 
     for iteration_count in range(num_iterations):
-        query_points = ask_tell.ask()
-        new_data = observer(query_points)
-        ask_tell.tell(new_data)
-        metrics = compute_metrics(ask_tell, CONFIG)
+        timer.next_iteration()
+        with timer.phase("iteration"):
+            with timer.phase("ask"):
+                query_points = ask_tell.ask()
+            new_data = observer(query_points)
+            with timer.phase("tell"):
+                ask_tell.tell(new_data)
+            with timer.phase("metrics"):
+                metrics = metrics_fn(ask_tell, CONFIG)
+                if excursion_metrics is not None:
+                    excursion.append(excursion_metrics.to_records(timer.iteration, excursion_metrics(model)))
         accuracy_global = tf.concat([accuracy_global,
                                      tf.repeat(metrics[0], acquisition_rule._num_query_points, axis=0)],
                                      axis=0)
@@ -44,4 +65,5 @@ def run_experiment(CONFIG):
                                        tf.repeat(metrics[1], acquisition_rule._num_query_points, axis=0)],
                                        axis=0)
 
-    return ask_tell, accuracy_global, accuracy_boundary
+    excursion = np.concatenate(excursion) if excursion else np.array([], dtype=EXCURSION_DTYPE)
+    return ask_tell, accuracy_global, accuracy_boundary, timer.to_array(), excursion
@@ -0,0 +1,55 @@
+import numpy as np
+import tensorflow as tf
+from trieste.data import Dataset
+from trieste.objectives import ScaledBranin
+
+from gibbon import feasibility_repulsion_term
+from model_utils import build_model
+
+
+def _make_model(num_data=15):
+    x = ScaledBranin.search_space.sample(num_data)
+    return build_model(Dataset(x, ScaledBranin.objective(x)))
+
+
+def _pending_cholesky(model, pending_points):
+    _, covariance = model.predict_joint(pending_points)
+    noise = model.get_observation_noise() * tf.eye(pending_points.shape[0], dtype=pending_points.dtype)
+    return tf.linalg.cholesky(covariance[0] + noise)
+
+
+def test_repulsion_cholesky_extension_matches_refactorisation():
+    tf.random.set_seed(0)
+    model = _make_model()
+    pending_points = ScaledBranin.search_space.sample(6)
+    term = feasibility_repulsion_term(model, 2)
+
+    for num_pending in [1, 3, 6]:  # one row, then blocks of two and three rows
+        term.update(pending_points[:num_pending])
+        np.testing.assert_allclose(term._L, _pending_cholesky(model, pending_points[:num_pending]), rtol=1e-8)
+
+    term.reset()
+    term.update(pending_points[:2])
+    np.testing.assert_allclose(term._L, _pending_cholesky(model, pending_points[:2]), rtol=1e-8)
+
+
+def test_repulsion_matches_conditional_variance():
+    tf.random.set_seed(1)
+    model = _make_model()
+    pending_points = ScaledBranin.search_space.sample(4)
+    x = ScaledBranin.search_space.sample(50)
+
+    incremental = feasibility_repulsion_term(model, 2, rescaled_repulsion=False)
+    for i in range(1, 5):
+        incremental.update(pending_points[:i])
+
+    # log(1 - ρ²) of each candidate observation with the pending ones, from the joint covariance
+    _, joint = model.predict_joint(tf.concat([pending_points, x], axis=0))
+    noise = model.get_observation_noise()
+    joint = joint[0] + noise * tf.eye(joint.shape[-1], dtype=joint.dtype)
+    pending_covariance, cross_covariance = joint[:4, :4], joint[:4, 4:]
+    yvar = tf.linalg.diag_part(joint)[4:]
+    explained = tf.reduce_sum(cross_covariance * tf.linalg.solve(pending_covariance, cross_covariance), axis=0)
+    expected = 0.5 * np.log(1. - explained / yvar)
+
+    np.testing.assert_allclose(incremental(x[:, None, :])[:, 0], expected, rtol=1e-6)
@@ -0,0 +1,66 @@
+import types
+
+import numpy as np
+import tensorflow as tf
+from trieste.acquisition.rule import OBJECTIVE
+from trieste.data import Dataset
+from trieste.objectives import ScaledBranin
+
+from metrics_utils import IncrementalExcursionAccuracy, compute_metrics
+from model_utils import build_model
+
+
+def _make_config(threshold=0.3):
+    search_space = ScaledBranin.search_space
+    problem = types.SimpleNamespace(threshold=threshold,
+                                    global_test_points=search_space.sample_sobol(200),
+                                    boundary_test_points=search_space.sample(50))
+    return types.SimpleNamespace(problem=problem)
+
+
+def _make_ask_tell(data):
+    return types.SimpleNamespace(_models={OBJECTIVE: build_model(data)})
+
+
+def _observe(x):
+    return Dataset(x, ScaledBranin.objective(x))
+
+
+def test_incremental_excursion_accuracy_extend_matches_compute_metrics():
+    tf.random.set_seed(0)
+    CONFIG = _make_config()
+    search_space = ScaledBranin.search_space
+    data = _observe(search_space.sample(10))
+    ask_tell = _make_ask_tell(data)
+    metrics = IncrementalExcursionAccuracy(CONFIG)
+    metrics(ask_tell, CONFIG)
+
+    for _ in range(3):  # hyperparameters are kept fixed, so every call takes the rank-q path
+        data = data + _observe(search_space.sample(4))
+        ask_tell._models[OBJECTIVE].update(data)
+        L_before = metrics._L
+        incremental = metrics(ask_tell, CONFIG)
+        assert metrics._L.shape[0] == L_before.shape[0] + 4
+        np.testing.assert_allclose(metrics._L[:-4, :-4], L_before)  # extended, not refactorised
+        expected = compute_metrics(ask_tell, CONFIG)
+        for value, expected_value in zip(incremental, expected):
+            np.testing.assert_allclose(value, expected_value, rtol=1e-6)
+
+
+def test_incremental_excursion_accuracy_refactorizes_after_refit():
+    tf.random.set_seed(0)
+    CONFIG = _make_config()
+    search_space = ScaledBranin.search_space
+    data = _observe(search_space.sample(10))
+    ask_tell = _make_ask_tell(data)
+    metrics = IncrementalExcursionAccuracy(CONFIG)
+    metrics(ask_tell, CONFIG)
+
+    data = data + _observe(search_space.sample(4))
+    model = ask_tell._models[OBJECTIVE]
+    model.update(data)
+    model.model.kernel.lengthscales.assign([0.3, 0.3])
+    incremental = metrics(ask_tell, CONFIG)
+    expected = compute_metrics(ask_tell, CONFIG)
+    for value, expected_value in zip(incremental, expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-6)
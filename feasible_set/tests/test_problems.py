@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+from trieste.space import Box
+
+import problems
+from problems import _get_feasible_set_test_data, load_feasible_set_test_data
+
+SEARCH_SPACE = Box([0., 0.], [1., 1.])
+THRESHOLD = 1.
+
+
+def _fun(x):
+    return tf.reduce_sum(x, axis=-1, keepdims=True)  # level set: the diagonal x_1 + x_2 = 1
+
+
+def test_test_data_fills_both_quotas():
+    # small batches, so that both sets are filled over several of them
+    global_points, boundary_points = _get_feasible_set_test_data(
+        SEARCH_SPACE, _fun, n_global=500, n_boundary=300, threshold=THRESHOLD, batch_size=200,
+        rng=np.random.default_rng(0))
+
+    assert global_points.shape == (500, 2) and boundary_points.shape == (300, 2)
+    for points in (global_points, boundary_points):
+        assert np.all((points >= 0.) & (points <= 1.))
+    band = 0.01 * 2.  # range_pct times the range of f over the search space, up to sampling
+    assert np.all(np.abs(global_points.sum(axis=-1) - THRESHOLD) > 0.9 * band)
+    np.testing.assert_allclose(boundary_points.sum(axis=-1), THRESHOLD, atol=1e-9)
+
+
+def test_test_data_cache_round_trip(tmp_path, monkeypatch):
+    kwargs = dict(n_global=200, n_boundary=100, threshold=THRESHOLD, seed=3, cache_dir=str(tmp_path))
+    generated = load_feasible_set_test_data("diagonal", SEARCH_SPACE, _fun, **kwargs)
+    assert sorted(os.listdir(tmp_path)) == ["diagonal_threshold_1.0_seed_3_boundary_100.npy",
+                                            "diagonal_threshold_1.0_seed_3_global_200.npy"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cached test sets must not be regenerated")
+
+    monkeypatch.setattr(problems, "_get_feasible_set_test_data", fail)
+    loaded = load_feasible_set_test_data("diagonal", SEARCH_SPACE, _fun, **kwargs)
+    for generated_points, loaded_points in zip(generated, loaded):
+        np.testing.assert_array_equal(generated_points, loaded_points)
+        assert not loaded_points.flags.writeable
+
+    expected = _get_feasible_set_test_data(SEARCH_SPACE, _fun, 200, 100, THRESHOLD, rng=np.random.default_rng(3))
+    for loaded_points, expected_points in zip(loaded, expected):
+        np.testing.assert_array_equal(loaded_points, expected_points)
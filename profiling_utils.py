@@ -0,0 +1,198 @@
+"""
+Lightweight per-phase instrumentation of a BO run.
+
+PhaseTimer: Wall time, number of calls and memory peaks per (iteration, phase), saved next to the results
+
+summarize_timings: Mean total time and calls per phase over a set of saved timing records
+
+map_in_chunks: Applies a function to row chunks of a tensor sized from the per-worker memory budget
+
+Shared by quantile/ and feasible_set/, which import it with the repository root on the path (as
+plotting.py).
+
+Phases can be nested (e.g. "update" runs inside "tell"), in which case the outer phase includes
+the time of the inner one. Memory is recorded as the peak of each call of a phase above the usage
+at its start (host resident set size, and TF allocator on GPU when available), i.e. the memory the
+phase itself needed. The peak of the TF allocator is reset when a phase starts, after its value so
+far has been passed on to the enclosing phases. The kernel high-water mark of the resident set is
+only reset (through /proc/self/clear_refs on linux) for a PhaseTimer created with
+reset_host_peaks=True, since the reset clears the referenced bits of all pages of the process. By
+default, or where the host peak cannot be reset, host records are the growth of the process peak
+during the phase.
+"""
+
+import time
+import resource
+import functools
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from trieste.types import TensorType
+
+TIMING_DTYPE = np.dtype([("iteration", np.int64), ("phase", "U32"), ("time", np.float64), ("calls", np.int64),
+                         ("host_peak_mb", np.float64), ("device_peak_mb", np.float64)])
+
+_memory_budget = 512 * 2 ** 20  # bytes available to a single chunked op
+
+
+def set_memory_budget(megabytes: float) -> None:
+    global _memory_budget
+    _memory_budget = megabytes * 2 ** 20
+
+
+def get_chunk_size(bytes_per_row: float, num_rows: int) -> int:
+    """ Number of rows of an op using `bytes_per_row` bytes per row that fit in the memory budget. """
+    return int(max(1, min(num_rows, _memory_budget // bytes_per_row)))
+
+
+def map_in_chunks(fun, x: TensorType, bytes_per_row: float):
+    """
+    Applies `fun` to chunks of rows of `x` and concatenates the outputs along the first axis. `fun`
+    may return a tensor or a tuple of tensors, and must act on the rows of `x` independently.
+    """
+    num_rows = x.shape[0]
+    chunk_size = get_chunk_size(bytes_per_row, num_rows)
+    if chunk_size >= num_rows:
+        return fun(x)
+
+    outputs = [fun(x[i:i + chunk_size]) for i in range(0, num_rows, chunk_size)]
+    if isinstance(outputs[0], tuple):
+        return tuple(tf.concat(output, axis=0) for output in zip(*outputs))
+    return tf.concat(outputs, axis=0)
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field):
+                return float(line.split()[1]) / 2 ** 10  # kB
+    raise KeyError(field)
+
+
+def host_memory_mb() -> Tuple[float, float]:
+    """ Current and peak resident set size of the process. """
+    try:
+        return _status_mb("VmRSS:"), _status_mb("VmHWM:")
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10  # ru_maxrss is in kB on linux
+        return peak, peak
+
+
+def reset_host_peak() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")  # resets VmHWM to the current VmRSS
+        return True
+    except OSError:
+        return False
+
+
+def device_memory_mb() -> Tuple[float, float]:
+    """ Current and peak memory of the TF allocator on the first GPU. """
+    if not tf.config.list_physical_devices("GPU"):
+        return np.nan, np.nan
+    info = tf.config.experimental.get_memory_info("GPU:0")
+    return info["current"] / 2 ** 20, info["peak"] / 2 ** 20
+
+
+def reset_device_peak() -> None:
+    if tf.config.list_physical_devices("GPU"):
+        tf.config.experimental.reset_memory_stats("GPU:0")
+
+
+class _PhaseMemory:
+    """ Usage at the start of an open phase, and highest usage seen since. """
+
+    def __init__(self, host: float, device: float):
+        self.host_start, self.device_start = host, device
+        self.host_peak, self.device_peak = host, device
+
+
+class PhaseTimer:
+    def __init__(self, reset_host_peaks: bool = False):
+        self.reset_host_peaks = reset_host_peaks
+        self.iteration = 0
+        self._records: Dict[Tuple[int, str], list] = defaultdict(lambda: [0., 0, np.nan, np.nan])
+        self._open_phases: list = []
+
+    def next_iteration(self) -> None:
+        self.iteration += 1
+
+    def add(self, phase: str, elapsed: float, calls: int = 1, host_mb: float = np.nan,
+            device_mb: float = np.nan) -> None:
+        record = self._records[self.iteration, phase]
+        record[0] += elapsed
+        record[1] += calls
+        record[2] = np.fmax(record[2], host_mb)
+        record[3] = np.fmax(record[3], device_mb)
+
+    def _collect_peaks(self) -> None:
+        """ Passes the process peaks since the last reset on to all open phases. """
+        (_, host_peak), (_, device_peak) = host_memory_mb(), device_memory_mb()
+        for memory in self._open_phases:
+            memory.host_peak = max(memory.host_peak, host_peak)
+            memory.device_peak = np.fmax(memory.device_peak, device_peak)
+
+    @contextmanager
+    def phase(self, phase: str):
+        self._collect_peaks()
+        (host, host_peak), (device, _) = host_memory_mb(), device_memory_mb()
+        memory = _PhaseMemory(host if self.reset_host_peaks and reset_host_peak() else host_peak, device)
+        self._open_phases.append(memory)
+        reset_device_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._collect_peaks()
+            self._open_phases.pop()
+            self.add(phase, elapsed, host_mb=memory.host_peak - memory.host_start,
+                     device_mb=memory.device_peak - memory.device_start)
+
+    def timed(self, phase: str, fun):
+        """ Wraps `fun` so that every call is recorded under `phase`. """
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with self.phase(phase):
+                return fun(*args, **kwargs)
+        return wrapper
+
+    def instrument(self, obj, method_name: str, phase: str) -> None:
+        """ Records every call to `obj.method_name` under `phase`, e.g. calls made inside trieste. """
+        setattr(obj, method_name, self.timed(phase, getattr(obj, method_name)))
+
+    def to_array(self) -> np.ndarray:
+        return np.array([(iteration, phase, *record) for (iteration, phase), record in sorted(self._records.items())],
+                        dtype=TIMING_DTYPE)
+
+
+def summarize_timings(records):
+    """
+    :param records: Arrays returned by :meth:`PhaseTimer.to_array`, one per run.
+    :return: For every phase, the mean over runs of its total time and number of calls, and the
+        largest host and device memory peaks of one of its calls over runs.
+    """
+    phases = sorted(set(phase for record in records for phase in record["phase"]))
+    summary = {}
+    for phase in phases:
+        totals = [record["time"][record["phase"] == phase].sum() for record in records]
+        calls = [record["calls"][record["phase"] == phase].sum() for record in records]
+        host_peaks = [record["host_peak_mb"][record["phase"] == phase].max() for record in records]
+        device_peaks = [record["device_peak_mb"][record["phase"] == phase].max() for record in records]
+        summary[phase] = (np.mean(totals), np.mean(calls), np.max(host_peaks), np.max(device_peaks))
+    return summary
+
+
+def print_timing_summary(name, records):
+    summary = summarize_timings(records)
+    total = sum(time for phase, (time, *_) in summary.items() if phase == "iteration")
+    print(f"    Timings for {name} ({len(records)} runs)")
+    for phase, (mean_time, mean_calls, host_peak, device_peak) in summary.items():
+        share = f"{100 * mean_time / total:5.1f}%" if total > 0 else "      "
+        print(f"        {phase:>20} {mean_time:10.2f}s {mean_calls:8.1f} calls {share} "
+              f"peak host {host_peak:8.1f}MB device {device_peak:8.1f}MB")
@@ -22,7 +22,7 @@ def create_initial_query_points(search_space, CONFIG):
         return search_space.sample_halton(CONFIG.num_initial_points)
 
 def create_acquisition_rule(CONFIG):
-    if CONFIG.model == "quantile":
+    if CONFIG.model in ["quantile", "homgp_ws"]:  # homoscedastic quantile is the mean plus a constant
         quantile_traj = NegativeGaussianProcessTrajectory()
         return trieste.acquisition.rule.EfficientGlobalOptimization(quantile_traj.using(OBJECTIVE),
                                                                          num_query_points=CONFIG.batch_size)
@@ -38,7 +38,7 @@ def create_acquisition_rule(CONFIG):
 def extract_current_best_quantile(ask_tell, CONFIG):
     model = ask_tell._models[OBJECTIVE]
     data = ask_tell._datasets[OBJECTIVE]
-    if CONFIG.model == "quantile":
+    if CONFIG.model in ["quantile", "homgp_ws"]:
         mean, var = model.predict(data.query_points)
         return data.query_points[tf.argmin(mean[:, 0]), :][None, :]
 
@@ -53,15 +53,41 @@ def extract_current_best_quantile(ask_tell, CONFIG):
         mean, var = model.predict(data.query_points)
         return data.query_points[tf.argmin(mean, axis=0)[0], :][None, :]
 
-class NegativeGaussianProcessTrajectory(SingleModelGreedyAcquisitionBuilder):
-    def __repr__(self) -> str:
-        return f"NegativeGaussianProcessTrajectory"
+class ResampledTrajectoryBuilder(SingleModelGreedyAcquisitionBuilder):
+    """
+    Greedy batches of Thompson samples: every batch point maximises a new trajectory of the model.
+    The trajectory (`model.trajectory()`) is redrawn in place, so the same acquisition function is
+    returned for all points and BO iterations, and a compiled version of it is traced only once.
+    """
+
+    def __init__(self):
+        self._trajectory = None
 
     def prepare_acquisition_function(
         self, model: FeaturedHetGPFluxModel, dataset: Dataset = None,
         pending_points: Optional[TensorType] = None,
     ) -> AcquisitionFunction:
-        trajectory = model.sample_trajectory()
+        self._trajectory = model.trajectory()
+        return self._acquisition(self._trajectory, model)
+
+    def update_acquisition_function(
+        self, function: AcquisitionFunction, model: FeaturedHetGPFluxModel, dataset: Dataset = None,
+        pending_points: Optional[TensorType] = None, new_optimization_step: bool = True,
+    ) -> AcquisitionFunction:
+        if new_optimization_step and not self._trajectory.is_current():  # the model has replaced its variables
+            return self.prepare_acquisition_function(model, dataset, pending_points)
+        self._trajectory.resample()
+        return function
+
+    def _acquisition(self, trajectory, model) -> AcquisitionFunction:
+        raise NotImplementedError
+
+
+class NegativeGaussianProcessTrajectory(ResampledTrajectoryBuilder):
+    def __repr__(self) -> str:
+        return f"NegativeGaussianProcessTrajectory"
+
+    def _acquisition(self, trajectory, model) -> AcquisitionFunction:
         return lambda at: -trajectory(tf.squeeze(at, axis=1))[..., 0:1]
 
 
@@ -187,20 +213,16 @@ class min_value_entropy_search_for_quantile(min_value_entropy_search):
 
 
 
-class NegativeQuantilefromGaussianHetGPTrajectory(SingleModelGreedyAcquisitionBuilder):
+class NegativeQuantilefromGaussianHetGPTrajectory(ResampledTrajectoryBuilder):
 
     def __init__(self, quantile_level: float = 0.9):
+        super().__init__()
         self._quantile_level = quantile_level
 
     def __repr__(self) -> str:
         return f"NegativeGaussianProcessTrajectory"
 
-    def prepare_acquisition_function(
-        self, model: FeaturedHetGPFluxModel, dataset: Dataset = None,
-        pending_points: Optional[TensorType] = None,
-    ) -> AcquisitionFunction:
-        trajectory = model.sample_trajectory()
-
+    def _acquisition(self, trajectory, model) -> AcquisitionFunction:
         def quantile_traj(at):
             lik_layer = model.model_gpflux.likelihood_layer
             dist = lik_layer.likelihood.conditional_distribution(trajectory(tf.squeeze(at, axis=1)))
@@ -230,4 +252,5 @@ class myExpectedImprovement(ExpectedImprovement):
         tf.debugging.Assert(isinstance(function, expected_improvement), [])
         mean, _ = model.predict(dataset.query_points)
         eta = tf.reduce_min(mean, axis=0)
-        return expected_improvement(model, eta)
+        function.update(eta)  # type: ignore
+        return function
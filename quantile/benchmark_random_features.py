@@ -0,0 +1,111 @@
+"""
+Accuracy-vs-F benchmark of the random feature constructions in random_features.py for the
+Matérn-5/2 kernel returned by set_kernel. For each construction and number of features F we report
+the relative Frobenius error of Φ(X)Φ(X)ᵀ against K(X, X) (mean and std over repeats) and the time to
+evaluate Φ(X), then the smallest F at which each construction matches plain RFF with 1000 features.
+Finally, features evaluated in float32 are compared with the same features in float64: maximum
+absolute error of Φ(X), of Φ(X)Φ(X)ᵀ and of a trajectory Φ(X)w, and speed-up of the trajectory
+evaluation. The errors are asserted to stay below the tolerances at the top of this file.
+"""
+
+import time
+import numpy as np
+import tensorflow as tf
+from gpflow.config import default_float
+from trieste.space import Box
+from model_utils import set_kernel
+from random_features import FEATURE_TYPES, with_feature_dtype, project_features
+
+tf.keras.backend.set_floatx("float64")
+
+FEATURE_TOLERANCE = 1e-6  # max |ΔΦ| of float32 features
+KERNEL_TOLERANCE = 1e-5  # max |Δ(ΦΦᵀ)|
+TRAJECTORY_TOLERANCE = 1e-5  # max |Δ(Φw)| for standard normal weights w
+
+
+def kernel_approximation_error(kernel, feature_class, num_features, X, num_repeats):
+    K = kernel(X, full_cov=True)
+    errors, times = [], []
+    for _ in range(num_repeats):
+        features = feature_class(kernel, num_features, dtype=default_float())
+        features(X[:1])  # build the layer outside of the timing
+
+        start = time.perf_counter()
+        Phi = features(X)  # [N, F]
+        times.append(time.perf_counter() - start)
+
+        errors.append((tf.norm(tf.matmul(Phi, Phi, transpose_b=True) - K) / tf.norm(K)).numpy())
+    return np.mean(errors), np.std(errors), np.mean(times)
+
+
+def precision_check(kernel, feature_class, num_features, X, num_repeats, dtype=tf.float32):
+    features = feature_class(kernel, num_features, dtype=default_float())
+    features(X[:1])
+    reduced_features = with_feature_dtype(feature_class, dtype)(kernel, num_features, dtype=default_float())
+    reduced_features(X[:1])
+    reduced_features.W.assign(features.W)  # same basis, so only the precision differs
+    reduced_features.b.assign(features.b)
+
+    weights = tf.random.normal([num_features, 1], dtype=default_float())
+    times, trajectories = {}, {}
+    for name, f in [("float64", features), ("reduced", reduced_features)]:
+        trajectory = tf.function(lambda X: project_features(f, X, weights))
+        trajectory(X)  # trace outside of the timing
+        start = time.perf_counter()
+        for _ in range(num_repeats):
+            trajectories[name] = trajectory(X)
+        times[name] = (time.perf_counter() - start) / num_repeats
+
+    Phi, reduced_Phi = features(X), reduced_features(X)
+    K, reduced_K = tf.matmul(Phi, Phi, transpose_b=True), tf.matmul(reduced_Phi, reduced_Phi, transpose_b=True)
+    feature_error = tf.reduce_max(tf.abs(Phi - reduced_Phi)).numpy()
+    kernel_error = tf.reduce_max(tf.abs(K - reduced_K)).numpy()
+    trajectory_error = tf.reduce_max(tf.abs(trajectories["float64"] - trajectories["reduced"])).numpy()
+    return feature_error, kernel_error, trajectory_error, times["float64"] / times["reduced"]
+
+
+if __name__ == "__main__":
+    np.random.seed(1789)
+    tf.random.set_seed(1789)
+
+    num_points = 1000
+    num_repeats = 10
+    reference_num_features = 1000
+    all_num_features = [50, 100, 200, 300, 500, 1000]
+
+    for input_dim in [1, 2, 3]:
+        kernel = set_kernel(1., input_dim)
+        X = Box(np.zeros(input_dim), np.ones(input_dim)).sample(num_points)
+
+        print(f"Matérn-5/2, input_dim={input_dim}, N={num_points}")
+        print(f"{'features':>10} {'F':>6} {'rel. error':>12} {'std':>10} {'time [ms]':>10}")
+        results = {}
+        for name, feature_class in FEATURE_TYPES.items():
+            for num_features in all_num_features:
+                mean_error, std_error, mean_time = kernel_approximation_error(kernel, feature_class, num_features,
+                                                                              X, num_repeats)
+                results[name, num_features] = mean_error
+                print(f"{name:>10} {num_features:>6} {mean_error:>12.4f} {std_error:>10.4f} {1e3 * mean_time:>10.2f}")
+
+        target = results["rff", reference_num_features]
+        for name in FEATURE_TYPES:
+            matching = [F for F in all_num_features if results[name, F] <= target]
+            print(f"{name}: F needed to match rff with F={reference_num_features}: "
+                  f"{matching[0] if matching else '>' + str(all_num_features[-1])}")
+        print()
+
+    num_points = 10000
+    print(f"float32 features against float64, N={num_points}, F={reference_num_features}")
+    print(f"{'features':>10} {'input_dim':>10} {'max |dPhi|':>12} {'max |dK|':>12} {'max |dPhi w|':>12} "
+          f"{'speed-up':>10}")
+    for input_dim in [1, 2, 3]:
+        kernel = set_kernel(1., input_dim)
+        X = Box(np.zeros(input_dim), np.ones(input_dim)).sample(num_points)
+        for name, feature_class in FEATURE_TYPES.items():
+            feature_error, kernel_error, trajectory_error, speed_up = precision_check(
+                kernel, feature_class, reference_num_features, X, num_repeats)
+            print(f"{name:>10} {input_dim:>10} {feature_error:>12.2e} {kernel_error:>12.2e} "
+                  f"{trajectory_error:>12.2e} {speed_up:>10.2f}")
+            assert feature_error < FEATURE_TOLERANCE, f"{name}: float32 features off by {feature_error:.2e}"
+            assert kernel_error < KERNEL_TOLERANCE, f"{name}: float32 kernel off by {kernel_error:.2e}"
+            assert trajectory_error < TRAJECTORY_TOLERANCE, f"{name}: float32 trajectory off by {trajectory_error:.2e}"
@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from glob import glob
 import os
+from profiling_utils import print_timing_summary
 
 
 def plot_regret(regrets: Dict[str, np.ndarray], title: str=None, ylabel="Regret", show_all=False):
@@ -48,4 +49,8 @@ for tag in pb_tags:
                 regret = np.hstack([regret, reg])
             all_regrets[exp_name] = regret.T
 
+        all_timing_files = glob(f"{subdir}*timings.npy")
+        if len(all_timing_files) > 0:
+            print_timing_summary(exp_name, [np.load(file=file) for file in all_timing_files])
+
     fig = plot_regret(all_regrets, title=tag, ylabel="Simple regret", show_all=False)
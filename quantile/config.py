@@ -1,11 +1,12 @@
 from problems import get_problem
+from profiling_utils import set_memory_budget
 from dataclasses import dataclass
 import itertools
 import numpy as np
 
 @dataclass
 class CONFIG:
-    model:str  # "quantile", "hetgp" or "GPR"
+    model:str  # "quantile", "hetgp", "homgp", "homgp_ws" or "GPR"
     problem_name:str  # "quantile_branin" or ....
     problem = None
     seed:int
@@ -15,14 +16,28 @@ class CONFIG:
     batch_size:int = 50
     num_inducing_points:int = 50
     num_features:int = 1000
+    rff_resample_tolerance:float = None  # None: keep the RFF bases drawn at model build
+    feature_type:str = "rff"  # "rff", "orf" (orthogonal) or "qmc" (Sobol frequencies)
+    feature_precision:str = "float64"  # "float32": random features and their trajectory products in single precision, kernels and Cholesky factors stay float64
+    refit_every:int = 1  # "homgp_ws" only: hyperparameter refit period, in BO iterations
+    compress_replicates:bool = False  # DeepGP models: evaluate the GP layer once per unique input
+    use_natgrads:bool = False  # DeepGP models: natural gradients on q(u), Adam on hyperparameters
+    natgrad_gamma:float = 0.1  # use_natgrads only: natural gradient step size
+    natgrad_epochs:int = 50  # use_natgrads only: maximum epochs per fit, stopping criteria come from the fit callbacks
+    inducing_policy:str = None  # DeepGP models: None (fixed num_inducing_points), "sqrt" or "nystrom"
     dirName:str = None
     num_initial_points: int = None
+    tensorboard:bool = False  # DeepGP models: buffered TensorBoard logs in logs/tensorboard/<exp_name>
+    compile_mode:str = None  # None, "graph" or "xla": compile predictions and acquisition functions
+    memory_budget_mb:float = 512.  # per-worker budget used to chunk large tensor ops
+    reset_host_peaks:bool = False  # per-phase host memory peaks through /proc/self/clear_refs (linux)
     results_dir:str = "results_whiten"
 
 
-def make_config(args):
+def make_config(args, problem_data=None):
     config = CONFIG(**args)
-    config.problem = get_problem(config.problem_name)
+    set_memory_budget(config.memory_budget_mb)
+    config.problem = get_problem(config.problem_name, **(problem_data or {}))
 
     config.exp_name = f"problem_{config.problem_name}" \
                       f"_model_{config.model}" \
@@ -37,6 +52,37 @@ def make_config(args):
                       f"_budget_{config.budget_per_dimension}" \
                       f"_batch_{config.batch_size}"
 
+    if config.feature_type != "rff":
+        config.exp_name += f"_features_{config.feature_type}"
+        subdir_name += f"_features_{config.feature_type}"
+
+    if config.feature_precision != "float64":
+        config.exp_name += f"_{config.feature_precision}"
+        subdir_name += f"_{config.feature_precision}"
+
+    if config.inducing_policy is not None:
+        config.exp_name += f"_inducing_{config.inducing_policy}"
+        subdir_name += f"_inducing_{config.inducing_policy}"
+
+    if config.rff_resample_tolerance is not None:
+        config.exp_name += f"_rfftol_{config.rff_resample_tolerance}"
+        subdir_name += f"_rfftol_{config.rff_resample_tolerance}"
+
+    if config.compress_replicates:
+        config.exp_name += "_compressed"
+        subdir_name += "_compressed"
+
+    if config.use_natgrads:
+        config.exp_name += "_natgrads"
+        subdir_name += "_natgrads"
+        if (config.natgrad_gamma, config.natgrad_epochs) != (CONFIG.natgrad_gamma, CONFIG.natgrad_epochs):
+            config.exp_name += f"_gamma_{config.natgrad_gamma}_epochs_{config.natgrad_epochs}"
+            subdir_name += f"_gamma_{config.natgrad_gamma}_epochs_{config.natgrad_epochs}"
+
+    if config.refit_every != 1:
+        config.exp_name += f"_refit_{config.refit_every}"
+        subdir_name += f"_refit_{config.refit_every}"
+
     config.dirName = f"{config.results_dir}/{subdir_name}"
 
     config.num_initial_points = config.initial_budget_per_dimension * config.problem.dim
@@ -48,7 +48,7 @@ def plot_results(ask_tell, best_x, best_y, estimated_best_y, show_model=True, sh
 configs = make_all_configs()
 config = make_config(configs[1])
 
-# ask_tell, best_x, best_y = run_quantile_experiment(config)
+# ask_tell, best_x, best_y, timings = run_quantile_experiment(config)
 
 #############################################
 import trieste
@@ -69,7 +69,7 @@ observer = make_observer(CONFIG)
 search_space = trieste.space.Box(CONFIG.problem.lower_bounds, CONFIG.problem.upper_bounds)
 initial_query_points = create_initial_query_points(search_space, CONFIG)
 data = observer(initial_query_points)
-model = build_model(data, CONFIG, search_space)  #, tb=tb_callback)
+model = build_model(data, CONFIG, search_space)
 
 summary_writer = tf.summary.create_file_writer("logs/tensorboard/experiment4")
 trieste.logging.set_tensorboard_writer(summary_writer)
@@ -5,7 +5,7 @@ import tensorflow as tf
 import tensorflow_probability as tfp
 import trieste
 from trieste.data import Dataset
-from model_utils import build_hetgp_rff_model, ASymmetricLaplace
+from model_utils import build_hetgp_rff_model, build_multi_quantile_rff_model, predict_quantiles
 from inducing_point_selector import KMeans, GridSampler
 
 np.random.seed(1789)
@@ -67,23 +67,15 @@ initial_query_points = search_space.sample(500)
 data = observer(initial_query_points)
 
 
-# Fit heterogeneous quantile model
-qhet_model = build_hetgp_rff_model(data=data,
-                                     num_features=1000,
-                                     likelihood_distribution=
-                                     lambda loc, scale: ASymmetricLaplace(loc, scale, tau=quantile_level),
-                                     num_inducing_points=40,
-                                     inducing_point_selector=GridSampler(search_space))
+# Fit heterogeneous quantile model, jointly for tau and 1 - tau
+quantile_levels = [1. - quantile_level, quantile_level]  # sorted: column 1 is tau, column 0 is 1 - tau
+qhet_model = build_multi_quantile_rff_model(data=data,
+                                            quantile_levels=quantile_levels,
+                                            num_features=1000,
+                                            num_inducing_points=40,
+                                            inducing_point_selector=GridSampler(search_space))
 qhet_model.optimize(data)
 
-qhet_model2 = build_hetgp_rff_model(data=data,
-                                     num_features=1000,
-                                     likelihood_distribution=
-                                     lambda loc, scale: ASymmetricLaplace(loc, scale, tau=1. - quantile_level),
-                                     num_inducing_points=40,
-                                     inducing_point_selector=GridSampler(search_space))
-qhet_model2.optimize(data)
-
 # Fit hetGP model
 hetgp = build_hetgp_rff_model(data=data,
                               num_features=1000,
@@ -92,25 +84,15 @@ hetgp = build_hetgp_rff_model(data=data,
                               inducing_point_selector=GridSampler(search_space))
 hetgp.optimize(data)
 
-# Fit homogeneous quantile model
-qhom_model = build_hetgp_rff_model(data=data,
-                                     num_features=1000,
-                                     likelihood_distribution=
-                                     lambda loc, scale: ASymmetricLaplace(loc, scale, tau=quantile_level),
-                                     num_inducing_points=40,
-                                     inducing_point_selector=GridSampler(search_space),
-                                homogeneous=True)
+# Fit homogeneous quantile model, jointly for tau and 1 - tau
+qhom_model = build_multi_quantile_rff_model(data=data,
+                                            quantile_levels=quantile_levels,
+                                            num_features=1000,
+                                            num_inducing_points=40,
+                                            inducing_point_selector=GridSampler(search_space),
+                                            homogeneous=True)
 qhom_model.optimize(data)
 
-qhom_model2 = build_hetgp_rff_model(data=data,
-                                     num_features=1000,
-                                     likelihood_distribution=
-                                     lambda loc, scale: ASymmetricLaplace(loc, scale, tau=1. - quantile_level),
-                                     num_inducing_points=40,
-                                     inducing_point_selector=GridSampler(search_space),
-                                homogeneous=True)
-qhom_model2.optimize(data)
-
 x = np.linspace(0., 1., 1000)
 x = tf.constant(x.reshape(-1, 1), dtype=tf.float64)
 f = fun(x)
@@ -134,17 +116,12 @@ for row in range(nrows):
         ax[row, col].scatter(data.query_points.numpy(), data.observations.numpy(), color="black")
 
 # hetQuantile plot
-qhet_mean, qhet_var = qhet_model.predict(x)
-ax[0,1].plot(x.numpy(), qhet_mean[:, 0].numpy(), color="green", linewidth=3)
-y_up = qhet_mean[:, 0].numpy() + 1.96 * np.sqrt(qhet_var[:, 0].numpy())
-y_lo = qhet_mean[:, 0].numpy() - 1.96 * np.sqrt(qhet_var[:, 0].numpy())
-ax[0,1].fill_between(x.numpy().flatten(), y_up.flatten(), y_lo.flatten(), alpha=0.3, color="green")
-
-qhet_mean, qhet_var = qhet_model2.predict(x)
-ax[1,1].plot(x.numpy(), qhet_mean[:, 0].numpy(), color="green", linewidth=3)
-y_up = qhet_mean[:, 0].numpy() + 1.96 * np.sqrt(qhet_var[:, 0].numpy())
-y_lo = qhet_mean[:, 0].numpy() - 1.96 * np.sqrt(qhet_var[:, 0].numpy())
-ax[1,1].fill_between(x.numpy().flatten(), y_up.flatten(), y_lo.flatten(), alpha=0.3, color="green")
+qhet_mean, qhet_var = predict_quantiles(qhet_model, x)
+for row, col in enumerate([1, 0]):
+    ax[row, 1].plot(x.numpy(), qhet_mean[:, col].numpy(), color="green", linewidth=3)
+    y_up = qhet_mean[:, col].numpy() + 1.96 * np.sqrt(qhet_var[:, col].numpy())
+    y_lo = qhet_mean[:, col].numpy() - 1.96 * np.sqrt(qhet_var[:, col].numpy())
+    ax[row, 1].fill_between(x.numpy().flatten(), y_up.flatten(), y_lo.flatten(), alpha=0.3, color="green")
 
 # hetGP plot
 hetgp_mean, hetgp_var = hetgp.predict(x)
@@ -167,17 +144,12 @@ for i in range(10):
 
 
 # homGP plot
-qhom_mean, qhom_var = qhom_model.predict(x)
-ax[0,3].plot(x.numpy(), qhom_mean[:, 0].numpy(), color="blue", linewidth=3)
-y_up = qhom_mean[:, 0].numpy() + 1.96 * np.sqrt(qhom_var[:, 0].numpy())
-y_lo = qhom_mean[:, 0].numpy() - 1.96 * np.sqrt(qhom_var[:, 0].numpy())
-ax[0,3].fill_between(x.numpy().flatten(), y_up.flatten(), y_lo.flatten(), alpha=0.3, color="blue")
-
-qhom_mean, qhom_var = qhom_model2.predict(x)
-ax[1,3].plot(x.numpy(), qhom_mean[:, 0].numpy(), color="blue", linewidth=3)
-y_up = qhom_mean[:, 0].numpy() + 1.96 * np.sqrt(qhom_var[:, 0].numpy())
-y_lo = qhom_mean[:, 0].numpy() - 1.96 * np.sqrt(qhom_var[:, 0].numpy())
-ax[1,3].fill_between(x.numpy().flatten(), y_up.flatten(), y_lo.flatten(), alpha=0.3, color="blue")
+qhom_mean, qhom_var = predict_quantiles(qhom_model, x)
+for row, col in enumerate([1, 0]):
+    ax[row, 3].plot(x.numpy(), qhom_mean[:, col].numpy(), color="blue", linewidth=3)
+    y_up = qhom_mean[:, col].numpy() + 1.96 * np.sqrt(qhom_var[:, col].numpy())
+    y_lo = qhom_mean[:, col].numpy() - 1.96 * np.sqrt(qhom_var[:, col].numpy())
+    ax[row, 3].fill_between(x.numpy().flatten(), y_up.flatten(), y_lo.flatten(), alpha=0.3, color="blue")
 
 for row in range(nrows):
     ax[row, 0].set_ylabel("y")
@@ -18,6 +18,12 @@ k_means: Choose points as the centroids from k-mean clustering
 conditional_variance: Choose points following RobustGP
 
 GIBBON: Our new approach (BO-specific)
+
+The number of inducing points can itself be adapted over a run with an InducingPointCountPolicy:
+
+SquareRootSchedule: M grows like the square root of the number of training points
+
+NystromResidual: M grows or shrinks to keep the Nyström residual of the training data in a band
 """
 
 
@@ -242,3 +248,67 @@ class GIBBON(InducingPointSelector):
             chosen_indicies.append(tf.argmax(d_squared))  # get next element
 
         return tf.gather(X, chosen_indicies)
+
+
+def nystrom_residual(X: TensorType, Z: TensorType, kernel: gpflow.kernels.Kernel, jitter: float = 1e-6):
+    """
+    Mean of diag(Kxx - Kxz Kzz⁻¹ Kzx) relative to the mean of diag(Kxx), i.e. the fraction of the
+    prior variance at X that is not explained by inducing points Z. For multi-output kernels the
+    largest value over the latent kernels is returned.
+    """
+    residuals = []
+    for k in getattr(kernel, "kernels", [kernel]):
+        Kzz = k.K(Z) + jitter * tf.eye(len(Z), dtype=Z.dtype)  # [M, M]
+        A = tf.linalg.triangular_solve(tf.linalg.cholesky(Kzz), k.K(Z, X))  # [M, N]
+        Kxx_diag = k.K_diag(X)  # [N]
+        residuals.append(tf.reduce_mean(Kxx_diag - tf.reduce_sum(A ** 2, 0)) / tf.reduce_mean(Kxx_diag))
+    return float(tf.reduce_max(residuals))
+
+
+class InducingPointCountPolicy(ABC):
+    def __init__(self, min_points: int = 10, max_points: int = 500):
+        self._min_points = min_points
+        self._max_points = max_points
+
+    def get_num_points(self, X: TensorType, Z: TensorType, kernel: gpflow.kernels.Kernel) -> int:
+        """
+        :param X: Training data from which inducing points are to be chosen.
+        :param Z: Current inducing points.
+        :param kernel: Gpflow kernel of the layer the inducing points belong to.
+        :return: Number of inducing points to use for X, between `min_points` and
+            min(`max_points`, N), and never fewer than the current number: the layer, its training
+            model and optimizer state are rebuilt whenever the number changes, so it only grows.
+        """
+        M = max(self._get_num_points(X, Z, kernel), len(Z))
+        return int(min(max(M, self._min_points), self._max_points, len(X)))
+
+    @abstractmethod
+    def _get_num_points(self, X: TensorType, Z: TensorType, kernel: gpflow.kernels.Kernel) -> int:
+        raise NotImplementedError
+
+
+class SquareRootSchedule(InducingPointCountPolicy):
+    def __init__(self, scale: float = 2., **kwargs):
+        super().__init__(**kwargs)
+        self._scale = scale
+
+    def _get_num_points(self, X: TensorType, Z: TensorType, kernel: gpflow.kernels.Kernel) -> int:
+        return math.ceil(self._scale * math.sqrt(len(X)))
+
+
+class NystromResidual(InducingPointCountPolicy):
+    """
+    Grows M by `factor` when the current inducing points leave more than `upper` of the prior variance
+    of the training data unexplained.
+    """
+
+    def __init__(self, upper: float = 1e-2, factor: float = 1.5, **kwargs):
+        super().__init__(**kwargs)
+        self._upper = upper
+        self._factor = factor
+
+    def _get_num_points(self, X: TensorType, Z: TensorType, kernel: gpflow.kernels.Kernel) -> int:
+        M = len(Z)
+        if nystrom_residual(X, Z, kernel) > self._upper:
+            return math.ceil(M * self._factor)
+        return M
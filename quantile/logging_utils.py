@@ -0,0 +1,110 @@
+"""
+Optional TensorBoard logging for experiment runs.
+
+BufferedScalarWriter: Keeps scalar summaries in memory and writes them to disk in batches from a
+background thread shared by all writers of the process
+
+make_summary_writer / close_summary_writer: The writer of an experiment, shared by all the models
+built for it until the experiment closes it
+
+BufferedTensorBoard: Keras callback sending the epoch logs of model_keras.fit to a BufferedScalarWriter
+
+Nothing is created when logging is disabled (CONFIG.tensorboard = False), so headless sweeps pay
+no logging cost.
+"""
+
+import atexit
+import queue
+import threading
+
+import tensorflow as tf
+
+
+def experiment_log_dir(CONFIG) -> str:
+    return f"logs/tensorboard/{CONFIG.exp_name}"
+
+
+_writers = {}  # open writers by log directory
+
+
+def make_summary_writer(CONFIG):
+    if not CONFIG.tensorboard:
+        return None
+    log_dir = experiment_log_dir(CONFIG)
+    if log_dir not in _writers:
+        _writers[log_dir] = BufferedScalarWriter(log_dir)
+    return _writers[log_dir]
+
+
+def close_summary_writer(CONFIG) -> None:
+    writer = _writers.pop(experiment_log_dir(CONFIG), None)
+    if writer is not None:
+        writer.close()
+
+
+class BufferedScalarWriter:
+    _queue = queue.Queue()  # batches of all writers, written by a single background thread
+    _thread = None
+
+    def __init__(self, log_dir: str, flush_every: int = 1000):
+        """
+        :param log_dir: Directory of the event files, one per experiment.
+        :param flush_every: Number of buffered scalars that triggers a write.
+        """
+        self._writer = tf.summary.create_file_writer(log_dir)
+        self._flush_every = flush_every
+        self._buffer = []
+        self._closed = False
+        if BufferedScalarWriter._thread is None:
+            BufferedScalarWriter._thread = threading.Thread(target=BufferedScalarWriter._write_batches, daemon=True)
+            BufferedScalarWriter._thread.start()
+        atexit.register(self.close)
+
+    def scalar(self, tag: str, value, step: int) -> None:
+        self._buffer.append((tag, float(value), int(step)))
+        if len(self._buffer) >= self._flush_every:
+            self.flush()
+
+    def scalars(self, tag: str, values, first_step: int) -> None:
+        for i, value in enumerate(values):
+            self.scalar(tag, value, first_step + i)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._queue.put((self._writer, self._buffer))
+            self._buffer = []
+
+    def close(self) -> None:
+        """ Writes the buffered scalars, waits for all pending batches and closes the event file. """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self.flush()
+        self._queue.put((self._writer, None))
+        self._queue.join()
+
+    @staticmethod
+    def _write_batches() -> None:
+        while True:
+            writer, batch = BufferedScalarWriter._queue.get()
+            if batch is None:
+                writer.close()
+            else:
+                with writer.as_default():
+                    for tag, value, step in batch:
+                        tf.summary.scalar(tag, value, step=step)
+                writer.flush()
+            BufferedScalarWriter._queue.task_done()
+
+
+class BufferedTensorBoard(tf.keras.callbacks.Callback):
+    def __init__(self, writer: BufferedScalarWriter):
+        super().__init__()
+        self._writer = writer
+        self._epoch = 0  # counts epochs over all calls to fit, i.e. over BO iterations
+
+    def on_epoch_end(self, epoch, logs=None):
+        for name, value in (logs or {}).items():
+            self._writer.scalar(f"epoch_{name}", value, self._epoch)
+        self._epoch += 1
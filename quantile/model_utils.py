@@ -10,34 +10,43 @@ import trieste.models.gpflow
 from tensorflow_probability.python.distributions.laplace import Laplace
 
 from gpflow.inducing_variables import InducingPoints
-from gpflow.config import default_float
+from gpflow.config import default_float, default_jitter
+from gpflow.covariances import Kuf, Kuu
+from gpflow.kullback_leiblers import gauss_kl
 from gpflow.inducing_variables import InducingVariables, SharedIndependentInducingVariables
 from gpflow.kernels import SeparateIndependent
 from gpflow.models import VGP
 
 from gpflux.layers import LatentVariableLayer
+from gpflux.layers.likelihood_layer import LikelihoodOutputs
 from gpflux.models import DeepGP
 from gpflux.models.deep_gp import sample_dgp
 from gpflux.sampling.kernel_with_feature_decomposition import KernelWithFeatureDecomposition
 from gpflux.sampling.sample import efficient_sample, Sample
 from gpflux.layers.basis_functions.fourier_features import RandomFourierFeaturesCosine
 from gpflux.helpers import construct_basic_inducing_variables
+from gpflux.math import compute_A_inv_b
 
 from trieste.data import Dataset
 from trieste.models.gpflux.models import DeepGaussianProcess
 from trieste.types import TensorType
-from trieste.models.gpflow import VariationalGaussianProcess
+from trieste.models.gpflow import VariationalGaussianProcess, GPflowPredictor
+from trieste.models.interfaces import TrainableProbabilisticModel
 from trieste.models.optimizer import Optimizer, BatchOptimizer
 
 from trieste.logging import get_step_number, get_tensorboard_writer
 
 from typing import Callable, Dict, Any, Optional
-from inducing_point_selector import InducingPointSelector, KMeans
+from inducing_point_selector import InducingPointSelector, KMeans, InducingPointCountPolicy, \
+    SquareRootSchedule, NystromResidual
+from random_features import FEATURE_TYPES, with_feature_dtype, project_features
+from profiling_utils import map_in_chunks
+from logging_utils import BufferedScalarWriter, BufferedTensorBoard, make_summary_writer
 
 tf.keras.backend.set_floatx("float64")
 
 
-def build_model(data, CONFIG, search_space, tb=None):
+def build_model(data, CONFIG, search_space):
     if CONFIG.model == "quantile":
         return build_hetgp_rff_model(data=data,
                                      num_features=CONFIG.num_features,
@@ -45,19 +54,52 @@ def build_model(data, CONFIG, search_space, tb=None):
                                      lambda loc, scale: ASymmetricLaplace(loc, scale, tau=CONFIG.problem.quantile_level),
                                      num_inducing_points=CONFIG.num_inducing_points,
                                      inducing_point_selector=KMeans(search_space),
-                                     tb_callback=tb)
+                                     rff_resample_tolerance=CONFIG.rff_resample_tolerance,
+                                     feature_type=CONFIG.feature_type,
+                                     feature_dtype=CONFIG.feature_precision,
+                                     compress_replicates=CONFIG.compress_replicates,
+                                     use_natgrads=CONFIG.use_natgrads,
+                                     natgrad_gamma=CONFIG.natgrad_gamma,
+                                     natgrad_epochs=CONFIG.natgrad_epochs,
+                                     inducing_count_policy=get_inducing_count_policy(CONFIG),
+                                     summary_writer=make_summary_writer(CONFIG))
     elif CONFIG.model == "hetgp":
         return build_hetgp_rff_model(data=data,
                                      num_features=CONFIG.num_features,
                                      likelihood_distribution=tfp.distributions.Normal,
                                      num_inducing_points=CONFIG.num_inducing_points,
-                                     inducing_point_selector=KMeans(search_space))
+                                     inducing_point_selector=KMeans(search_space),
+                                     rff_resample_tolerance=CONFIG.rff_resample_tolerance,
+                                     feature_type=CONFIG.feature_type,
+                                     feature_dtype=CONFIG.feature_precision,
+                                     compress_replicates=CONFIG.compress_replicates,
+                                     use_natgrads=CONFIG.use_natgrads,
+                                     natgrad_gamma=CONFIG.natgrad_gamma,
+                                     natgrad_epochs=CONFIG.natgrad_epochs,
+                                     inducing_count_policy=get_inducing_count_policy(CONFIG),
+                                     summary_writer=make_summary_writer(CONFIG))
     elif CONFIG.model == "homgp":
         return build_hetgp_rff_model(data=data,
                                      num_features=CONFIG.num_features,
                                      likelihood_distribution=tfp.distributions.Normal,
                                      num_inducing_points=CONFIG.num_inducing_points,
-                                     inducing_point_selector=KMeans(search_space))
+                                     inducing_point_selector=KMeans(search_space),
+                                     homogeneous=True,
+                                     rff_resample_tolerance=CONFIG.rff_resample_tolerance,
+                                     feature_type=CONFIG.feature_type,
+                                     feature_dtype=CONFIG.feature_precision,
+                                     compress_replicates=CONFIG.compress_replicates,
+                                     use_natgrads=CONFIG.use_natgrads,
+                                     natgrad_gamma=CONFIG.natgrad_gamma,
+                                     natgrad_epochs=CONFIG.natgrad_epochs,
+                                     inducing_count_policy=get_inducing_count_policy(CONFIG),
+                                     summary_writer=make_summary_writer(CONFIG))
+    elif CONFIG.model == "homgp_ws":
+        return build_weight_space_model(data,
+                                        num_features=CONFIG.num_features,
+                                        feature_type=CONFIG.feature_type,
+                                        feature_dtype=CONFIG.feature_precision,
+                                        refit_every=CONFIG.refit_every)
     elif CONFIG.model == "GPR":
         return build_quantile_gpr_model(data,
                                         batch_size=CONFIG.batch_size,
@@ -66,6 +108,17 @@ def build_model(data, CONFIG, search_space, tb=None):
         raise NotImplementedError
 
 
+def get_inducing_count_policy(CONFIG):
+    if CONFIG.inducing_policy is None:
+        return None
+    elif CONFIG.inducing_policy == "sqrt":
+        return SquareRootSchedule()
+    elif CONFIG.inducing_policy == "nystrom":
+        return NystromResidual()
+    else:
+        raise NotImplementedError
+
+
 @efficient_sample.register(
     SharedIndependentInducingVariables,
     SeparateIndependent,
@@ -178,15 +231,70 @@ class FeaturedHetGPFluxModel(DeepGaussianProcess):
                  model: DeepGP,
                  optimizer: tf.optimizers.Optimizer | None = None,
                  inducing_point_selector: InducingPointSelector = None,
+                 rff_resample_tolerance: Optional[float] = None,
+                 compress_replicates: bool = False,
+                 use_natgrads: bool = False,
+                 natgrad_gamma: float = 0.1,
+                 natgrad_epochs: int = 50,
+                 inducing_count_policy: Optional[InducingPointCountPolicy] = None,
+                 summary_writer: Optional[BufferedScalarWriter] = None,
                  ):
+        """
+        :param rff_resample_tolerance: Controls when the random Fourier feature bases are redrawn
+            in :meth:`update`. If `None`, the bases drawn when the model is built are kept for the
+            whole run. Otherwise a basis is kept fixed until the lengthscales of its kernel have
+            moved by more than this tolerance (max absolute log-ratio) since the basis was drawn;
+            use `0.` to redraw whenever the lengthscales change.
+        :param compress_replicates: If `True`, observations are grouped by unique input before
+            training (see :func:`group_replicates`), so that the GP layer is evaluated once per
+            unique site. The likelihood layer must then be a :class:`ReplicatedLikelihoodLayer`.
+        :param use_natgrads: If `True`, :meth:`optimize` alternates natural gradient steps on the
+            variational parameters of the GP layer with steps of the Adam optimizer on the remaining
+            parameters, for at most `natgrad_epochs` epochs, instead of training everything with
+            `model_keras.fit`. The batch size and the callbacks (early stopping, learning rate
+            schedule, logging) are taken from the optimizer's fit arguments.
+        :param natgrad_gamma: Step size of the natural gradient optimizer.
+        :param inducing_count_policy: If given, decides at every :meth:`update` how many inducing
+            points to select for the new data. Otherwise the number of inducing points is fixed.
+        :param summary_writer: If given, :meth:`log` is called after every :meth:`optimize` and
+            sends the kernel hyperparameters, q(u) statistics and training loss history to this
+            buffered writer. Otherwise it writes them to the trieste TensorBoard writer, if set.
+        """
 
         super().__init__(model, optimizer)
 
         if inducing_point_selector is None:
             inducing_point_selector = KMeans
         self._inducing_point_selector = inducing_point_selector
+        self._inducing_count_policy = inducing_count_policy
+        self._summary_writer = summary_writer
+
+        self._rff_resample_tolerance = rff_resample_tolerance
+        self._rff_lengthscales: Dict[int, np.ndarray] = {}
+        self._compress_replicates = compress_replicates
+
+        self._use_natgrads = use_natgrads
+        self._natgrad_gamma = natgrad_gamma
+        self._natgrad_epochs = natgrad_epochs
+        self._natgrad_step: Optional[Callable] = None
+        self._loss_history: list = []
+
+        # num_data of the model and its layers, as a variable so that compiled losses read its current value
+        self._num_data = tf.Variable(float(self.model_gpflux.num_data), dtype=default_float(), trainable=False)
+        self.model_gpflux.num_data = self._num_data
+        for layer in self.model_gpflux.f_layers:
+            if hasattr(layer, "num_data"):
+                layer.num_data = self._num_data
 
         self.loss_step = 0
+        self._log_step = 0
+        self._optimized_since_log = False
+        self._training_model = super().model_keras
+
+    @property
+    def model_keras(self) -> tf.keras.Model:
+        """ The keras training model of the current layers, rebuilt when :meth:`update` replaces a GP layer. """
+        return self._training_model
 
     def __repr__(self) -> str:
         """"""
@@ -195,16 +303,96 @@ class FeaturedHetGPFluxModel(DeepGaussianProcess):
     def sample_trajectory(self) -> Callable:
         return sample_dgp(self.model_gpflux)
 
+    def trajectory(self) -> LayerTrajectory:
+        """ A trajectory of the GP layer that is redrawn in place, see :class:`LayerTrajectory`. """
+        return LayerTrajectory(self.model_gpflux)
+
+    def _should_resample_rff(self, kernel: KernelWithFeatureDecomposition) -> bool:
+        if self._rff_resample_tolerance is None:
+            return False
+
+        key = id(kernel.feature_functions)
+        lengthscales = np.atleast_1d(tf.convert_to_tensor(kernel.feature_functions.kernel.lengthscales).numpy())
+        if key not in self._rff_lengthscales:  # basis was drawn at model build
+            self._rff_lengthscales[key] = lengthscales
+            return False
+
+        change = np.max(np.abs(np.log(lengthscales / self._rff_lengthscales[key])))
+        if change > self._rff_resample_tolerance:
+            self._rff_lengthscales[key] = lengthscales
+            return True
+        return False
+
+    def optimize(self, dataset: Dataset) -> None:
+        if self._compress_replicates:
+            unique_points, replicates, observations = group_replicates(dataset.query_points, dataset.observations)
+            self.model_gpflux.likelihood_layer.observations.assign(observations)
+            dataset = Dataset(unique_points, replicates)
+        if self._use_natgrads:
+            self._optimize_with_natgrads(dataset)
+        else:
+            super().optimize(dataset)
+        self._optimized_since_log = True
+        if self._summary_writer is not None:
+            self.log()
+
+    def _optimize_with_natgrads(self, dataset: Dataset) -> None:
+        if self._natgrad_step is None:
+            self._natgrad_step = self._build_natgrad_step(dataset)
+
+        # full batches only, so that the step keeps a single trace and an unbiased scaling of the ELBO
+        batch_size = min(self.optimizer.minimize_args.get("batch_size", len(dataset)), len(dataset))
+        batches = tf.data.Dataset.from_tensor_slices(dataset.astuple()).shuffle(len(dataset)) \
+            .batch(batch_size, drop_remainder=True)
+
+        # the callbacks of the fit arguments stop training, schedule the learning rate and log the epochs
+        callbacks = tf.keras.callbacks.CallbackList(self.optimizer.minimize_args.get("callbacks", []),
+                                                    model=self.model_keras)
+        self.model_keras.stop_training = False
+        callbacks.on_train_begin()
+        self._loss_history = []
+        for epoch in range(self._natgrad_epochs):
+            callbacks.on_epoch_begin(epoch)
+            epoch_loss = np.mean([self._natgrad_step(X, Y).numpy() for X, Y in batches])
+            self._loss_history.append(epoch_loss)
+            callbacks.on_epoch_end(epoch, {"loss": epoch_loss})
+            if self.model_keras.stop_training:
+                break
+        callbacks.on_train_end()
+
+    def _build_natgrad_step(self, dataset: Dataset) -> Callable:
+        layer = self.model_gpflux.f_layers[0]
+        natgrad_optimizer = gpflow.optimizers.NaturalGradient(gamma=self._natgrad_gamma)
+        adam_optimizer = self.optimizer.optimizer
+
+        # variational params are optimized by natgrad only; they stay trainable for the keras path
+        variational_params = [(layer.q_mu, layer.q_sqrt)]
+        variational_refs = {layer.q_mu.unconstrained_variable.ref(), layer.q_sqrt.unconstrained_variable.ref()}
+        model_params = [v for v in self.model_gpflux.trainable_variables if v.ref() not in variational_refs]
+
+        # num_data is a variable (see update), so a new dataset size does not trigger a new trace
+        signature = [tf.TensorSpec([None, dataset.query_points.shape[-1]], default_float()),
+                     tf.TensorSpec([None, None], default_float())]
+
+        @tf.function(input_signature=signature)
+        def natgrad_step(X: TensorType, Y: TensorType) -> tf.Tensor:
+            loss_fn = lambda: -self.model_gpflux.elbo((X, Y))
+            natgrad_optimizer.minimize(loss_fn, variational_params)
+            adam_optimizer.minimize(loss_fn, model_params)
+            return loss_fn() / self.model_gpflux.num_data  # per-datapoint loss, as reported by keras
+
+        return natgrad_step
+
     def update(self, dataset: Dataset) -> None:
         inputs = dataset.query_points
-        new_num_data = inputs.shape[0]
-        self.model_gpflux.num_data = new_num_data
+        if self._compress_replicates:
+            new_num_data = np.unique(inputs.numpy(), axis=0).shape[0]
+        else:
+            new_num_data = inputs.shape[0]
+        self._num_data.assign(new_num_data)
 
-        # Update num_data for each layer, as well as make sure dataset shapes are ok
+        # Make sure dataset shapes are ok
         for i, layer in enumerate(self.model_gpflux.f_layers):
-            if hasattr(layer, "num_data"):
-                layer.num_data = new_num_data
-
             if isinstance(layer, LatentVariableLayer):
                 inputs = layer(inputs)
                 continue
@@ -221,19 +409,17 @@ class FeaturedHetGPFluxModel(DeepGaussianProcess):
                 )
             inputs = layer(inputs)
 
-            if hasattr(layer.kernel, 'feature_functions'): # If using RFF kernel decomp then need to resample for new kernel params
-                feature_function = layer.kernel.feature_functions
-                input_shape = dataset.query_points.shape
-                def renew_rff(feature_f, input_dim):
-                    shape_bias = [1, feature_f.output_dim]
-                    new_b = feature_f._sample_bias(shape_bias, dtype=feature_f.dtype)
-                    feature_f.b = new_b
-                    shape_weights = [feature_f.output_dim, input_dim]
-                    new_W = feature_f._sample_weights(shape_weights, dtype=feature_f.dtype)
-                    feature_f.W = new_W
-                renew_rff(feature_function,  input_shape[-1])
+            # If using RFF kernel decomp then may need to resample for new kernel params
+            for kernel in feature_decomposed_kernels(layer.kernel):
+                if self._should_resample_rff(kernel):
+                    renew_rff(kernel.feature_functions, dataset.query_points.shape[-1])
 
-            num_inducing = layer.inducing_variable.inducing_variable.Z.shape[0]
+            old_Z = layer.inducing_variable.inducing_variable.Z
+            num_inducing = old_Z.shape[0]
+            if self._inducing_count_policy is not None:
+                num_inducing = self._inducing_count_policy.get_num_points(dataset.query_points,
+                                                                          tf.convert_to_tensor(old_Z),
+                                                                          layer.kernel)
 
             Z = self._inducing_point_selector.get_points(dataset.query_points,
                                                          dataset.observations,
@@ -259,70 +445,291 @@ class FeaturedHetGPFluxModel(DeepGaussianProcess):
                 jitter_mat = jitter * tf.eye(num_inducing, dtype=new_f_cov.dtype)
                 new_q_sqrt = tf.linalg.cholesky(new_f_cov + jitter_mat)
 
-            layer.q_mu.assign(new_q_mu)
-            layer.q_sqrt.assign(new_q_sqrt)
-            layer.inducing_variable.inducing_variable.Z.assign(Z)
+            if num_inducing == old_Z.shape[0]:
+                layer.q_mu.assign(new_q_mu)
+                layer.q_sqrt.assign(new_q_sqrt)
+                layer.inducing_variable.inducing_variable.Z.assign(Z)
+            else:
+                layer.inducing_variable.inducing_variable.Z = gpflow.Parameter(Z, trainable=False)
+                self.model_gpflux.f_layers[i] = self._resized_gp_layer(layer, new_q_mu, new_q_sqrt)
+                self._rebuild_training_model()
 
-    def log(self) -> None:
+    def _resized_gp_layer(self, layer: gpflux.layers.GPLayer, q_mu: TensorType,
+                          q_sqrt: TensorType) -> gpflux.layers.GPLayer:
         """
-        Log model-specific information at a given optimization step.
+        A new GP layer with the kernel, inducing variable and mean function of `layer`, and the
+        given q(u). Keras keeps the variables of replaced q(u) parameters in the weights of a layer,
+        so a layer whose number of inducing points changes is rebuilt rather than given new parameters.
         """
-        summary_writer = get_tensorboard_writer()
-
+        new_layer = gpflux.layers.GPLayer(layer.kernel, layer.inducing_variable, num_data=int(self._num_data.numpy()),
+                                          mean_function=layer.mean_function, num_latent_gps=layer.num_latent_gps,
+                                          whiten=layer.whiten, full_cov=layer.full_cov,
+                                          full_output_cov=layer.full_output_cov, num_samples=layer.num_samples,
+                                          name=layer.name, verbose=False)
+        new_layer.num_data = self._num_data
+        new_layer.q_mu.assign(q_mu)
+        new_layer.q_sqrt.assign(q_sqrt)
+        return new_layer
+
+    def _rebuild_training_model(self) -> None:
+        """
+        New keras training model for the current layers of the DeepGP, compiled with the same
+        optimizer. Optimizers with per-variable slots (tf.optimizers before TF 2.11) create the slots
+        of the new q(u) on first use, and keep their step count and the moments of the other
+        parameters. Keras optimizers from TF 2.11 are built once for a fixed list of variables: they
+        are replaced by a copy with the same configuration, learning rate and step count.
+        """
+        optimizer = self.optimizer.optimizer
+        if not hasattr(optimizer, "get_slot"):
+            new_optimizer = optimizer.__class__.from_config(optimizer.get_config())
+            new_optimizer.iterations.assign(optimizer.iterations)
+            self.optimizer.optimizer = new_optimizer
+        self._training_model = self.model_gpflux.as_training_model()
+        self._training_model.compile(self.optimizer.optimizer)
+        self._natgrad_step = None
 
-        if summary_writer:
+    def log(self) -> None:
+        """
+        Log model-specific information at a given optimization step: to the buffered writer of the
+        experiment when there is one (called after every :meth:`optimize`), otherwise to the
+        trieste TensorBoard writer, if set.
+        """
+        if self._summary_writer is not None:
+            if not self._optimized_since_log:  # already logged by optimize
+                return
+            self._optimized_since_log = False
+            for tag, value in self._log_scalars().items():
+                self._summary_writer.scalar(tag, value, self._log_step)
+            loss = self._last_losses()
+            self._summary_writer.scalars("loss", loss, self.loss_step)
+        else:
+            summary_writer = get_tensorboard_writer()
+            if not summary_writer:
+                return
+            loss = self._last_losses()
             with summary_writer.as_default(step=trieste.logging.get_step_number()):
-                layer = self.model_gpflux.f_layers[0]
-
-                lengthscales_f = layer.kernel.kernels[0]._kernel.lengthscales
-                lengthscales_g = layer.kernel.kernels[1]._kernel.lengthscales
-                variance_f = layer.kernel.kernels[0]._kernel.variance
-                variance_g = layer.kernel.kernels[1]._kernel.variance
-
-                tf.summary.scalar("kernel.variance.f", variance_f)
-                tf.summary.scalar("kernel.variance.g", variance_g)
-                for i, lengthscalef in enumerate(lengthscales_f):
-                    tf.summary.scalar(f"kernel.lengthscale.f.{i}", lengthscalef)
-                for i, lengthscaleg in enumerate(lengthscales_g):
-                    tf.summary.scalar(f"kernel.lengthscale.g.{i}", lengthscaleg)
-
-                mean_q_mu = tf.reduce_mean(layer.q_mu, axis=0)
-                mean_q_sqrt = tf.reduce_mean(tf.linalg.diag_part(layer.q_sqrt), axis=0)
-                tf.summary.scalar(f"q_mu.f", mean_q_mu[0])
-                tf.summary.scalar(f"q_mu.g", mean_q_mu[1])
-                tf.summary.scalar(f"diag.q_sqrt.f", mean_q_sqrt[0])
-                tf.summary.scalar(f"diag.q_sqrt.g", mean_q_sqrt[1])
-
-                # tf.summary.histogram(f"q_mu.h.f", layer.q_mu[:, 0])
-                # tf.summary.histogram(f"q_mu.h.g", layer.q_mu[:, 1])
-                # tf.summary.histogram(f"q_sqrt.h.f", tf.linalg.diag_part(layer.q_sqrt)[:, 0])
-                # tf.summary.histogram(f"q_sqrt.h.g", tf.linalg.diag_part(layer.q_sqrt)[:, 1])
-
-                loss = self.model_keras.history.history['loss']
+                for tag, value in self._log_scalars().items():
+                    tf.summary.scalar(tag, value)
                 for i, l in enumerate(loss):
                     tf.summary.scalar(f"loss", l, step=self.loss_step + i)
 
-                self.loss_step = self.loss_step + i
-                # tf.summary.scalar(f"diag.q_sqrt.g", loss[i]. step=)
-                # lr = self.model_keras.history.history['loss']
-
-
-def create_kernel_with_features(var, input_dim, num_features):
+        self.loss_step = self.loss_step + len(loss)
+        self._log_step += 1
+
+    def _last_losses(self) -> list:
+        if self._use_natgrads:
+            return self._loss_history
+        history = self.model_keras.history
+        return history.history['loss'] if history is not None else []
+
+    def _log_scalars(self) -> Dict[str, Any]:
+        layer = self.model_gpflux.f_layers[0]
+
+        lengthscales_f = layer.kernel.kernels[0]._kernel.lengthscales
+        lengthscales_g = layer.kernel.kernels[1]._kernel.lengthscales
+        scalars = {
+            "kernel.variance.f": layer.kernel.kernels[0]._kernel.variance,
+            "kernel.variance.g": layer.kernel.kernels[1]._kernel.variance,
+        }
+        for i, lengthscalef in enumerate(lengthscales_f):
+            scalars[f"kernel.lengthscale.f.{i}"] = lengthscalef
+        for i, lengthscaleg in enumerate(lengthscales_g):
+            scalars[f"kernel.lengthscale.g.{i}"] = lengthscaleg
+
+        mean_q_mu = tf.reduce_mean(layer.q_mu, axis=0)
+        mean_q_sqrt = tf.reduce_mean(tf.linalg.diag_part(layer.q_sqrt), axis=0)
+        scalars["q_mu.f"], scalars["q_mu.g"] = mean_q_mu[0], mean_q_mu[1]
+        scalars["diag.q_sqrt.f"], scalars["diag.q_sqrt.g"] = mean_q_sqrt[0], mean_q_sqrt[1]
+        return {tag: float(tf.convert_to_tensor(value)) for tag, value in scalars.items()}
+
+
+class LayerTrajectory(tf.Module):
+    """
+    Matheron-rule sample of a GP layer with feature-decomposed kernels, as `layer.sample()` (see
+    _efficient_sample_matheron_rule), whose sample weights are variables redrawn in place by
+    :meth:`resample`. A function traced on the trajectory therefore stays valid across samples and
+    BO iterations, as long as the model keeps its GP layer and the layer its variables (see
+    :meth:`is_current`).
+    """
+
+    def __init__(self, model: DeepGP):
+        layer = model.f_layers[0]
+        self._model = model
+        self._layer = layer
+        self._key = self._variables_key()
+        self._prior_weights = [tf.Variable(tf.zeros_like(k.feature_coefficients[:, :1]), trainable=False)
+                               for k in layer.kernel.kernels]  # [L, 1] each
+        self._update_weights = [tf.Variable(tf.zeros_like(layer.q_mu[:, :1]), trainable=False)
+                                for _ in layer.kernel.kernels]  # [M, 1] each
+        self.resample()
+
+    def _variables_key(self) -> tuple:
+        layer = self._model.f_layers[0]
+        return tuple(id(v) for v in (layer, layer.q_mu, layer.q_sqrt, layer.inducing_variable.inducing_variable.Z))
+
+    def is_current(self) -> bool:
+        """ `False` once the GP layer or its variational parameters were replaced (e.g. new number of inducing points). """
+        return self._key == self._variables_key()
+
+    def resample(self) -> None:
+        layer = self._layer
+        inducing_points = layer.inducing_variable.inducing_variable
+        num_inducing = tf.shape(layer.q_mu)[0]
+        for i, kernel in enumerate(layer.kernel.kernels):
+            prior_weights = tf.sqrt(kernel.feature_coefficients) * tf.random.normal(
+                [tf.shape(kernel.feature_coefficients)[0], 1], dtype=default_float())  # [L, 1]
+            u_noise = tf.matmul(layer.q_sqrt[i], tf.random.normal([num_inducing, 1], dtype=default_float()))
+            u_sample = layer.q_mu[:, i:i + 1] + u_noise  # [M, 1]
+            Kmm = Kuu(inducing_points, kernel, jitter=default_jitter())  # [M, M]
+            if layer.whiten:
+                u_sample = tf.matmul(tf.linalg.cholesky(Kmm), u_sample)
+            diff = u_sample - tf.matmul(kernel.feature_functions(inducing_points.Z), prior_weights)
+            self._prior_weights[i].assign(prior_weights)
+            self._update_weights[i].assign(compute_A_inv_b(Kmm, diff))
+
+    def __call__(self, X: TensorType) -> tf.Tensor:
+        layer = self._layer
+        inducing_points = layer.inducing_variable.inducing_variable
+        outputs = [project_features(kernel.feature_functions, X, prior_weights)
+                   + tf.matmul(Kuf(inducing_points, kernel, X), update_weights, transpose_a=True)
+                   for kernel, prior_weights, update_weights
+                   in zip(layer.kernel.kernels, self._prior_weights, self._update_weights)]
+        return tf.concat(outputs, axis=-1) + layer.mean_function(X)  # [N, P]
+
+
+def feature_decomposed_kernels(kernel):
+    """ Returns the (sub-)kernels of `kernel` that carry a random Fourier feature decomposition. """
+    kernels = kernel.kernels if isinstance(kernel, SeparateIndependent) else [kernel]
+    return [k for k in kernels if hasattr(k, 'feature_functions')]
+
+
+def renew_rff(feature_f, input_dim):
+    shape_bias = [1, feature_f.output_dim]
+    new_b = feature_f._sample_bias(shape_bias, dtype=feature_f.dtype)
+    feature_f.b.assign(new_b)  # in place, so that functions traced on the features see the new basis
+    shape_weights = [feature_f.output_dim, input_dim]
+    new_W = feature_f._sample_weights(shape_weights, dtype=feature_f.dtype)
+    feature_f.W.assign(new_W)
+
+
+class CachedFeatureMatrix:
+    """
+    Feature matrix Φ(X) of a growing set of training inputs for a fixed random Fourier feature basis.
+
+    When called with inputs that extend the previously seen ones (as trieste datasets do after each
+    `tell`), only the new rows are evaluated and appended. The whole matrix is recomputed when the
+    basis (W, b) or the kernel hyperparameters scaling the features have changed.
+    """
+
+    def __init__(self, feature_functions):
+        self._feature_functions = feature_functions
+        self._inputs: Optional[np.ndarray] = None
+        self._features: Optional[tf.Tensor] = None
+        self._state: Optional[list] = None
+
+    def _current_state(self) -> list:
+        f = self._feature_functions
+        return [tf.convert_to_tensor(v).numpy() for v in (f.W, f.b, f.kernel.lengthscales, f.kernel.variance)]
+
+    def invalidate(self) -> None:
+        self._inputs, self._features, self._state = None, None, None
+
+    def __call__(self, X: TensorType) -> tf.Tensor:
+        X = np.asarray(X)
+        if not self._feature_functions.built:  # W and b are only created on the first call
+            self._feature_functions.build(X.shape)
+
+        state = self._current_state()
+        if self._state is None or any(not np.array_equal(a, b) for a, b in zip(state, self._state)):
+            self.invalidate()
+
+        num_cached = 0 if self._inputs is None else self._inputs.shape[0]
+        if 0 < num_cached <= X.shape[0] and np.array_equal(X[:num_cached], self._inputs):
+            if X.shape[0] > num_cached:
+                new_features = self._feature_functions(X[num_cached:])
+                self._features = tf.concat([self._features, new_features], axis=0)
+        else:
+            self._features = self._feature_functions(X)
+
+        self._inputs = X.copy()
+        self._state = state
+        return self._features
+
+
+def group_replicates(query_points: TensorType, observations: TensorType):
+    """
+    Group a dataset by unique input.
+
+    :param query_points: Inputs [N, D], possibly with repeated rows.
+    :param observations: Observations [N, 1].
+    :return: The unique inputs [M, D], the replicates of each of them [M, 2] as the offset and the
+        number of its observations, and the observations [N, 1] sorted by input, in order of
+        appearance among the replicates of an input.
+    """
+    X = np.asarray(query_points)
+    unique_points, site, counts = np.unique(X, axis=0, return_inverse=True, return_counts=True)
+    order = np.argsort(site.reshape(-1), kind="stable")
+    replicates = np.stack([np.cumsum(counts) - counts, counts], axis=-1)
+    return (tf.constant(unique_points, dtype=default_float()),
+            tf.constant(replicates, dtype=default_float()),
+            tf.constant(np.asarray(observations)[order], dtype=default_float()))
+
+
+class ReplicatedLikelihoodLayer(gpflux.layers.LikelihoodLayer):
+    """
+    Likelihood layer for data grouped by :func:`group_replicates`: row i of the targets holds the
+    offset and the number of the observations at the i-th unique input in :attr:`observations`,
+    which must be assigned the sorted observations before training. The layer below is evaluated
+    once per unique input, and the variational expectations of its replicates are summed here, so
+    the loss is the mean over sites of the per-site sum. With `num_data` set to the number of
+    unique sites this gives the same ELBO as training on the uncompressed data.
+    """
+
+    def __init__(self, likelihood: gpflow.likelihoods.Likelihood, **kwargs):
+        super().__init__(likelihood, **kwargs)
+        self.observations = tf.Variable(tf.zeros([0, 1], dtype=default_float()), trainable=False,
+                                        shape=tf.TensorShape([None, 1]))
+
+    def call(self, inputs, targets=None, training=None):
+        if not training or targets is None:
+            return super().call(inputs, targets=targets, training=training)
+
+        F_mean = inputs.loc  # [M, L]
+        F_var = inputs.scale.diag ** 2  # [M, L]
+        offsets = tf.cast(targets[:, 0], tf.int32)  # [M]
+        counts = tf.cast(targets[:, 1], tf.int32)  # [M]
+        Y = tf.gather(self.observations, tf.ragged.range(offsets, offsets + counts).flat_values)  # [n, 1]
+
+        ve = self.likelihood.variational_expectations(tf.repeat(F_mean, counts, axis=0),
+                                                      tf.repeat(F_var, counts, axis=0), Y)  # [n]
+        site = tf.repeat(tf.range(tf.shape(counts)[0]), counts)  # [n]
+        self.add_loss(-tf.reduce_mean(tf.math.segment_sum(ve, site)))
+
+        return LikelihoodOutputs(F_mean, F_var, None, None)
+
+
+def create_kernel_with_features(var, input_dim, num_features, feature_type="rff", feature_dtype="float64"):
     kernel = set_kernel(var, input_dim)
     coefficients = np.ones((num_features, 1), dtype=default_float())
-    features = RandomFourierFeaturesCosine(kernel, num_features, dtype=default_float())
+    feature_class = with_feature_dtype(FEATURE_TYPES[feature_type], feature_dtype)
+    features = feature_class(kernel, num_features, dtype=default_float())
     return KernelWithFeatureDecomposition(kernel, features, coefficients)
 
 def build_hetgp_rff_model(data, num_features, likelihood_distribution, num_inducing_points,
-                          inducing_point_selector, homogeneous=False):
+                          inducing_point_selector, homogeneous=False, rff_resample_tolerance=None,
+                          feature_type="rff", likelihood=None, compress_replicates=False, use_natgrads=False,
+                          natgrad_gamma=0.1, natgrad_epochs=50,
+                          inducing_count_policy=None, summary_writer=None, feature_dtype="float64"):
     num_data, input_dim = data.query_points.shape
+    if compress_replicates:
+        num_data = np.unique(data.query_points.numpy(), axis=0).shape[0]
     var = tf.math.reduce_variance(data.observations)
-    kernel_with_features1 = create_kernel_with_features(var / 2., input_dim, num_features)
+    kernel_with_features1 = create_kernel_with_features(var / 2., input_dim, num_features, feature_type, feature_dtype)
     if homogeneous:
-        kernel_with_features2 = create_kernel_with_features(1e-12, input_dim, num_features)
+        kernel_with_features2 = create_kernel_with_features(1e-12, input_dim, num_features, feature_type, feature_dtype)
         gpflow.set_trainable(kernel_with_features2, False)
     else:
-        kernel_with_features2 = create_kernel_with_features(var / 2., input_dim, num_features)
+        kernel_with_features2 = create_kernel_with_features(var / 2., input_dim, num_features, feature_type, feature_dtype)
     kernel_list = [kernel_with_features1, kernel_with_features2]
     kernel = gpflux.helpers.construct_basic_kernel(kernel_list)
 
@@ -336,20 +743,25 @@ def build_hetgp_rff_model(data, num_features, likelihood_distribution, num_induc
     layer = gpflux.layers.GPLayer(kernel, inducing_variable, num_data, whiten=True, num_latent_gps=2,
                                   mean_function=gpflow.mean_functions.Constant(np.zeros([1, 2])))
 
-    likelihood = gpflow.likelihoods.HeteroskedasticTFPConditional(
-        distribution_class=likelihood_distribution,
-        scale_transform=tfp.bijectors.Exp(),
-    )
+    if likelihood is None:
+        likelihood = gpflow.likelihoods.HeteroskedasticTFPConditional(
+            distribution_class=likelihood_distribution,
+            scale_transform=tfp.bijectors.Exp(),
+        )
 
-    likelihood_layer = gpflux.layers.LikelihoodLayer(likelihood)
+    if compress_replicates:
+        likelihood_layer = ReplicatedLikelihoodLayer(likelihood)
+    else:
+        likelihood_layer = gpflux.layers.LikelihoodLayer(likelihood)
     model = gpflux.models.DeepGP([layer], likelihood_layer)
 
     epochs = 300
     batch_size = 200
 
-    callbacks = [gpflux.callbacks.TensorBoard(log_dir="logs/tensorboard/"),
-        tf.keras.callbacks.ReduceLROnPlateau(monitor="loss", patience=10, factor=0.5, verbose=1, min_lr=1e-6),
+    callbacks = [tf.keras.callbacks.ReduceLROnPlateau(monitor="loss", patience=10, factor=0.5, verbose=1, min_lr=1e-6),
         tf.keras.callbacks.EarlyStopping(monitor="loss", patience=50, min_delta=0.01, verbose=0, mode="min"),]
+    if summary_writer is not None:
+        callbacks.append(BufferedTensorBoard(summary_writer))
 
     fit_args = {
         "batch_size": batch_size,
@@ -360,13 +772,277 @@ def build_hetgp_rff_model(data, num_features, likelihood_distribution, num_induc
     optimizer = Optimizer(tf.optimizers.Adam(0.01), fit_args)
 
     return FeaturedHetGPFluxModel(model=model, optimizer=optimizer, #fit_args=fit_args,
-                                  inducing_point_selector=inducing_point_selector)
+                                  inducing_point_selector=inducing_point_selector,
+                                  rff_resample_tolerance=rff_resample_tolerance,
+                                  compress_replicates=compress_replicates,
+                                  use_natgrads=use_natgrads,
+                                  natgrad_gamma=natgrad_gamma,
+                                  natgrad_epochs=natgrad_epochs,
+                                  inducing_count_policy=inducing_count_policy,
+                                  summary_writer=summary_writer)
+
+
+class MultiQuantileLikelihood(gpflow.likelihoods.MultiLatentLikelihood):
+    """
+    Joint likelihood of several quantile levels built on the two latent GPs [f, g] of the hetGP layer.
+    Quantile k is modelled as
+
+        q_k(x) = f(x) + exp(g(x)) c_k,   with c_1 < c_2 < ... < c_K,
+
+    so that the quantile curves can never cross. Each level contributes an asymmetric Laplace
+    term with scale s exp(g(x)), and the log-density of an observation is the sum over levels.
+    The offsets are parametrised as c_1 plus cumulative positive increments, initialised at the
+    standard normal quantiles.
+    """
+
+    def __init__(self, quantile_levels, **kwargs):
+        super().__init__(latent_dim=2, **kwargs)
+        quantile_levels = np.sort(np.asarray(quantile_levels, dtype=default_float()))
+        normal_quantiles = tfp.distributions.Normal(
+            tf.cast(0., default_float()), tf.cast(1., default_float())).quantile(quantile_levels).numpy()
+
+        self.quantile_levels = tf.constant(quantile_levels)
+        self.first_offset = gpflow.Parameter(normal_quantiles[0])
+        self.offset_increments = gpflow.Parameter(np.maximum(np.diff(normal_quantiles), 1e-3),
+                                                  transform=gpflow.utilities.positive())
+        self.scale = gpflow.Parameter(1., transform=gpflow.utilities.positive())
+
+    @property
+    def offsets(self) -> tf.Tensor:
+        """ Increasing offsets c_k [K] """
+        return self.first_offset + tf.concat([tf.zeros([1], dtype=default_float()),
+                                              tf.cumsum(self.offset_increments)], axis=0)
+
+    def quantiles(self, F: TensorType) -> tf.Tensor:
+        """ Quantile curves [..., K] for latent values F [..., 2] """
+        return F[..., 0:1] + tf.exp(F[..., 1:2]) * self.offsets
+
+    def _log_prob(self, F, Y):
+        tau = self.quantile_levels
+        scale = self.scale * tf.exp(F[..., 1:2])  # [..., 1]
+        z = (Y - self.quantiles(F)) / scale  # [..., K]
+        is_neg = 0.5 - 0.5 * tf.sign(z)
+        return tf.reduce_sum(tf.math.log(tau * (1 - tau) / scale) - z * (tau - is_neg), axis=-1)
+
+    def _conditional_mean(self, F):
+        return self.quantiles(F)
+
+    def _conditional_variance(self, F):
+        return tf.zeros_like(self.quantiles(F))
+
+    def _predict_mean_and_var(self, Fmu, Fvar):
+        # f and g are independent, and exp(g) is log-normal under q(g)
+        c = self.offsets
+        f_mean, g_mean = Fmu[..., 0:1], Fmu[..., 1:2]
+        f_var, g_var = Fvar[..., 0:1], Fvar[..., 1:2]
+        scale_mean = tf.exp(g_mean + g_var / 2.)
+        scale_var = (tf.exp(g_var) - 1.) * tf.exp(2. * g_mean + g_var)
+        return f_mean + c * scale_mean, f_var + c ** 2 * scale_var  # [N, K], [N, K]
+
+
+def build_multi_quantile_rff_model(data, quantile_levels, num_features, num_inducing_points,
+                                   inducing_point_selector, homogeneous=False, rff_resample_tolerance=None,
+                                   feature_type="rff"):
+    """
+    One hetGP layer (shared kernels and inducing variables) trained on all `quantile_levels` at once
+    through :class:`MultiQuantileLikelihood`.
+    """
+    return build_hetgp_rff_model(data=data,
+                                 num_features=num_features,
+                                 likelihood_distribution=None,
+                                 num_inducing_points=num_inducing_points,
+                                 inducing_point_selector=inducing_point_selector,
+                                 homogeneous=homogeneous,
+                                 rff_resample_tolerance=rff_resample_tolerance,
+                                 feature_type=feature_type,
+                                 likelihood=MultiQuantileLikelihood(quantile_levels))
+
+
+def predict_quantiles(model: FeaturedHetGPFluxModel, query_points: TensorType):
+    """ Mean and variance [N, K] of the quantile curves of a model built by build_multi_quantile_rff_model. """
+    f_mean, f_var = model.predict(query_points)
+    return model.model_gpflux.likelihood_layer.likelihood.predict_mean_and_var(f_mean, f_var)
+
+class BayesianFeatureRegression(gpflow.models.GPModel, gpflow.models.InternalDataTrainingLossMixin):
+    """
+    Weight-space view of a homoscedastic GP: y = m + Φ(x) w + ε, with w ~ N(0, I), ε ~ N(0, σ²) and
+    Φ the random Fourier features of `kernel`. For a fixed feature basis the posterior over w is
+    Gaussian, with precision A = I + ΦᵀΦ / σ² and mean A⁻¹ Φᵀ (y - m) / σ².
+
+    The posterior is cached as the Cholesky factor of A and the weight mean, so that predictions
+    cost O(F²) per point. :meth:`refresh_posterior` recomputes it from the data in O(N F² + F³),
+    and :meth:`add_data` folds in new rows with rank-one Cholesky updates in O(k F²).
+    """
+
+    def __init__(self, data, kernel, feature_functions, noise_variance=1.0):
+        X, Y = data
+        super().__init__(kernel, gpflow.likelihoods.Gaussian(noise_variance),
+                         mean_function=gpflow.mean_functions.Constant(tf.reduce_mean(Y, axis=0)),
+                         num_latent_gps=1)
+        self.data = (tf.Variable(X, trainable=False, shape=[None, X.shape[-1]]),
+                     tf.Variable(Y, trainable=False, shape=[None, Y.shape[-1]]))
+        self.feature_functions = feature_functions
+        self._feature_cache = CachedFeatureMatrix(feature_functions)
+
+        num_features = feature_functions.output_dim
+        self._posterior_chol = tf.Variable(tf.eye(num_features, dtype=default_float()), trainable=False)
+        self._posterior_mean = tf.Variable(tf.zeros([num_features, 1], dtype=default_float()), trainable=False)
+        self._projected_residuals = tf.Variable(tf.zeros([num_features, 1], dtype=default_float()), trainable=False)
+        self.refresh_posterior()
+
+    def _hyperparameters(self) -> list:
+        return [tf.convert_to_tensor(p).numpy() for p in self.parameters]
+
+    def maximum_log_likelihood_objective(self) -> tf.Tensor:
+        X, Y = self.data
+        Phi = self.feature_functions(X)  # [N, F]
+        noise = self.likelihood.variance
+        residuals = Y - self.mean_function(X)  # [N, 1]
+
+        A = tf.eye(tf.shape(Phi)[-1], dtype=Phi.dtype) + tf.matmul(Phi, Phi, transpose_a=True) / noise
+        L = tf.linalg.cholesky(A)  # [F, F]
+        alpha = tf.linalg.triangular_solve(L, tf.matmul(Phi, residuals, transpose_a=True)) / noise  # [F, 1]
+
+        num_data = tf.cast(tf.shape(Y)[0], Y.dtype)
+        return (- 0.5 * num_data * np.log(2 * np.pi)
+                - 0.5 * num_data * tf.math.log(noise)
+                - tf.reduce_sum(tf.math.log(tf.linalg.diag_part(L)))
+                - 0.5 * tf.reduce_sum(tf.square(residuals)) / noise
+                + 0.5 * tf.reduce_sum(tf.square(alpha)))
+
+    def refresh_posterior(self) -> None:
+        """ Recomputes the weight posterior from all the data, e.g. after a hyperparameter change. """
+        X, Y = self.data
+        Phi = self._feature_cache(X.numpy())  # [N, F]
+        noise = self.likelihood.variance
+        A = tf.eye(tf.shape(Phi)[-1], dtype=Phi.dtype) + tf.matmul(Phi, Phi, transpose_a=True) / noise
+        self._posterior_chol.assign(tf.linalg.cholesky(A))
+        self._projected_residuals.assign(tf.matmul(Phi, Y - self.mean_function(X), transpose_a=True))
+        self._update_posterior_mean()
+        self._posterior_hyperparameters = self._hyperparameters()
+
+    def add_data(self, X_new: TensorType, Y_new: TensorType) -> None:
+        """ Appends k rows to the data and updates the posterior in O(k F²), keeping the hyperparameters. """
+        X = tf.concat([self.data[0], X_new], axis=0)
+        self.data[0].assign(X)
+        self.data[1].assign(tf.concat([self.data[1], Y_new], axis=0))
+        if self._hyperparameters_changed():
+            self.refresh_posterior()
+            return
+
+        Phi_new = self._feature_cache(X.numpy())[-X_new.shape[0]:]  # [k, F]
+        scaled_rows = Phi_new / tf.sqrt(self.likelihood.variance)
+        chol = tf.convert_to_tensor(self._posterior_chol)
+        for row in tf.unstack(scaled_rows):
+            chol = tfp.math.cholesky_update(chol, row)
+        self._posterior_chol.assign(chol)
+        self._projected_residuals.assign_add(tf.matmul(Phi_new, Y_new - self.mean_function(X_new), transpose_a=True))
+        self._update_posterior_mean()
+
+    def _hyperparameters_changed(self) -> bool:
+        return any(not np.array_equal(a, b) for a, b in zip(self._hyperparameters(), self._posterior_hyperparameters))
+
+    def _update_posterior_mean(self) -> None:
+        tmp = tf.linalg.triangular_solve(self._posterior_chol, self._projected_residuals)
+        mean = tf.linalg.triangular_solve(self._posterior_chol, tmp, adjoint=True)
+        self._posterior_mean.assign(mean / self.likelihood.variance)
+
+    def predict_f(self, Xnew: TensorType, full_cov: bool = False, full_output_cov: bool = False):
+        Phi = self.feature_functions(Xnew)  # [M, F]
+        mean = self.mean_function(Xnew) + tf.matmul(Phi, self._posterior_mean)  # [M, 1]
+        V = tf.linalg.triangular_solve(self._posterior_chol, tf.transpose(Phi))  # [F, M]
+        if full_cov:
+            return mean, tf.matmul(V, V, transpose_a=True)[None, ...]  # [1, M, M]
+        return mean, tf.reduce_sum(tf.square(V), axis=0)[:, None]  # [M, 1]
+
+    def sample_weights(self) -> tf.Tensor:
+        """ Draws w ~ q(w) = N(A⁻¹ Φᵀ (y - m) / σ², A⁻¹) exactly. """
+        eps = tf.random.normal(self._posterior_mean.shape, dtype=self._posterior_mean.dtype)
+        return self._posterior_mean + tf.linalg.triangular_solve(self._posterior_chol, eps, adjoint=True)
+
+
+class WeightSpaceGPModel(GPflowPredictor, TrainableProbabilisticModel):
+    """
+    Trieste wrapper of :class:`BayesianFeatureRegression`. `update` adds the new observations with
+    rank-k posterior updates; `optimize` fits the hyperparameters by marginal likelihood every
+    `refit_every` calls, after which the posterior is recomputed with the new features.
+    """
+
+    def __init__(self, model: BayesianFeatureRegression, optimizer: Optimizer | None = None, refit_every: int = 1):
+        super().__init__(optimizer)
+        self._model = model
+        self._refit_every = refit_every
+        self._num_optimize_calls = 0
+
+    def __repr__(self) -> str:
+        """"""
+        return f"WeightSpaceGPModel({self.model!r}, {self.optimizer!r}, {self._refit_every!r})"
+
+    @property
+    def model(self) -> BayesianFeatureRegression:
+        return self._model
+
+    def update(self, dataset: Dataset) -> None:
+        num_data = int(tf.shape(self.model.data[0])[0])
+        tf.debugging.assert_equal(dataset.query_points[:num_data], self.model.data[0],
+                                  message="WeightSpaceGPModel expects the dataset to extend the previous one.")
+        if len(dataset) > num_data:
+            self.model.add_data(dataset.query_points[num_data:], dataset.observations[num_data:])
+
+    def optimize(self, dataset: Dataset) -> None:
+        if self._num_optimize_calls % self._refit_every == 0:
+            self.optimizer.optimize(self.model, dataset)
+            self.model.refresh_posterior()
+        self._num_optimize_calls += 1
+
+    def sample_trajectory(self) -> Callable:
+        weights = self.model.sample_weights()  # [F, 1]
+        return lambda X: self.model.mean_function(X) + project_features(self.model.feature_functions, X, weights)
+
+    def trajectory(self) -> WeightSpaceTrajectory:
+        return WeightSpaceTrajectory(self.model)
+
+
+class WeightSpaceTrajectory(tf.Module):
+    """ Posterior sample of a :class:`BayesianFeatureRegression` whose weights are redrawn in place. """
+
+    def __init__(self, model: BayesianFeatureRegression):
+        self._model = model
+        self._weights = tf.Variable(model.sample_weights(), trainable=False)  # [F, 1]
+
+    def is_current(self) -> bool:
+        return True
+
+    def resample(self) -> None:
+        self._weights.assign(self._model.sample_weights())
+
+    def __call__(self, X: TensorType) -> tf.Tensor:
+        return self._model.mean_function(X) + project_features(self._model.feature_functions, X, self._weights)
+
+
+def build_weight_space_model(data, num_features, feature_type="rff", refit_every=1, feature_dtype="float64"):
+    var = tf.math.reduce_variance(data.observations)
+    kernel_with_features = create_kernel_with_features(var, data.query_points.shape[-1], num_features, feature_type,
+                                                       feature_dtype)
+    model = BayesianFeatureRegression(data.astuple(), kernel_with_features._kernel,
+                                      kernel_with_features.feature_functions, noise_variance=var / 10.)
+    return WeightSpaceGPModel(model, Optimizer(gpflow.optimizers.Scipy()), refit_every=refit_every)
+
 
 from trieste.utils import DEFAULTS, jit
 from trieste.models.gpflow.utils import assert_data_is_compatible
 
 
 class QuantileVGP(VariationalGaussianProcess):
+    """
+    VGP on the aggregated (quantile, bootstrap variance) data of each unique site.
+
+    The training data and the variational parameters are stored with a fixed capacity of sites,
+    see :func:`pad_sites`. Padding sites do not change the ELBO or the predictions, and the
+    capacity is doubled only when it is exceeded, so that the compiled optimization step is traced
+    once per capacity rather than at every BO iteration.
+    """
+
     def __init__(
         self,
         model: VGP,
@@ -375,10 +1051,26 @@ class QuantileVGP(VariationalGaussianProcess):
         natgrad_gamma: Optional[float] = None,
         quantile_level: Optional[float] = 0.5,
         batch_size: Optional[float] = 1,
+        tolerance: float = 1e-6,
+        minibatch_size: Optional[int] = None,
     ):
+        """
+        :param tolerance: The natural gradient loop stops when the relative change of the loss
+            between two steps falls below this value, or after `optimizer.max_iter` steps.
+        :param minibatch_size: If given, each step uses an unbiased estimate of the ELBO from this
+            many randomly chosen sites, and the stopping rule is applied to an exponential moving
+            average of the loss.
+        """
         super().__init__(model, optimizer, use_natgrads, natgrad_gamma)
         self.quantile_level = quantile_level
         self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.minibatch_size = minibatch_size
+        self._optimization_loop: Optional[Callable] = None
+
+    @property
+    def capacity(self) -> int:
+        return int(self.model.num_data)
 
     def update(self, dataset: Dataset, *, jitter: float = DEFAULTS.JITTER) -> None:
         """
@@ -391,28 +1083,35 @@ class QuantileVGP(VariationalGaussianProcess):
         model = self.model
 
         x, y = self.model.data[0].value(), self.model.data[1].value()
-        new_data = aggregate_data(dataset, self.batch_size, self.quantile_level)
+        aggregated_data = aggregate_data(dataset, self.batch_size, self.quantile_level)
+        capacity = max(self.capacity, site_capacity(len(aggregated_data)))
+        new_data = pad_sites(aggregated_data, capacity)
         assert_data_is_compatible(new_data, Dataset(x, y))
 
         f_mu, f_cov = self.model.predict_f(new_data.query_points, full_cov=True)  # [N, L], [L, N, N]
 
         # GPflow's VGP model is hard-coded to use the whitened representation, i.e.
-        # q_mu and q_sqrt parametrise q(v), and u = f(X) = L v, where L = cholesky(K(X, X))
+        # q_mu and q_sqrt parametrise q(v), and u = f(X) = L v + m(X), where L = cholesky(K(X, X))
         # Hence we need to back-transform from f_mu and f_cov to obtain the updated
         # new_q_mu and new_q_sqrt:
         Knn = model.kernel(new_data.query_points, full_cov=True)  # [N, N]
-        jitter_mat = jitter * tf.eye(len(new_data), dtype=Knn.dtype)
+        jitter_mat = jitter * tf.eye(capacity, dtype=Knn.dtype)
         Lnn = tf.linalg.cholesky(Knn + jitter_mat)  # [N, N]
-        new_q_mu = tf.linalg.triangular_solve(Lnn, f_mu)  # [N, L]
+        new_q_mu = tf.linalg.triangular_solve(Lnn, f_mu - model.mean_function(new_data.query_points))  # [N, L]
         tmp = tf.linalg.triangular_solve(Lnn[None], f_cov)  # [L, N, N], L⁻¹ f_cov
         S_v = tf.linalg.triangular_solve(Lnn[None], tf.linalg.matrix_transpose(tmp))  # [L, N, N]
         new_q_sqrt = tf.linalg.cholesky(S_v + jitter_mat)  # [L, N, N]
 
         model.data[0].assign(new_data.query_points)
         model.data[1].assign(new_data.observations)
-        model.num_data = len(new_data)
-        model.q_mu = gpflow.Parameter(new_q_mu)
-        model.q_sqrt = gpflow.Parameter(new_q_sqrt, transform=gpflow.utilities.triangular())
+        if capacity == self.capacity:
+            model.q_mu.assign(new_q_mu)
+            model.q_sqrt.assign(new_q_sqrt)
+        else:  # capacity grows: new variables, so the compiled step has to be traced again
+            model.num_data = capacity
+            model.q_mu = gpflow.Parameter(new_q_mu)
+            model.q_sqrt = gpflow.Parameter(new_q_sqrt, transform=gpflow.utilities.triangular())
+            self._optimization_loop = None
 
     def optimize(self, dataset: Dataset) -> None:
         """
@@ -429,26 +1128,14 @@ class QuantileVGP(VariationalGaussianProcess):
         model = self.model
 
         if self._use_natgrads:  # optimize variational params with natgrad optimizer
-
-            natgrad_optimizer = gpflow.optimizers.NaturalGradient(gamma=self._natgrad_gamma)
-            base_optimizer = self.optimizer
-
             gpflow.set_trainable(model.q_mu, False)  # variational params optimized by natgrad
             gpflow.set_trainable(model.q_sqrt, False)
-            variational_params = [(model.q_mu, model.q_sqrt)]
-            model_params = model.trainable_variables
-
-            loss_fn = base_optimizer.create_loss(model, dataset)
 
-            @jit(apply=self.optimizer.compile)
-            def perform_optimization_step() -> None:  # alternate with natgrad optimizations
-                natgrad_optimizer.minimize(loss_fn, variational_params)
-                base_optimizer.optimizer.minimize(
-                    loss_fn, model_params, **base_optimizer.minimize_args
-                )
+            if self._optimization_loop is None:
+                self._optimization_loop = self._build_optimization_loop()
 
-            for _ in range(base_optimizer.max_iter):  # type: ignore
-                perform_optimization_step()
+            self._optimization_loop(tf.constant(self.optimizer.max_iter),
+                                    tf.constant(self.tolerance, dtype=default_float()))
 
             gpflow.set_trainable(model.q_mu, True)  # revert varitional params to trainable
             gpflow.set_trainable(model.q_sqrt, True)
@@ -456,14 +1143,124 @@ class QuantileVGP(VariationalGaussianProcess):
         else:
             self.optimizer.optimize(model, dataset)
 
+    def _build_optimization_loop(self) -> Callable:
+        model = self.model
+        natgrad_optimizer = gpflow.optimizers.NaturalGradient(gamma=self._natgrad_gamma)
+        base_optimizer = self.optimizer
+
+        variational_params = [(model.q_mu, model.q_sqrt)]
+        model_params = model.trainable_variables
+        smoothing = 0. if self.minibatch_size is None else 0.9
+
+        def perform_optimization_step() -> tf.Tensor:  # alternate with natgrad optimizations
+            if self.minibatch_size is None:
+                natgrad_optimizer.minimize(model.training_loss, variational_params)
+                base_optimizer.optimizer.minimize(
+                    model.training_loss, model_params, **base_optimizer.minimize_args
+                )
+                return model.training_loss()
+
+            # the natgrad step does not change the kernel, so both steps share one factorisation of K
+            tape = tf.GradientTape(watch_accessed_variables=False)
+            tape.watch(model_params)
+            with tape:
+                L = self._kernel_cholesky()
+            natgrad_optimizer.minimize(lambda: self._minibatch_loss(tf.stop_gradient(L)), variational_params)
+            with tape:
+                loss = self._minibatch_loss(L)
+            gradients = tape.gradient(loss, model_params)
+            base_optimizer.optimizer.apply_gradients(
+                [(g, v) for g, v in zip(gradients, model_params) if g is not None]
+            )
+            return loss
+
+        @jit(apply=self.optimizer.compile)
+        def optimization_loop(max_iter: tf.Tensor, tolerance: tf.Tensor) -> tf.Tensor:
+            def cond(i, loss, previous_loss):
+                return tf.logical_and(i < max_iter, tf.abs(previous_loss - loss) > tolerance * tf.abs(loss))
+
+            def body(i, loss, previous_loss):
+                new_loss = smoothing * loss + (1. - smoothing) * perform_optimization_step()
+                return i + 1, new_loss, loss
+
+            # the first step runs outside the loop, since it creates the optimizer slot variables
+            initial_loss = perform_optimization_step()
+            inf = tf.constant(np.inf, dtype=initial_loss.dtype)
+            num_iter, loss, _ = tf.while_loop(cond, body, (tf.constant(1), initial_loss, inf))
+            return num_iter
+
+        return optimization_loop
+
+    def _kernel_cholesky(self) -> tf.Tensor:
+        X = self.model.data[0]
+        K = self.model.kernel(X) + default_jitter() * tf.eye(tf.shape(X)[0], dtype=default_float())
+        return tf.linalg.cholesky(K)  # [C, C]
+
+    def _minibatch_loss(self, L: TensorType) -> tf.Tensor:
+        """
+        Unbiased estimate of the training loss (negative ELBO minus the log prior density of the
+        hyperparameters), with the likelihood term estimated on a random subset of the real sites.
+        Only the rows of L = cholesky(K) at those sites are used to form q(f), which avoids the
+        [C, C] x [C, C] product with q_sqrt of the full ELBO.
+
+        :param L: Cholesky factor of the kernel matrix of all sites, see :meth:`_kernel_cholesky`.
+        """
+        model = self.model
+        X, Y = model.data
+        num_sites = tf.cast(tf.reduce_sum(Y[:, 2]), tf.int32)
+        batch = tf.random.shuffle(tf.range(num_sites))[:self.minibatch_size]  # [B]
+
+        L_batch = tf.gather(L, batch)  # [B, C]
+        X_batch, Y_batch = tf.gather(X, batch), tf.gather(Y, batch)
+
+        f_mean = tf.matmul(L_batch, model.q_mu) + model.mean_function(X_batch)  # [B, L]
+        LS = tf.matmul(L_batch[None], tf.linalg.band_part(model.q_sqrt, -1, 0))  # [L, B, C]
+        f_var = tf.transpose(tf.reduce_sum(tf.square(LS), axis=-1))  # [B, L]
+
+        var_exp = model.likelihood.variational_expectations(f_mean, f_var, Y_batch)  # [B]
+        scale = tf.cast(num_sites, default_float()) / tf.cast(tf.shape(batch)[0], default_float())
+        elbo = scale * tf.reduce_sum(var_exp) - gauss_kl(model.q_mu, model.q_sqrt)
+        return -(elbo + model.log_prior_density())
+
+
+PARKING_DISTANCE = 1e6
+
+
+def site_capacity(num_sites: int, minimum: int = 16) -> int:
+    """ Smallest power of two (at least `minimum`) that holds `num_sites` sites. """
+    return max(minimum, int(2 ** np.ceil(np.log2(num_sites))))
+
+
+def pad_sites(data: Dataset, capacity: int) -> Dataset:
+    """
+    Pad aggregated data with query points [M, D] and observations [M, 2] (quantile, variance) to
+    `capacity` sites. A third observation column is 1 for the M real sites and 0 for the padding,
+    which :class:`HeteroskedasticGaussian` uses to drop the padding from the likelihood. Padding
+    inputs are placed far from the search space and from each other so that they are a priori
+    independent of everything else. Since they come after the real sites in the whitened VGP
+    parametrisation, they cannot change f at the real sites, and q(v) stays at the prior on them.
+    """
+    num_sites, input_dim = data.query_points.shape
+    num_padding = capacity - num_sites
+    dtype = data.query_points.dtype
+
+    parking = PARKING_DISTANCE * tf.range(1, num_padding + 1, dtype=dtype)[:, None]  # [P, 1]
+    query_points = tf.concat([data.query_points, tf.tile(parking, [1, input_dim])], axis=0)  # [C, D]
+
+    padding = tf.concat([tf.zeros([num_padding, 1], dtype), tf.ones([num_padding, 1], dtype)], axis=-1)
+    observations = tf.concat([data.observations, padding], axis=0)  # [C, 2]
+    mask = tf.concat([tf.ones([num_sites, 1], dtype), tf.zeros([num_padding, 1], dtype)], axis=0)  # [C, 1]
+    return Dataset(query_points, tf.concat([observations, mask], axis=-1))
+
 
 def build_quantile_gpr_model(data, batch_size, quantile_level):
     var = tf.math.reduce_variance(data.observations)
     kernel = set_kernel(var, data.query_points.shape[1])
     meanf = gpflow.mean_functions.Constant()
     aggregated_data = aggregate_data(data, batch_size, quantile_level)
+    padded_data = pad_sites(aggregated_data, site_capacity(len(aggregated_data)))
     lik = HeteroskedasticGaussian()
-    model = gpflow.models.VGP(aggregated_data.astuple(), kernel=kernel,
+    model = gpflow.models.VGP(padded_data.astuple(), kernel=kernel,
                               likelihood=lik, num_latent_gps=1, mean_function=meanf)
     return QuantileVGP(model=model, use_natgrads=True, batch_size=batch_size, quantile_level=quantile_level,
                                      optimizer=BatchOptimizer(tf.optimizers.Adam(), batch_size=100))
@@ -487,29 +1284,35 @@ def aggregate_data(data, batch_size, quantile_level):
 def get_variance_by_bootstrap(observations, quantile_level, boot_sample_size=100):
     # observations comes in [M, B, L]
     ind = np.random.choice(observations.shape[1], [boot_sample_size, observations.shape[1]])  # [boot, B]
-    bootstrapped_data = tf.gather(observations, ind, axis=1)  # [M, B, L] -> [M, boot, B, L]
-    bootstrapped_quantiles = tfp.stats.percentile(bootstrapped_data, quantile_level * 100, axis=2)  # [B, M, L]
-    var = tf.math.reduce_variance(bootstrapped_quantiles, axis=1)  # [M, L]
-    return var
+
+    def bootstrap_variance(observations_chunk):
+        bootstrapped_data = tf.gather(observations_chunk, ind, axis=1)  # [M, B, L] -> [M, boot, B, L]
+        bootstrapped_quantiles = tfp.stats.percentile(bootstrapped_data, quantile_level * 100, axis=2)  # [M, boot, L]
+        return tf.math.reduce_variance(bootstrapped_quantiles, axis=1)  # [M, L]
+
+    # the gather and the sort in percentile each hold a [boot, B, L] block per site
+    bytes_per_site = 2 * 8 * boot_sample_size * observations.shape[1] * observations.shape[2]
+    return map_in_chunks(bootstrap_variance, observations, bytes_per_site)
 
 
 class HeteroskedasticGaussian(gpflow.likelihoods.Likelihood):
     def __init__(self, **kwargs):
-        # this likelihood expects a single latent function F, and two columns in the data matrix Y:
-        super().__init__(latent_dim=1, observation_dim=2)
+        # this likelihood expects a single latent function F, and three columns in the data matrix Y:
+        # observation, noise variance and a 0/1 mask that switches off padding sites (see pad_sites)
+        super().__init__(latent_dim=1, observation_dim=3)
 
     def _log_prob(self, F, Y):
         # log_prob is used by the quadrature fallback of variational_expectations and predict_log_density.
         # Because variational_expectations is implemented analytically below, this is not actually needed,
         # but is included for pedagogical purposes.
         # Note that currently relying on the quadrature would fail due to https://github.com/GPflow/GPflow/issues/966
-        Y, NoiseVar = Y[:, 0], Y[:, 1]
-        return gpflow.logdensities.gaussian(Y, F, NoiseVar)
+        Y, NoiseVar, Mask = Y[:, 0], Y[:, 1], Y[:, 2]
+        return Mask * gpflow.logdensities.gaussian(Y, F[:, 0], NoiseVar)
 
     def _variational_expectations(self, Fmu, Fvar, Y):
-        Y, NoiseVar = Y[:, 0], Y[:, 1]
+        Y, NoiseVar, Mask = Y[:, 0], Y[:, 1], Y[:, 2]
         Fmu, Fvar = Fmu[:, 0], Fvar[:, 0]
-        return (
+        return Mask * (
             -0.5 * np.log(2 * np.pi)
             - 0.5 * tf.math.log(NoiseVar)
             - 0.5 * (tf.math.square(Y - Fmu) + Fvar) / NoiseVar
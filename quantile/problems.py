@@ -3,6 +3,7 @@ import tensorflow_probability as tfp
 from trieste.objectives import scaled_branin, hartmann_3, SCALED_BRANIN_MINIMUM
 from trieste.space import Box
 from scipy.stats import norm
+from profiling_utils import get_chunk_size
 
 class Problem:
     fun = None
@@ -14,7 +15,11 @@ class Problem:
     minimum:float
 
 
-def get_problem(name):
+def get_problem(name, minimum=None):
+    """
+    :param minimum: Minimum of the quantile function, e.g. shared by the sweep driver (see
+        :func:`get_problem_data`). Estimated by sampling if `None`.
+    """
     problem = Problem
     if name == "gauss_noise_branin":
         noise = .1
@@ -39,7 +44,7 @@ def get_problem(name):
         problem.upper_bounds = [1., 1.]
         problem.quantile_level = quantile_level
         problem.dim = 2
-        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000)
+        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000) if minimum is None else minimum
 
         return problem
 
@@ -66,7 +71,7 @@ def get_problem(name):
         problem.upper_bounds = [1., 1.]
         problem.quantile_level = quantile_level
         problem.dim = 2
-        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000)
+        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000) if minimum is None else minimum
 
         return problem
 
@@ -94,7 +99,7 @@ def get_problem(name):
         problem.quantile_fun = quantile_fun
         problem.quantile_level = quantile_level
         problem.dim = 3
-        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000)
+        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000) if minimum is None else minimum
         return problem
 
     elif name == "flat_branin_noise":
@@ -118,7 +123,7 @@ def get_problem(name):
         problem.quantile_fun = quantile_fun
         problem.quantile_level = quantile_level
         problem.dim = 2
-        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000)
+        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 1000000) if minimum is None else minimum
         return problem
 
     elif name == "1d":
@@ -156,11 +161,22 @@ def get_problem(name):
         problem.quantile_fun = quantile_fun
         problem.quantile_level = quantile_level
         problem.dim = 1
-        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 100000)
+        problem.minimum = get_minimum(problem.quantile_fun, problem.lower_bounds, problem.upper_bounds, 100000) if minimum is None else minimum
         return problem
 
 
+def get_problem_data(name):
+    """ The expensive parts of a problem, computed once by the sweep driver and passed to `get_problem`. """
+    return dict(minimum=get_problem(name).minimum)
+
+
 def get_minimum(fun, lb, ub, num_samples):
-    points = Box(lb, ub).sample(num_samples)
-    y = fun(points)
-    return tf.reduce_min(y).numpy()
+    space = Box(lb, ub)
+    # each sample [D] and its value, and as much again for the intermediate results of `fun`
+    bytes_per_sample = 2 * space.lower.dtype.size * (int(tf.size(space.lower)) + 1)
+    chunk_size = get_chunk_size(bytes_per_sample, num_samples)
+    minimum = float("inf")
+    for start in range(0, num_samples, chunk_size):
+        points = space.sample(min(chunk_size, num_samples - start))
+        minimum = min(minimum, tf.reduce_min(fun(points)).numpy())
+    return minimum
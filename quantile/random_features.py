@@ -0,0 +1,148 @@
+"""
+Random Fourier feature constructions that need fewer features than plain Monte Carlo
+frequencies for the same kernel approximation error.
+
+rff: RandomFourierFeaturesCosine, i.i.d. frequencies from the spectral density
+
+orf: Orthogonal random features, frequencies orthogonal within blocks of input_dim rows
+
+qmc: Frequencies obtained by pushing a scrambled Sobol sequence through the inverse spectral CDF
+
+Any of them can evaluate its features in reduced precision (see with_feature_dtype), while the
+hyperparameters, weights and everything downstream of the feature matrix stay in float64. Trajectories
+(see project_features) also keep the product of the features with their weights in reduced precision.
+"""
+
+import numpy as np
+import gpflow
+import tensorflow as tf
+from scipy.stats import chi2, norm, qmc
+
+from gpflux.layers.basis_functions.fourier_features import RandomFourierFeaturesCosine
+
+from trieste.types import TensorType
+
+
+def spectral_degrees_of_freedom(kernel: gpflow.kernels.Kernel):
+    """
+    Degrees of freedom of the multivariate Student-t spectral density of a Matérn kernel,
+    or `None` for the squared exponential kernel whose spectral density is Gaussian.
+    """
+    if isinstance(kernel, gpflow.kernels.SquaredExponential):
+        return None
+    elif isinstance(kernel, gpflow.kernels.Matern12):
+        return 1.
+    elif isinstance(kernel, gpflow.kernels.Matern32):
+        return 3.
+    elif isinstance(kernel, gpflow.kernels.Matern52):
+        return 5.
+    else:
+        raise NotImplementedError(f"No spectral density available for {kernel.__class__.__name__}")
+
+
+class StructuredFeaturesCosine(RandomFourierFeaturesCosine):
+    """
+    Base class for cosine random features that only change how the frequencies W are drawn.
+    The same sampler is used when the layer is built and when `renew_rff` redraws the basis.
+    """
+
+    def _weights_init(self, shape: TensorType, dtype=None) -> TensorType:
+        return self._sample_weights(shape, dtype=dtype)
+
+    def _sample_weights(self, shape: TensorType, dtype=None) -> TensorType:
+        raise NotImplementedError
+
+
+class OrthogonalRandomFeaturesCosine(StructuredFeaturesCosine):
+    """
+    Orthogonal random features (Yu et al., 2016): within each block of `input_dim` rows the
+    frequency directions are orthonormal, while the frequency norms follow the same radial
+    distribution as i.i.d. draws from the spectral density.
+    """
+
+    def _sample_weights(self, shape: TensorType, dtype=None) -> TensorType:
+        num_features, input_dim = int(shape[0]), int(shape[1])
+        num_blocks = int(np.ceil(num_features / input_dim))
+
+        gaussian = tf.random.normal([num_blocks, input_dim, input_dim], dtype=dtype)
+        q, r = tf.linalg.qr(gaussian)  # [B, D, D]
+        q = q * tf.sign(tf.linalg.diag_part(r))[:, None, :]  # Haar-distributed rotations
+        directions = tf.reshape(tf.linalg.matrix_transpose(q), [-1, input_dim])[:num_features]  # [F, D]
+
+        norms = tf.norm(tf.random.normal([num_features, input_dim], dtype=dtype), axis=-1, keepdims=True)  # [F, 1]
+        nu = spectral_degrees_of_freedom(self.kernel)
+        if nu is not None:  # Student-t radial scaling: sqrt(nu / chi2_nu)
+            g = tf.random.gamma([num_features, 1], alpha=nu / 2., beta=.5, dtype=dtype)
+            norms = norms * tf.sqrt(nu / g)
+        return directions * norms
+
+
+class QuasiMonteCarloFeaturesCosine(StructuredFeaturesCosine):
+    """
+    Frequencies from a scrambled Sobol sequence mapped through the inverse CDF of the spectral
+    density. For Matérn kernels one extra Sobol coordinate drives the chi-squared mixing variable
+    of the Student-t density.
+    """
+
+    def _sample_weights(self, shape: TensorType, dtype=None) -> TensorType:
+        num_features, input_dim = int(shape[0]), int(shape[1])
+        nu = spectral_degrees_of_freedom(self.kernel)
+        sobol_dim = input_dim if nu is None else input_dim + 1
+
+        sampler = qmc.Sobol(sobol_dim, scramble=True, seed=np.random.randint(2 ** 31))
+        u = sampler.random_base2(int(np.ceil(np.log2(num_features))))[:num_features]
+        u = np.clip(u, 1e-10, 1. - 1e-10)
+
+        weights = norm.ppf(u[:, :input_dim])
+        if nu is not None:
+            weights = weights * np.sqrt(nu / chi2.ppf(u[:, input_dim:], nu))
+        return tf.constant(weights, dtype=dtype)
+
+
+class ReducedPrecisionFeatures:
+    """
+    Mixin for cosine random features evaluating cos(X W' / l + b) in `feature_dtype`. This matmul
+    and the cosine are the expensive part of the features. Called as a layer, the result is cast
+    back to the dtype of the inputs, so that the feature matrices used by training, predictions and
+    Cholesky factorisations remain in double precision. :meth:`project` also computes the product
+    with the weights of a trajectory in `feature_dtype`, and only casts back its [N, 1] output.
+    """
+    feature_dtype = tf.float32
+
+    def _reduced_features(self, inputs: TensorType) -> tf.Tensor:
+        dtype = self.feature_dtype
+        X = tf.cast(inputs, dtype) / tf.cast(self.kernel.lengthscales, dtype)  # [N, D]
+        bases = tf.matmul(X, tf.cast(self.W, dtype), transpose_b=True) + tf.cast(self.b, dtype)  # [N, F]
+        const = tf.sqrt(2. * tf.cast(self.kernel.variance, dtype) / self.output_dim)
+        return const * tf.cos(bases)
+
+    def call(self, inputs: TensorType) -> tf.Tensor:
+        return tf.cast(self._reduced_features(inputs), inputs.dtype)
+
+    def project(self, inputs: TensorType, weights: TensorType) -> tf.Tensor:
+        if not self.built:  # W and b are only created on the first call
+            self.build(inputs.shape)
+        products = tf.matmul(self._reduced_features(inputs), tf.cast(weights, self.feature_dtype))  # [N, P]
+        return tf.cast(products, inputs.dtype)
+
+
+def with_feature_dtype(feature_class, dtype):
+    """ Subclass of `feature_class` that evaluates its features in `dtype`, e.g. `tf.float32`. """
+    if tf.as_dtype(dtype) == tf.float64:
+        return feature_class
+    return type(f"{feature_class.__name__}{tf.as_dtype(dtype).name.capitalize()}",
+                (ReducedPrecisionFeatures, feature_class), {"feature_dtype": tf.as_dtype(dtype)})
+
+
+def project_features(feature_functions, X: TensorType, weights: TensorType) -> tf.Tensor:
+    """ Φ(X) w [N, P] for weights [F, P], in the precision of the features (see ReducedPrecisionFeatures). """
+    if isinstance(feature_functions, ReducedPrecisionFeatures):
+        return feature_functions.project(X, weights)
+    return tf.matmul(feature_functions(X), weights)
+
+
+FEATURE_TYPES = {
+    "rff": RandomFourierFeaturesCosine,
+    "orf": OrthogonalRandomFeaturesCosine,
+    "qmc": QuasiMonteCarloFeaturesCosine,
+}
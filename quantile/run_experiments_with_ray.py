@@ -3,11 +3,12 @@ import numpy as np
 import os
 from run_quantile_problem import run_quantile_experiment
 from config import make_all_configs, make_config
+from problems import get_problem_data
 from trieste.observer import OBJECTIVE
 
 
-def run_single_experiment(config):
-    config = make_config(config)
+def run_single_experiment(config, problem_data=None):
+    config = make_config(config, problem_data=problem_data)
 
     try:
         # Create target Directory
@@ -16,7 +17,7 @@ def run_single_experiment(config):
     except FileExistsError:
         print("Directory ", config.dirName, " already exists")
 
-    ask_tell, best_x, best_y = run_quantile_experiment(config)
+    ask_tell, best_x, best_y, timings = run_quantile_experiment(config)
     X = ask_tell._datasets[OBJECTIVE].query_points.numpy()
     Y = ask_tell._datasets[OBJECTIVE].observations.numpy()
     experiment_name = config.exp_name
@@ -25,6 +26,7 @@ def run_single_experiment(config):
     np.save(f"{config.dirName}/{experiment_name}_best_x", best_x)
     np.save(f"{config.dirName}/{experiment_name}_best_y", best_y)
     np.save(f"{config.dirName}/{experiment_name}_regret", best_y - config.problem.minimum)
+    np.save(f"{config.dirName}/{experiment_name}_timings", timings)
 
     print(f"finished experiment {experiment_name}")
 
@@ -36,11 +38,11 @@ if __name__ == "__main__":
     ray.init(num_cpus=num_workers)
 
     @ray.remote
-    def run_single_experiment_with_ray(config):
+    def run_single_experiment_with_ray(config, problem_data):
         try:
-            run_single_experiment(config)
+            run_single_experiment(config, problem_data)
         except:
-            config = make_config(config)
+            config = make_config(config, problem_data=problem_data)
             experiment_name = config.exp_name
             print(f"failed experiment {experiment_name}")
 
@@ -49,8 +51,11 @@ if __name__ == "__main__":
 
     configs = make_all_configs()
 
+    # problem minima are estimated once here instead of in every task
+    problem_data = {name: ray.put(get_problem_data(name)) for name in set(c["problem_name"] for c in configs)}
+
     for config in configs:
-        worker = run_single_experiment_with_ray.remote(config)
+        worker = run_single_experiment_with_ray.remote(config, problem_data[config["problem_name"]])
         workers.append(worker)
 
     remaining_workers = workers
@@ -5,6 +5,9 @@ from trieste.ask_tell_optimization import AskTellOptimizer
 from model_utils import build_model
 from acquisition_utils import create_initial_query_points, create_acquisition_rule, extract_current_best_quantile
 from trieste.data import Dataset
+from profiling_utils import PhaseTimer
+from compilation_utils import compile_experiment
+from logging_utils import close_summary_writer
 
 
 def make_observer(CONFIG):
@@ -17,30 +20,51 @@ def make_observer(CONFIG):
         return lambda qp: Dataset(qp, CONFIG.problem.fun(qp))
 
 
+def instrument_model(model, timer):
+    timer.instrument(model, "optimize", "optimize")
+    timer.instrument(model, "update", "update")
+    selector = getattr(model, "_inducing_point_selector", None)
+    if selector is not None:
+        timer.instrument(selector, "get_points", "inducing_points")
+
+
 def run_quantile_experiment(CONFIG):
     np.random.seed(CONFIG.seed)
     tf.random.set_seed(CONFIG.seed)
+    timer = PhaseTimer(CONFIG.reset_host_peaks)  # iteration 0 is the set-up, then one record per BO iteration
 
-    observer = make_observer(CONFIG)
+    observer = timer.timed("observer", make_observer(CONFIG))
     search_space = trieste.space.Box(CONFIG.problem.lower_bounds, CONFIG.problem.upper_bounds)
     initial_query_points = create_initial_query_points(search_space, CONFIG)
     data = observer(initial_query_points)
-    model = build_model(data, CONFIG, search_space)
+    with timer.phase("build_model"):
+        model = build_model(data, CONFIG, search_space)
+    instrument_model(model, timer)
 
     acquisition_rule = create_acquisition_rule(CONFIG)
     ask_tell = AskTellOptimizer(search_space, data, model, acquisition_rule)
+    with timer.phase("compile"):
+        compile_experiment(CONFIG, ask_tell, search_space)
 
     num_iterations = np.int((CONFIG.budget - data.observations.shape[0]) / CONFIG.batch_size)
 
-    all_best_x = extract_current_best_quantile(ask_tell, CONFIG)
+    with timer.phase("best_point"):
+        all_best_x = extract_current_best_quantile(ask_tell, CONFIG)
 
     for iteration_count in range(num_iterations):
-        query_points = ask_tell.ask()
-        new_data = observer(query_points)
-        ask_tell.tell(new_data)
-        current_best_x = extract_current_best_quantile(ask_tell, CONFIG)
-        all_best_x = tf.concat([all_best_x, current_best_x], axis=0)
+        timer.next_iteration()
+        with timer.phase("iteration"):
+            with timer.phase("ask"):
+                query_points = ask_tell.ask()
+            new_data = observer(query_points)
+            with timer.phase("tell"):
+                ask_tell.tell(new_data)
+            with timer.phase("best_point"):
+                current_best_x = extract_current_best_quantile(ask_tell, CONFIG)
+            all_best_x = tf.concat([all_best_x, current_best_x], axis=0)
 
     # result = ask_tell.to_result()
+    close_summary_writer(CONFIG)
     all_best_y = CONFIG.problem.quantile_fun(all_best_x)
-    return ask_tell, all_best_x, all_best_y
+    return ask_tell, all_best_x, all_best_y, timer.to_array()
+
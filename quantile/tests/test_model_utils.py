@@ -0,0 +1,53 @@
+import numpy as np
+import gpflow
+import gpflux
+import tensorflow as tf
+import tensorflow_probability as tfp
+from gpflux.helpers import construct_basic_inducing_variables, construct_basic_kernel
+from trieste.data import Dataset
+
+from model_utils import ReplicatedLikelihoodLayer, create_kernel_with_features, group_replicates
+
+
+def _replicated_data(num_sites=15, max_replicates=5, seed=0):
+    rng = np.random.default_rng(seed)
+    sites = rng.random([num_sites, 2])
+    X = np.repeat(sites, rng.integers(1, max_replicates + 1, num_sites), axis=0)
+    X = X[rng.permutation(len(X))]
+    Y = np.sin(6 * X[:, :1]) + 0.1 * rng.standard_normal([len(X), 1])
+    return Dataset(tf.constant(X), tf.constant(Y))
+
+
+def test_group_replicates_keeps_every_observation_once():
+    data = _replicated_data()
+    unique_points, replicates, observations = group_replicates(data.query_points, data.observations)
+    offsets, counts = replicates.numpy().astype(int).T
+    assert counts.sum() == len(data)
+    np.testing.assert_array_equal(offsets, np.cumsum(counts) - counts)
+    for x, offset, count in zip(unique_points.numpy(), offsets, counts):
+        at_x = np.all(data.query_points.numpy() == x, axis=-1)
+        np.testing.assert_array_equal(observations.numpy()[offset:offset + count], data.observations.numpy()[at_x])
+
+
+def test_replicate_compressed_elbo_matches_uncompressed():
+    data = _replicated_data()
+    kernel = construct_basic_kernel([create_kernel_with_features(1., 2, 100) for _ in range(2)])
+    inducing_variable = construct_basic_inducing_variables(10, 2, output_dim=2, share_variables=True,
+                                                           z_init=data.query_points[:10])
+    layer = gpflux.layers.GPLayer(kernel, inducing_variable, len(data), whiten=True, num_latent_gps=2,
+                                  mean_function=gpflow.mean_functions.Zero())
+    layer.q_mu.assign(np.random.default_rng(1).standard_normal([10, 2]))
+    likelihood = gpflow.likelihoods.HeteroskedasticTFPConditional(distribution_class=tfp.distributions.Normal,
+                                                                 scale_transform=tfp.bijectors.Exp())
+
+    unique_points, replicates, observations = group_replicates(data.query_points, data.observations)
+    layer.num_data = len(unique_points)
+    compressed_gp = gpflux.models.DeepGP([layer], ReplicatedLikelihoodLayer(likelihood))
+    compressed_gp.likelihood_layer.observations.assign(observations)
+    compressed = compressed_gp.elbo((unique_points, replicates))
+
+    layer.num_data = len(data)
+    uncompressed_gp = gpflux.models.DeepGP([layer], gpflux.layers.LikelihoodLayer(likelihood))
+    uncompressed = uncompressed_gp.elbo(data.astuple())
+
+    np.testing.assert_allclose(compressed, uncompressed, rtol=1e-10)